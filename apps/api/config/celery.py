@@ -21,4 +21,9 @@ app.conf.beat_schedule = {
         'task': 'ingest.tasks.trigger_all_ingests',
         'schedule': crontab(minute='*/15'),
     },
+    'recompute-dirty-risk-scores': {
+        'task': 'safety.tasks.recompute_risk_scores_task',
+        # Offset from ingest so most runs have flagged their cells
+        'schedule': crontab(minute='10-59/15'),
+    },
 }
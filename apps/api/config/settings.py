@@ -138,6 +138,10 @@ STATIC_URL = "static/"
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# Ingest
+# Optional Socrata app token; raises the SODA API rate limits for incremental pulls.
+SOCRATA_APP_TOKEN = os.environ.get("SOCRATA_APP_TOKEN", "")
+
 # Caching
 CACHES = {
     "default": {
@@ -146,6 +150,16 @@ CACHES = {
     }
 }
 
+# Response cache TTLs (seconds) per endpoint. Entries are also dropped
+# explicitly when a recompute or ingest touches their cell; cached routes
+# are retired by each new scoring run instead.
+RESPONSE_CACHE_TTLS = {
+    "snapshot": 3600,
+    "context_incidents": 3600,
+    "context_alerts": 600,
+    "routes": 3600,
+}
+
 # REST Framework
 REST_FRAMEWORK = {
     "DEFAULT_RENDERER_CLASSES": [
@@ -157,3 +171,42 @@ REST_FRAMEWORK = {
 CORS_ALLOWED_ORIGINS = os.environ.get("CORS_ALLOWED_ORIGINS", "http://localhost:3000").split(",")
 CELERY_BROKER_URL = 'redis://redis:6379/1'
 CELERY_RESULT_BACKEND = 'redis://redis:6379/1'
+
+# Risk score recomputation
+# Number of Celery shards for a sharded rescore; cells are split by their H3 parent.
+RISK_RECOMPUTE_SHARDS = int(os.environ.get("RISK_RECOMPUTE_SHARDS", "8"))
+RISK_SHARD_RESOLUTION = 5
+
+# Heatmap
+# Max hexagons per GeoJSON heatmap response; larger views are truncated and paged.
+HEATMAP_MAX_FEATURES = int(os.environ.get("HEATMAP_MAX_FEATURES", "20000"))
+
+# Routing
+# Walking graphs are built offline from OSM PBF extracts (scripts/build_walk_graphs.py)
+# and loaded from ROUTING_GRAPH_DIR; routing never calls Overpass.
+ROUTING_GRAPH_DIR = Path(os.environ.get("ROUTING_GRAPH_DIR", BASE_DIR / "data" / "graphs"))
+ROUTING_METROS = {
+    "nyc": {
+        "pbf": os.environ.get("NYC_PBF_PATH", str(BASE_DIR / "data" / "osm" / "new-york-latest.osm.pbf")),
+        "bbox": (-74.27, 40.49, -73.68, 40.92),  # min_lng, min_lat, max_lng, max_lat
+    },
+}
+# Graphs are stored as tiles keyed by their H3 cell at this resolution;
+# each worker keeps recently used tiles in an LRU capped at ROUTING_TILE_CACHE_MB.
+ROUTING_TILE_RESOLUTION = 7
+ROUTING_TILE_CACHE_MB = int(os.environ.get("ROUTING_TILE_CACHE_MB", "256"))
+# Safety weightings (alpha) served from contraction hierarchies, for metros
+# built with --hierarchy; hierarchies are re-customized after each scoring run.
+# Other weightings (e.g. the rest of routing.ALTERNATIVE_ALPHAS) fall back to A*.
+ROUTING_CH_ALPHAS = (5.0,)
+# Per-request limits for routes outside a hierarchy: the largest start/end span
+# in degrees (0.5 covers cross-borough walks), the megabytes of memory one request's
+# graph may take (its tiles and every array built from them, see
+# graph_store.WORKING_SET_FACTOR), and the wall-clock time for loading, scoring and searching.
+ROUTING_MAX_SPAN_DEG = float(os.environ.get("ROUTING_MAX_SPAN_DEG", "0.5"))
+ROUTING_MAX_GRAPH_MB = int(os.environ.get("ROUTING_MAX_GRAPH_MB", "256"))
+ROUTING_TIME_BUDGET_S = float(os.environ.get("ROUTING_TIME_BUDGET_S", "10"))
+# Most alternative routes one routes/ request may ask for
+ROUTING_MAX_ALTERNATIVES = 5
+# Most origin/destination pairs in one routes/matrix/ request
+ROUTING_MATRIX_MAX_PAIRS = int(os.environ.get("ROUTING_MATRIX_MAX_PAIRS", "2500"))
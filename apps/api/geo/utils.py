@@ -1,4 +1,13 @@
+import math
 import h3
+import numpy as np
+from django.contrib.gis.geos import Polygon
+
+# Spherical Web Mercator (EPSG:3857) earth radius in meters
+EARTH_RADIUS_M = 6378137.0
+
+# Mean earth radius in meters, for great-circle distances
+MEAN_EARTH_RADIUS_M = 6371008.8
 
 def point_to_h3(lat: float, lng: float, resolution: int = 9) -> str:
     """
@@ -6,3 +15,54 @@ def point_to_h3(lat: float, lng: float, resolution: int = 9) -> str:
     Resolution 9 is approx 0.1km^2 (hex edge ~174m).
     """
     return h3.latlng_to_cell(lat, lng, resolution)
+
+def points_to_h3(lats, lngs, resolution: int = 9) -> np.ndarray:
+    """
+    H3 indexes for arrays of points, as an object array of strings.
+    h3-py converts one point per call, so repeated coordinates (common in
+    incident data geocoded to intersections) are converted only once.
+    """
+    points = np.column_stack([np.asarray(lats, dtype=np.float64), np.asarray(lngs, dtype=np.float64)])
+    if len(points) == 0:
+        return np.array([], dtype=object)
+    unique, inverse = np.unique(points, axis=0, return_inverse=True)
+    cells = np.array([h3.latlng_to_cell(lat, lng, resolution) for lat, lng in unique.tolist()], dtype=object)
+    return cells[inverse.reshape(-1)]
+
+def h3_to_polygon(h3_id: str) -> Polygon:
+    """
+    Hexagon boundary of an H3 cell as a closed GEOS polygon (lng/lat, SRID 4326).
+    """
+    # h3-py v4 returns (lat, lng) tuples. GeoJSON/GEOS need (lng, lat).
+    ring = [(lng, lat) for lat, lng in h3.cell_to_boundary(h3_id)]
+    ring.append(ring[0])
+    return Polygon(ring, srid=4326)
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    Bounds of an XYZ web map tile as (west, south, east, north) in degrees.
+    """
+    n = 2 ** z
+
+    def lat_for(tile_y):
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * tile_y / n))))
+
+    west = x / n * 360.0 - 180.0
+    east = (x + 1) / n * 360.0 - 180.0
+    return west, lat_for(y + 1), east, lat_for(y)
+
+def lnglat_to_mercator(lng: float, lat: float) -> tuple:
+    """
+    Project a lng/lat point to Web Mercator meters.
+    """
+    x = EARTH_RADIUS_M * math.radians(lng)
+    y = EARTH_RADIUS_M * math.log(math.tan(math.pi / 4 + math.radians(lat) / 2))
+    return x, y
+
+def haversine_m(lat1, lng1, lat2, lng2):
+    """
+    Great-circle distance in meters. Accepts scalars or NumPy arrays.
+    """
+    lat1, lng1, lat2, lng2 = map(np.radians, (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * MEAN_EARTH_RADIUS_M * np.arcsin(np.sqrt(a))
@@ -1,13 +1,105 @@
 from abc import ABC, abstractmethod
 from typing import List, Dict, Any
+import hashlib
+import os
+import tempfile
 import logging
+import requests
 from ..models import DataSource, AlertItem
 
 logger = logging.getLogger(__name__)
 
+class SourceUnchanged(Exception):
+    """The source returned 304 Not Modified, or the same content as last run."""
+
+def alert_key(item_data: Dict[str, Any]) -> str:
+    """
+    Natural key of a parsed alert within its source: the feed's external_id
+    when it has one, else a sha256 of its title and publish time.
+    """
+    if item_data.get('external_id'):
+        return item_data['external_id']
+    return content_key(item_data)
+
+def content_key(item_data: Dict[str, Any]) -> str:
+    """sha256 of an alert's title and publish time, the key alerts were first deduplicated by."""
+    content = f"{item_data.get('title')}|{item_data.get('published_at')}"
+    return hashlib.sha256(content.encode()).hexdigest()
+
 class BaseConnector(ABC):
     def __init__(self, source: DataSource):
         self.source = source
+        # H3 cells whose scoring inputs (incidents, env metrics) changed this run
+        self.dirty_cells = set()
+        # H3 cells that gained alerts this run (no rescoring, but cached responses are stale)
+        self.alert_cells = set()
+        # ETag / Last-Modified / content hash of this run's download, and the
+        # highest watermark value it loaded; saved once the run succeeds
+        self.validators = {}
+        self.watermark = None
+
+    def mark_dirty(self, *h3_ids: str):
+        """Record cells that need rescoring after this run."""
+        self.dirty_cells.update(h3_ids)
+
+    def mark_alerts(self, *h3_ids: str):
+        """Record cells whose alerts changed this run."""
+        self.alert_cells.update(h3_ids)
+
+    def conditional_fetch(self, to_file=False, headers=None, **kwargs):
+        """
+        GETs the source URL, sending the ETag and Last-Modified saved by the
+        last successful run. Returns the body as bytes, or with to_file the
+        path of a temp file it was streamed to (caller removes it).
+        Raises SourceUnchanged on 304, or when the body hashes the same as
+        last time (servers without validators, or with volatile ones).
+        """
+        headers = dict(headers or {})
+        if self.source.etag:
+            headers['If-None-Match'] = self.source.etag
+        if self.source.last_modified:
+            headers['If-Modified-Since'] = self.source.last_modified
+
+        digest = hashlib.sha256()
+        with requests.get(self.source.url, headers=headers, stream=True, **kwargs) as r:
+            if r.status_code == 304:
+                raise SourceUnchanged(f"{self.source.slug}: 304 Not Modified")
+            r.raise_for_status()
+
+            if to_file:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as f:
+                    for chunk in r.iter_content(chunk_size=65536):
+                        digest.update(chunk)
+                        f.write(chunk)
+                body = f.name
+            else:
+                body = r.content
+                digest.update(body)
+
+            self.validators = {
+                'etag': r.headers.get('ETag', ''),
+                'last_modified': r.headers.get('Last-Modified', ''),
+                'content_sha256': digest.hexdigest()
+            }
+
+        if self.validators['content_sha256'] == self.source.content_sha256:
+            if to_file:
+                os.remove(body)
+            # Same content: keep any new validators so the next request can get a 304
+            self.save_source_state()
+            raise SourceUnchanged(f"{self.source.slug}: content unchanged (sha256 match)")
+        return body
+
+    def save_source_state(self):
+        """Stores this run's validators and watermark on the source."""
+        state = dict(self.validators)
+        if self.watermark is not None:
+            state['watermark'] = self.watermark
+        if not state:
+            return
+        DataSource.objects.filter(pk=self.source.pk).update(**state)
+        for field, value in state.items():
+            setattr(self.source, field, value)
 
     @abstractmethod
     def fetch(self) -> Any:
@@ -25,35 +117,43 @@ class BaseConnector(ABC):
         try:
             raw_data = self.fetch()
             items = self.parse(raw_data)
-            count = 0
-            for item in items:
-                if self.save_item(item):
-                    count += 1
-            return count
+            return self.save_items(items)
+        except SourceUnchanged:
+            raise
         except Exception as e:
             logger.error(f"Error ingesting {self.source.name}: {e}")
             raise e
 
-    def save_item(self, item_data: Dict[str, Any]) -> bool:
-        """Save a parsed item to the DB, creating if not exists based on source+h3+time or other unique key."""
-        # For AlertItems, uniqueness logic depends on the source.
-        # This generic saver assumes 'h3_id' and 'published_at' are key, but
-        # usually we want a unique ID from the feed (e.g. guid).
-        # For this step, we'll keep it simple: dedupe by duplicate fields if possible
-        # or just create. A real impl would check a unique ID.
-
-        # Dedupe check (simple):
-        exists = AlertItem.objects.filter(
-            source=self.source,
-            title=item_data.get('title'),
-            published_at=item_data.get('published_at')
-        ).exists()
-
-        if exists:
-            return False
-
-        AlertItem.objects.create(
-            source=self.source,
-            **item_data
+    def save_items(self, items: List[Dict[str, Any]]) -> int:
+        """
+        Saves parsed alert items as one batch, keyed by alert_key. Keys this
+        source already has are fetched into a set with one query and skipped;
+        the rest go in with one bulk_create, whose ignore_conflicts covers a
+        concurrent run inserting the same key. Returns the number of new items.
+
+        Alerts stored before external_id existed were backfilled with their
+        content_key (migration 0005), which differs from the feed id now used
+        for most items, so an item whose content_key is stored is skipped too.
+        """
+        alerts = {}
+        for item_data in items:
+            item_data = dict(item_data)
+            key = alert_key(item_data)
+            item_data.pop('external_id', None)
+            # First occurrence wins when a feed repeats an item
+            alerts.setdefault(key, (content_key(item_data), AlertItem(source=self.source, external_id=key, **item_data)))
+
+        existing = set(
+            AlertItem.objects.filter(
+                source=self.source,
+                external_id__in=[*alerts, *(legacy for legacy, _ in alerts.values())]
+            ).values_list('external_id', flat=True)
         )
-        return True
+        new_alerts = [
+            alert for key, (legacy, alert) in alerts.items()
+            if key not in existing and legacy not in existing
+        ]
+        AlertItem.objects.bulk_create(new_alerts, batch_size=1000, ignore_conflicts=True)
+
+        self.mark_alerts(*{alert.h3_id for alert in new_alerts if alert.h3_id})
+        return len(new_alerts)
@@ -1,216 +1,127 @@
 import pandas as pd
-import requests
-import tempfile
-import shutil
+import numpy as np
 import os
 import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
 from django.utils import timezone
 from .base import BaseConnector
-from geo.utils import point_to_h3
+from geo.utils import points_to_h3
+from ingest.loader import BulkLoader, ENV_FIELDS, INCIDENT_FIELDS, point_ewkb
+from ingest.normalization import normalize_incident
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SIZE = 5000
+
+# Rows outside this box are geocoding outliers ((0, 0) etc.)
+# NYC is roughly Lat 40..41, Lng -74..-73
+NYC_BOUNDS = (40.0, 42.0, -75.0, -72.0)  # min_lat, max_lat, min_lng, max_lng
+
+# Expanded Centroid Map for NY State (ny-state-index has no Lat/Lng)
+# Format: 'COUNTY': (Lat, Lng, LatSpread, LngSpread)
+# Default Spread: 0.15 (~15-20km)
+NY_COUNTY_CENTROIDS = {
+    'ALBANY': (42.65, -73.75, 0.15, 0.20),
+    'ALLEGANY': (42.25, -78.02, 0.2, 0.3),
+    'BROOME': (42.15, -75.83, 0.2, 0.3),
+    'CATTARAUGUS': (42.24, -78.67, 0.2, 0.3),
+    'CAYUGA': (42.94, -76.56, 0.25, 0.15),
+    'CHAUTAUQUA': (42.30, -79.40, 0.2, 0.3),
+    'CHEMUNG': (42.14, -76.80, 0.15, 0.2),
+    'CHENANGO': (42.49, -75.61, 0.2, 0.2),
+    'CLINTON': (44.75, -73.56, 0.3, 0.3),
+    'COLUMBIA': (42.25, -73.68, 0.25, 0.2),
+    'CORTLAND': (42.60, -76.17, 0.15, 0.15),
+    'DELAWARE': (42.19, -74.96, 0.3, 0.3),
+    'DUTCHESS': (41.76, -73.74, 0.25, 0.25),
+    'ERIE': (42.8864, -78.8784, 0.2, 0.2),
+    'ESSEX': (44.11, -73.68, 0.3, 0.3),
+    'FRANKLIN': (44.60, -74.30, 0.3, 0.3),
+    'FULTON': (43.11, -74.43, 0.15, 0.2),
+    'GENESEE': (43.00, -78.19, 0.15, 0.2),
+    'GREENE': (42.27, -74.05, 0.2, 0.25),
+    'HAMILTON': (43.50, -74.40, 0.4, 0.3), # Huge county
+    'HERKIMER': (43.42, -74.96, 0.4, 0.2), # Long N-S
+    'JEFFERSON': (44.02, -75.98, 0.3, 0.3),
+    'LEWIS': (43.78, -75.45, 0.3, 0.2),
+    'LIVINGSTON': (42.72, -77.85, 0.2, 0.2),
+    'MADISON': (42.90, -75.67, 0.2, 0.2),
+    'MONROE': (43.1566, -77.6088, 0.15, 0.2),
+    'MONTGOMERY': (42.93, -74.42, 0.1, 0.2),
+    'NASSAU': (40.7300, -73.7000, 0.1, 0.15),
+    'NIAGARA': (43.20, -78.96, 0.15, 0.2),
+    'ONEIDA': (43.209, -75.452, 0.3, 0.3),
+    'ONONDAGA': (43.0481, -76.1474, 0.2, 0.2),
+    'ONTARIO': (42.85, -77.28, 0.2, 0.2),
+    'ORANGE': (41.40, -74.30, 0.2, 0.25),
+    'ORLEANS': (43.24, -78.19, 0.15, 0.2),
+    'OSWEGO': (43.45, -76.11, 0.2, 0.25),
+    'OTSEGO': (42.63, -75.05, 0.2, 0.25),
+    'PUTNAM': (41.42, -73.65, 0.1, 0.15),
+    'RENSSELAER': (42.71, -73.57, 0.2, 0.15),
+    'ROCKLAND': (41.15, -74.05, 0.1, 0.1),
+    'SARATOGA': (43.03, -73.79, 0.2, 0.2),
+    'SCHENECTADY': (42.81, -73.94, 0.1, 0.1),
+    'SCHOHARIE': (42.60, -74.44, 0.2, 0.2),
+    'SCHUYLER': (42.39, -76.87, 0.15, 0.15),
+    'SENECA': (42.78, -76.82, 0.2, 0.1),
+    'STEUBEN': (42.34, -77.30, 0.3, 0.3),
+    'ST LAWRENCE': (44.60, -75.14, 0.4, 0.5), # Massive
+    'SUFFOLK': (40.8500, -73.0000, 0.15, 0.6), # Very Long E-W
+    'SULLIVAN': (41.77, -74.76, 0.25, 0.25),
+    'TIOGA': (42.12, -76.32, 0.15, 0.2),
+    'TOMPKINS': (42.44, -76.50, 0.15, 0.15),
+    'ULSTER': (41.85, -74.14, 0.3, 0.3),
+    'WARREN': (43.50, -73.78, 0.3, 0.25),
+    'WASHINGTON': (43.32, -73.43, 0.4, 0.15), # Long N-S
+    'WAYNE': (43.20, -77.04, 0.15, 0.3),
+    'WESTCHESTER': (41.1220, -73.7949, 0.2, 0.15),
+    'WYOMING': (42.70, -78.08, 0.2, 0.2),
+    'YATES': (42.66, -77.10, 0.15, 0.15)
+}
+
 class CSVConnector(BaseConnector):
+    """
+    Loads large CSV exports (NYPD complaints, 311 street lights, NY State
+    index crimes) a pandas chunk at a time. Each chunk is processed as
+    columns: NumPy masks drop bad coordinates, H3 ids and categories are
+    computed per distinct value. The resulting row tuples of the whole file
+    are streamed into the database through one BulkLoader COPY.
+    """
+
     def fetch(self):
-        # Stream download to temp file to handle large/gzipped files
-        with requests.get(self.source.url, stream=True) as r:
-            r.raise_for_status()
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".csv") as f:
-                for chunk in r.iter_content(chunk_size=8192):
-                    f.write(chunk)
-                return f.name
+        # Stream download to temp file to handle large/gzipped files;
+        # raises SourceUnchanged if the dataset has not changed since last run
+        return self.conditional_fetch(to_file=True)
 
     def parse(self, content):
         pass
 
+    def layout(self):
+        """(build, loader) for this source's rows, or None if it has no known layout."""
+        from ingest.models import IncidentNorm, EnvMetric
+
+        if self.source.slug == 'ny-state-index':
+            # ny-state-index doesn't need date parsing (Year column is int)
+            return self.state_index_rows, BulkLoader(IncidentNorm, INCIDENT_FIELDS)
+        if self.source.type == 'crime_history':
+            return self.incident_rows, BulkLoader(IncidentNorm, INCIDENT_FIELDS)
+        if self.source.type == 'environment':
+            return self.env_rows, BulkLoader(EnvMetric, ENV_FIELDS)
+        logger.warning(f"No CSV layout for {self.source.slug} (type: {self.source.type})")
+        return None
+
     def run(self):
-        local_csv_path = self.fetch()
-        count = 0
-        CHUNK_SIZE = 5000
+        layout = self.layout()
+        if layout is None:
+            return 0
+        build, loader = layout
 
+        local_csv_path = self.fetch()
         try:
-            date_col_args = {}
-            is_crime = self.source.type == 'crime_history'
-            is_env = self.source.type == 'environment'
-
-            if is_crime and self.source.slug == 'nyc-nypd-ytd':
-                # 'CMPLNT_FR_DT' input format is MM/DD/YYYY, 'CMPLNT_FR_TM' is HH:MM:SS
-                # Pandas parse_dates with list of lists combines them column-wise
-                date_col_args = {'parse_dates': {'occurred_at': ['CMPLNT_FR_DT', 'CMPLNT_FR_TM']}, 'keep_date_col': True}
-            elif is_env and 'light' in self.source.slug:
-                date_col_args = {'parse_dates': ['Created Date']}
-
-            # ny-state-index doesn't need parse_dates at read time (Year column is int)
-
-            for chunk in pd.read_csv(local_csv_path, chunksize=CHUNK_SIZE, **date_col_args, on_bad_lines='skip'):
-                for _, row in chunk.iterrows():
-                    try:
-                        # Special logic for NY State Aggregated Data (No Lat/Lng in source)
-                        if self.source.slug == 'ny-state-index':
-                             county = str(row.get('County', '')).upper()
-                             # Expanded Centroid Map for NY State
-                             # Format: 'COUNTY': (Lat, Lng, LatSpread, LngSpread)
-                             # Default Spread: 0.15 (~15-20km)
-                             county_map = {
-                                'ALBANY': (42.65, -73.75, 0.15, 0.20),
-                                'ALLEGANY': (42.25, -78.02, 0.2, 0.3),
-                                'BROOME': (42.15, -75.83, 0.2, 0.3),
-                                'CATTARAUGUS': (42.24, -78.67, 0.2, 0.3),
-                                'CAYUGA': (42.94, -76.56, 0.25, 0.15),
-                                'CHAUTAUQUA': (42.30, -79.40, 0.2, 0.3),
-                                'CHEMUNG': (42.14, -76.80, 0.15, 0.2),
-                                'CHENANGO': (42.49, -75.61, 0.2, 0.2),
-                                'CLINTON': (44.75, -73.56, 0.3, 0.3),
-                                'COLUMBIA': (42.25, -73.68, 0.25, 0.2),
-                                'CORTLAND': (42.60, -76.17, 0.15, 0.15),
-                                'DELAWARE': (42.19, -74.96, 0.3, 0.3),
-                                'DUTCHESS': (41.76, -73.74, 0.25, 0.25),
-                                'ERIE': (42.8864, -78.8784, 0.2, 0.2),
-                                'ESSEX': (44.11, -73.68, 0.3, 0.3),
-                                'FRANKLIN': (44.60, -74.30, 0.3, 0.3),
-                                'FULTON': (43.11, -74.43, 0.15, 0.2),
-                                'GENESEE': (43.00, -78.19, 0.15, 0.2),
-                                'GREENE': (42.27, -74.05, 0.2, 0.25),
-                                'HAMILTON': (43.50, -74.40, 0.4, 0.3), # Huge county
-                                'HERKIMER': (43.42, -74.96, 0.4, 0.2), # Long N-S
-                                'JEFFERSON': (44.02, -75.98, 0.3, 0.3),
-                                'LEWIS': (43.78, -75.45, 0.3, 0.2),
-                                'LIVINGSTON': (42.72, -77.85, 0.2, 0.2),
-                                'MADISON': (42.90, -75.67, 0.2, 0.2),
-                                'MONROE': (43.1566, -77.6088, 0.15, 0.2),
-                                'MONTGOMERY': (42.93, -74.42, 0.1, 0.2),
-                                'NASSAU': (40.7300, -73.7000, 0.1, 0.15),
-                                'NIAGARA': (43.20, -78.96, 0.15, 0.2),
-                                'ONEIDA': (43.209, -75.452, 0.3, 0.3),
-                                'ONONDAGA': (43.0481, -76.1474, 0.2, 0.2),
-                                'ONTARIO': (42.85, -77.28, 0.2, 0.2),
-                                'ORANGE': (41.40, -74.30, 0.2, 0.25),
-                                'ORLEANS': (43.24, -78.19, 0.15, 0.2),
-                                'OSWEGO': (43.45, -76.11, 0.2, 0.25),
-                                'OTSEGO': (42.63, -75.05, 0.2, 0.25),
-                                'PUTNAM': (41.42, -73.65, 0.1, 0.15),
-                                'RENSSELAER': (42.71, -73.57, 0.2, 0.15),
-                                'ROCKLAND': (41.15, -74.05, 0.1, 0.1),
-                                'SARATOGA': (43.03, -73.79, 0.2, 0.2),
-                                'SCHENECTADY': (42.81, -73.94, 0.1, 0.1),
-                                'SCHOHARIE': (42.60, -74.44, 0.2, 0.2),
-                                'SCHUYLER': (42.39, -76.87, 0.15, 0.15),
-                                'SENECA': (42.78, -76.82, 0.2, 0.1),
-                                'STEUBEN': (42.34, -77.30, 0.3, 0.3),
-                                'ST LAWRENCE': (44.60, -75.14, 0.4, 0.5), # Massive
-                                'SUFFOLK': (40.8500, -73.0000, 0.15, 0.6), # Very Long E-W
-                                'SULLIVAN': (41.77, -74.76, 0.25, 0.25),
-                                'TIOGA': (42.12, -76.32, 0.15, 0.2),
-                                'TOMPKINS': (42.44, -76.50, 0.15, 0.15),
-                                'ULSTER': (41.85, -74.14, 0.3, 0.3),
-                                'WARREN': (43.50, -73.78, 0.3, 0.25),
-                                'WASHINGTON': (43.32, -73.43, 0.4, 0.15), # Long N-S
-                                'WAYNE': (43.20, -77.04, 0.15, 0.3),
-                                'WESTCHESTER': (41.1220, -73.7949, 0.2, 0.15),
-                                'WYOMING': (42.70, -78.08, 0.2, 0.2),
-                                'YATES': (42.66, -77.10, 0.15, 0.15)
-                             }
-
-                             data = county_map.get(county)
-                             if not data:
-                                 continue
-
-                             base_lat, base_lng, s_lat, s_lng = data
-
-                             import random
-                             # Apply specific spread
-                             lat = base_lat + random.uniform(-s_lat, s_lat)
-                             lng = base_lng + random.uniform(-s_lng, s_lng)
-
-                             h3_id = point_to_h3(lat, lng)
-
-                             count_val = row.get('Index Total', 0)
-                             if pd.isna(count_val) or count_val == 0:
-                                 continue
-
-                             year = row.get('Year')
-                             # Default to Jan 1st of that year if valid
-                             try:
-                                 occurrence = timezone.datetime(int(year), 1, 1, tzinfo=timezone.utc)
-                                 # Add extensive random time jitter so trending charts look real-ish
-                                 # Spread across the year
-                                 day_offset = random.randint(0, 364)
-                                 occurrence = occurrence + timezone.timedelta(days=day_offset)
-                             except:
-                                 occurrence = timezone.now()
-
-                             self.save_item(
-                                 model='incident',
-                                 category='aggregated_index_crime',
-                                 severity=5,
-                                 occurred_at=occurrence,
-                                 geom_lat=lat,
-                                 geom_lng=lng,
-                                 h3_id=h3_id
-                             )
-                             count += 1
-                             continue
-
-                        # Standard Flow (NYPD / Lights)
-                        lat = row.get('Latitude')
-                        lng = row.get('Longitude')
-
-                        # Fix: Check for NaN and Invalid Bounds (NYC Box)
-                        # NYC is roughly Lat 40..41, Lng -74..-73
-                        if pd.isna(lat) or pd.isna(lng):
-                            continue
-
-                        lat = float(lat)
-                        lng = float(lng)
-
-                        if lat < 40.0 or lat > 42.0 or lng < -75.0 or lng > -72.0:
-                            # Skip outliers (0,0) etc.
-                            continue
-
-                        h3_id = point_to_h3(lat, lng)
-
-                        if is_crime:
-                            # Normalize Crime
-                            raw_category = str(row.get('OFNS_DESC', '')).strip()
-                            norm_data = normalize_incident(raw_category, 'nyc_nypd')
-                            if not norm_data:
-                                continue
-
-                            occ = row.get('occurred_at')
-                            if pd.isna(occ):
-                                continue
-
-                            self.save_item(
-                                model='incident',
-                                category=norm_data['category'],
-                                severity=norm_data['severity'],
-                                occurred_at=occ,
-                                geom_lat=lat,
-                                geom_lng=lng,
-                                h3_id=h3_id
-                            )
-                            count += 1
-
-                        elif is_env:
-                             # Env Logic
-                             created = row.get('Created Date')
-                             if pd.isna(created):
-                                 created = timezone.now()
-
-                             self.save_item(
-                                 model='env',
-                                 metric='street_light_outage',
-                                 value=1.0,
-                                 ts=created,
-                                 h3_id=h3_id,
-                                 geom_lat=lat,
-                                 geom_lng=lng
-                             )
-                             count += 1
-
-                    except Exception as e:
-                        # logger.warning(f"Row error: {e}")
-                        continue
+            chunks = pd.read_csv(local_csv_path, chunksize=CHUNK_SIZE, on_bad_lines='skip')
+            stats = loader.load(self.rows(chunks, build))
+            count = stats['rows']
 
         except Exception as e:
             logger.error(f"Ingest failed for {self.source.slug}")
@@ -221,28 +132,115 @@ class CSVConnector(BaseConnector):
 
         return count
 
-    def save_item(self, **kwargs):
-        from ingest.models import IncidentNorm, EnvMetric
-        from django.contrib.gis.geos import Point
-
-        target_model = kwargs.get('model')
-        geom = Point(float(kwargs['geom_lng']), float(kwargs['geom_lat']))
-
-        if target_model == 'incident':
-            IncidentNorm.objects.create(
-                source=self.source,
-                category=kwargs['category'],
-                severity=kwargs['severity'],
-                occurred_at=kwargs['occurred_at'],
-                h3_id=kwargs['h3_id'],
-                geom=geom
-            )
-        elif target_model == 'env':
-            EnvMetric.objects.create(
-                source=self.source,
-                metric=kwargs['metric'],
-                value=kwargs['value'],
-                ts=kwargs['ts'],
-                h3_id=kwargs['h3_id'],
-                geom=geom
-            )
+    def rows(self, chunks, build):
+        """Row tuples of every DataFrame chunk, flagging their cells dirty as they go."""
+        for chunk in chunks:
+            rows = build(chunk)
+            # h3_id is the second to last field of both layouts
+            self.mark_dirty(*{row[-2] for row in rows})
+            yield from rows
+
+    def coordinates(self, chunk):
+        """(mask, lat, lng) of the rows with numeric coordinates inside NYC_BOUNDS."""
+        lat = pd.to_numeric(chunk['Latitude'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        lng = pd.to_numeric(chunk['Longitude'], errors='coerce').to_numpy(dtype=np.float64, na_value=np.nan)
+        min_lat, max_lat, min_lng, max_lng = NYC_BOUNDS
+        # NaN compares False, so missing coordinates fail the box test too
+        mask = (lat >= min_lat) & (lat <= max_lat) & (lng >= min_lng) & (lng <= max_lng)
+        return mask, lat, lng
+
+    def incident_rows(self, chunk):
+        """INCIDENT_FIELDS tuples of a chunk of NYPD complaints."""
+        if not {'Latitude', 'Longitude', 'OFNS_DESC', 'CMPLNT_FR_DT', 'CMPLNT_FR_TM'}.issubset(chunk.columns):
+            return []
+        mask, lat, lng = self.coordinates(chunk)
+
+        # 'CMPLNT_FR_DT' input format is MM/DD/YYYY, 'CMPLNT_FR_TM' is HH:MM:SS
+        occurred_at = pd.to_datetime(
+            chunk['CMPLNT_FR_DT'].astype('string') + ' ' + chunk['CMPLNT_FR_TM'].astype('string'),
+            format='%m/%d/%Y %H:%M:%S', errors='coerce'
+        )
+        mask &= occurred_at.notna().to_numpy()
+
+        # Normalize each distinct offense once, then spread over the rows
+        raw_category = chunk['OFNS_DESC'].fillna('').astype(str).str.strip().to_numpy()
+        offenses, offense_index = np.unique(raw_category, return_inverse=True)
+        normalized = [normalize_incident(o, 'nyc_nypd') for o in offenses.tolist()]
+        known = np.array([n is not None for n in normalized])
+        categories = np.array([n['category'] if n else '' for n in normalized], dtype=object)
+        severities = np.array([n['severity'] if n else 0 for n in normalized], dtype=np.int64)
+        mask &= known[offense_index]
+
+        rows = np.flatnonzero(mask)
+        h3_ids = points_to_h3(lat[rows], lng[rows])
+        return list(zip(
+            [self.source.id] * len(rows),
+            categories[offense_index[rows]].tolist(),
+            severities[offense_index[rows]].tolist(),
+            occurred_at.iloc[rows].dt.to_pydatetime().tolist(),
+            h3_ids.tolist(),
+            map(point_ewkb, lng[rows].tolist(), lat[rows].tolist())
+        ))
+
+    def env_rows(self, chunk):
+        """ENV_FIELDS tuples of a chunk of street light outage reports."""
+        if not {'Latitude', 'Longitude'}.issubset(chunk.columns):
+            return []
+        mask, lat, lng = self.coordinates(chunk)
+        rows = np.flatnonzero(mask)
+
+        if 'Created Date' in chunk:
+            created = pd.to_datetime(chunk['Created Date'], errors='coerce').iloc[rows]
+        else:
+            created = pd.Series(pd.NaT, index=chunk.index[rows], dtype='datetime64[ns]')
+        now = timezone.now()
+        h3_ids = points_to_h3(lat[rows], lng[rows])
+        return list(zip(
+            [self.source.id] * len(rows),
+            ['street_light_outage'] * len(rows),
+            [1.0] * len(rows),
+            [now if pd.isna(ts) else ts for ts in created.dt.to_pydatetime().tolist()],
+            h3_ids.tolist(),
+            map(point_ewkb, lng[rows].tolist(), lat[rows].tolist())
+        ))
+
+    def state_index_rows(self, chunk):
+        """
+        INCIDENT_FIELDS tuples for NY State county index crime totals: one point
+        per county-year, scattered around the county centroid by its spread
+        and jittered across the year so trending charts look real-ish.
+        """
+        if not {'County', 'Index Total', 'Year'}.issubset(chunk.columns):
+            return []
+        centroids = chunk['County'].astype(str).str.upper().map(NY_COUNTY_CENTROIDS)
+        total = pd.to_numeric(chunk['Index Total'], errors='coerce').fillna(0)
+        year = pd.to_numeric(chunk['Year'], errors='coerce')
+        rows = np.flatnonzero((centroids.notna() & (total != 0)).to_numpy())
+        if len(rows) == 0:
+            return []
+
+        base_lat, base_lng, s_lat, s_lng = np.array(centroids.iloc[rows].tolist(), dtype=np.float64).T
+        rng = np.random.default_rng()
+        # Apply specific spread
+        lat = base_lat + rng.uniform(-s_lat, s_lat)
+        lng = base_lng + rng.uniform(-s_lng, s_lng)
+        h3_ids = points_to_h3(lat, lng)
+
+        # Jan 1st of the row's year (now if the year is invalid), spread across the year
+        years = year.iloc[rows].to_numpy(dtype=np.float64, na_value=np.nan)
+        now = timezone.now()
+        day_offsets = rng.integers(0, 365, size=len(rows)).tolist()
+        occurrences = [
+            datetime(int(y), 1, 1, tzinfo=dt_timezone.utc) + timedelta(days=d)
+            if 1 <= y <= 9999 else now
+            for y, d in zip(years.tolist(), day_offsets)
+        ]
+
+        return list(zip(
+            [self.source.id] * len(rows),
+            ['aggregated_index_crime'] * len(rows),
+            [5] * len(rows),
+            occurrences,
+            h3_ids.tolist(),
+            map(point_ewkb, lng.tolist(), lat.tolist())
+        ))
@@ -4,6 +4,7 @@ from django.utils import timezone
 from .base import BaseConnector
 from geo.utils import point_to_h3
 from geo.us_states import US_STATES_MAP, US_CITIES_MAP
+from ingest.loader import BulkLoader, INCIDENT_FIELDS, point_ewkb
 
 logger = logging.getLogger(__name__)
 
@@ -164,40 +165,31 @@ class FederalCrimeConnector(BaseConnector):
         logger.info(f"Starting Federal Baseline ingest for {self.source.slug}")
 
         # CLEAR OLD DATA for this baseline source to prevent doubling
-        deleted_count, _ = IncidentNorm.objects.filter(source=self.source).delete()
+        old_data = IncidentNorm.objects.filter(source=self.source)
+        self.mark_dirty(*old_data.values_list('h3_id', flat=True).distinct())
+        deleted_count, _ = old_data.delete()
         if deleted_count > 0:
             logger.info(f"Cleared {deleted_count} old records for {self.source.slug}")
 
         data = self.fetch()
         items = self.parse(data)
 
-        # Bulk Create Optimization?
-        # For ~10k items, bulk_create is much faster than loop .create()
-        # IncidentNorm.objects.bulk_create([IncidentNorm(...) for ...])
-        # But we need geospatial Point objects. Django GIS supports bulk_create.
-
-        objs = []
-        from django.contrib.gis.geos import Point
-
+        # Streamed through COPY (see ingest.loader); rows are tuples of INCIDENT_FIELDS
+        rows = []
         for item in items:
             # Resolution 7 (~5km edges) for State baselines creates visible regions
             # instead of tiny isolated dots (Res 9) when density is low.
             h3_id = point_to_h3(item['geom_lat'], item['geom_lng'], resolution=7)
-            geom = Point(float(item['geom_lng']), float(item['geom_lat']))
-
-            objs.append(IncidentNorm(
-                source=self.source,
-                category=item['category'],
-                severity=item['severity'],
-                occurred_at=item['occurred_at'],
-                h3_id=h3_id,
-                geom=geom
+            rows.append((
+                self.source.id,
+                item['category'],
+                item['severity'],
+                item['occurred_at'],
+                h3_id,
+                point_ewkb(float(item['geom_lng']), float(item['geom_lat']))
             ))
 
-        IncidentNorm.objects.bulk_create(objs, batch_size=1000)
-
-        return len(objs)
+        BulkLoader(IncidentNorm, INCIDENT_FIELDS).load(rows)
+        self.mark_dirty(*(row[4] for row in rows))
 
-    def save_item(self, item_data):
-        # Unused because we override run() for bulk efficiency
-        pass
+        return len(rows)
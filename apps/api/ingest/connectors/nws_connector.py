@@ -1,8 +1,8 @@
 
-import requests
+import json
 import logging
 from django.utils import timezone
-from .base import BaseConnector
+from .base import BaseConnector, SourceUnchanged
 from geo.utils import point_to_h3
 from geo.us_states import US_STATES_MAP
 from django.contrib.gis.geos import Point, Polygon
@@ -26,9 +26,9 @@ class NWSConnector(BaseConnector):
         }
 
         try:
-            resp = requests.get(self.source.url, headers=headers, timeout=10)
-            resp.raise_for_status()
-            return resp.json()
+            return json.loads(self.conditional_fetch(headers=headers, timeout=10))
+        except SourceUnchanged:
+            raise
         except Exception as e:
             logger.error(f"Failed to fetch NWS alerts from {self.source.url}: {e}")
             raise e
@@ -75,15 +75,9 @@ class NWSConnector(BaseConnector):
         logger.info(f"Starting NWS ingest for {self.source.slug}")
         data = self.fetch()
         items = self.parse(data)
-        count = 0
-
-        from ingest.models import AlertItem
+        alerts = []
 
         for item in items:
-            # Dedupe check
-            if AlertItem.objects.filter(source=self.source, url=item['url']).exists():
-                continue
-
             # Handle Geometry
             geo_data = item.pop('geometry')
 
@@ -121,19 +115,13 @@ class NWSConnector(BaseConnector):
             if lat == 0:
                 continue
 
-            # Remove external_id if present
-            item.pop('external_id', None)
+            # external_id (the NWS alert id) stays as the dedupe key
             item.pop('expires_at', None)
             item.pop('source_text', None)
 
-            h3_id = point_to_h3(lat, lng, resolution=7) # Use broader resolution (7) for alerts
-
-            AlertItem.objects.create(
-                source=self.source,
-                h3_id=h3_id,
-                geom=Point(lng, lat),
-                **item
-            )
-            count += 1
+            item['h3_id'] = point_to_h3(lat, lng, resolution=7) # Use broader resolution (7) for alerts
+            item['geom'] = Point(lng, lat)
+            alerts.append(item)
 
-        return count
+        # One query for the alert ids already stored, one insert for the rest
+        return self.save_items(alerts)
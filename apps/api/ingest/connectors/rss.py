@@ -11,8 +11,8 @@ logger = logging.getLogger(__name__)
 
 class RSSConnector(BaseConnector):
     def fetch(self):
-        # Using feedparser's remote fetch
-        return feedparser.parse(self.source.url)
+        # Download conditionally (SourceUnchanged if the feed is the same), then parse the bytes
+        return feedparser.parse(self.conditional_fetch(timeout=30))
 
     def parse(self, raw_data) -> list:
         items = []
@@ -33,6 +33,9 @@ class RSSConnector(BaseConnector):
             h3_id = point_to_h3(lat, lng)
 
             item = {
+                # The guid is the feed's stable id for the entry; links can change or be
+                # shared between entries. Without either, alert_key hashes title and time
+                "external_id": getattr(entry, 'id', '') or getattr(entry, 'link', ''),
                 "title": entry.title,
                 "summary": getattr(entry, 'summary', ''),
                 "published_at": published_at,
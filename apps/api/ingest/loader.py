@@ -0,0 +1,99 @@
+from django.db import connection, transaction
+import struct
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# EWKB header of a little-endian 2D point with an SRID
+EWKB_POINT_TYPE = 0x20000001
+
+# Row layouts shared by the connectors that load incidents and env metrics
+INCIDENT_FIELDS = ('source', 'category', 'severity', 'occurred_at', 'h3_id', 'geom')
+ENV_FIELDS = ('source', 'metric', 'value', 'ts', 'h3_id', 'geom')
+
+def point_ewkb(lng, lat, srid=4326):
+    """
+    Hex EWKB of a point, which PostGIS accepts as text input for geometry
+    columns. Avoids building a GEOS Point per row.
+    """
+    return struct.pack('<BIIdd', 1, EWKB_POINT_TYPE, srid, lng, lat).hex()
+
+class BulkLoader:
+    """
+    Loads rows into a model's table with COPY FROM STDIN (psycopg 3).
+
+    Rows are tuples of values for `fields` in order: foreign keys as ids,
+    geometries as hex EWKB (see point_ewkb). They are streamed into a
+    temporary staging table, then merged into the target with one
+    INSERT ... SELECT, all in one transaction, so a failed load leaves
+    nothing behind. auto_now / auto_now_add fields not in `fields` are
+    stamped with now(). With conflict_fields, rows that clash with an
+    existing one on them are skipped (ON CONFLICT DO NOTHING).
+    """
+
+    def __init__(self, model, fields, conflict_fields=None):
+        self.model = model
+        self.fields = [model._meta.get_field(name) for name in fields]
+        self.conflict_fields = [model._meta.get_field(name) for name in conflict_fields or ()]
+        self.stamped = [
+            f for f in model._meta.concrete_fields
+            if (getattr(f, 'auto_now', False) or getattr(f, 'auto_now_add', False)) and f not in self.fields
+        ]
+
+    def statements(self):
+        """
+        SQL of a load, in order: create the staging table, COPY into it,
+        merge it into the table, drop it.
+        """
+        qn = connection.ops.quote_name
+        table = qn(self.model._meta.db_table)
+        staging = qn(f"{self.model._meta.db_table}_staging")
+        columns = ", ".join(qn(f.column) for f in self.fields)
+        target_columns = ", ".join([columns] + [qn(f.column) for f in self.stamped])
+        values = ", ".join([columns] + ["now()"] * len(self.stamped))
+        on_conflict = ""
+        if self.conflict_fields:
+            on_conflict = f" ON CONFLICT ({', '.join(qn(f.column) for f in self.conflict_fields)}) DO NOTHING"
+
+        return (
+            # Only the loaded columns, without the target's constraints or identity
+            f"CREATE TEMPORARY TABLE {staging} ON COMMIT DROP AS SELECT {columns} FROM {table} WITH NO DATA",
+            f"COPY {staging} ({columns}) FROM STDIN",
+            f"INSERT INTO {table} ({target_columns}) SELECT {values} FROM {staging}{on_conflict}",
+            # Dropped now rather than at commit, in case this runs inside an outer transaction
+            f"DROP TABLE {staging}"
+        )
+
+    def load(self, rows):
+        """
+        Streams an iterable of tuples into the table.
+        Returns {"rows": copied, "inserted": merged, "seconds", "rows_per_second"}.
+        """
+        create, copy_sql, insert, drop = self.statements()
+
+        started = time.monotonic()
+        copied = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(create)
+            with cursor.cursor.copy(copy_sql) as copy:
+                for row in rows:
+                    copy.write_row(row)
+                    copied += 1
+
+            cursor.execute(insert)
+            inserted = cursor.rowcount
+            cursor.execute(drop)
+
+        seconds = time.monotonic() - started
+        rate = copied / seconds if seconds > 0 else 0.0
+        logger.info(
+            f"Loaded {copied} rows into {self.model._meta.db_table} "
+            f"({inserted} inserted) in {seconds:.1f}s, {rate:,.0f} rows/s"
+        )
+        return {
+            "rows": copied,
+            "inserted": inserted,
+            "seconds": round(seconds, 3),
+            "rows_per_second": round(rate)
+        }
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DirtyCell',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('h3_id', models.CharField(max_length=15)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dirty_cells', to='ingest.ingestrun')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['processed_at', 'h3_id'], name='ingest_dirt_process_e91a75_idx')],
+                'unique_together': {('run', 'h3_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0002_dirtycell'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='content_sha256',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='etag',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='last_modified',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AlterField(
+            model_name='ingestrun',
+            name='status',
+            field=models.CharField(choices=[('running', 'Running'), ('success', 'Success'), ('failed', 'Failed'), ('unchanged', 'Unchanged')], default='running', max_length=20),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0003_conditional_fetch'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='datasource',
+            name='connector',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='watermark',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='datasource',
+            name='watermark_field',
+            field=models.CharField(blank=True, max_length=64),
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:38
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def backfill_external_id(apps, schema_editor):
+    """
+    Keys existing alerts the way they were deduplicated before: NWS alerts by
+    URL (the NWS alert id, which is still their external_id), every other
+    source by title and publish time, stored as the sha256 content_key that
+    BaseConnector.save_items also checks. RSS guids were never stored, so
+    this is what lets the next run recognise the entries already in the
+    feed. Only the first row per source and key is set, for the constraint.
+    """
+    AlertItem = apps.get_model('ingest', 'AlertItem')
+    seen = set()
+    batch = []
+    alerts = (
+        AlertItem.objects.select_related('source')
+        .only('id', 'url', 'title', 'published_at', 'source__slug', 'source__connector')
+        .order_by('id')
+    )
+    for alert in alerts.iterator(chunk_size=2000):
+        # Same test ingest_source uses to pick NWSConnector
+        if alert.source.connector == 'nws' or alert.source.slug.endswith('-alerts'):
+            key = alert.url
+        else:
+            key = hashlib.sha256(f"{alert.title}|{alert.published_at}".encode()).hexdigest()
+        if not key or (alert.source_id, key) in seen:
+            continue
+        seen.add((alert.source_id, key))
+        alert.external_id = key
+        batch.append(alert)
+        if len(batch) >= 1000:
+            AlertItem.objects.bulk_update(batch, ['external_id'])
+            batch = []
+    AlertItem.objects.bulk_update(batch, ['external_id'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingest', '0004_incremental_sources'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='alertitem',
+            name='external_id',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.RunPython(backfill_external_id, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='alertitem',
+            constraint=models.UniqueConstraint(fields=('source', 'external_id'), name='unique_alert_per_source'),
+        ),
+    ]
@@ -11,7 +11,16 @@ class DataSource(models.Model):
     slug = models.SlugField(unique=True)
     type = models.CharField(max_length=50, choices=SourceType.choices)
     url = models.URLField(blank=True)
+    connector = models.CharField(max_length=50, blank=True)
     is_active = models.BooleanField(default=True)
+    # Incremental (socrata) sources: the field rows are pulled in order of,
+    # and its highest value loaded so far
+    watermark_field = models.CharField(max_length=64, blank=True)
+    watermark = models.CharField(max_length=64, blank=True)
+    # Validators of the last ingested download, for conditional fetches
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    content_sha256 = models.CharField(max_length=64, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -23,6 +32,7 @@ class IngestRun(models.Model):
         RUNNING = "running", _("Running")
         SUCCESS = "success", _("Success")
         FAILED = "failed", _("Failed")
+        UNCHANGED = "unchanged", _("Unchanged")
 
     source = models.ForeignKey(DataSource, on_delete=models.CASCADE, related_name="runs")
     status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
@@ -34,6 +44,25 @@ class IngestRun(models.Model):
     def __str__(self):
         return f"{self.source.slug} - {self.started_at}"
 
+    def record_dirty_cells(self, h3_ids):
+        """Flags the H3 cells this run inserted into or deleted from for rescoring."""
+        cells = [DirtyCell(run=self, h3_id=h3_id) for h3_id in set(h3_ids)]
+        DirtyCell.objects.bulk_create(cells, batch_size=5000, ignore_conflicts=True)
+        return len(cells)
+
+class DirtyCell(models.Model):
+    """H3 cell whose scoring inputs changed during an ingest run"""
+    run = models.ForeignKey(IngestRun, on_delete=models.CASCADE, related_name="dirty_cells")
+    h3_id = models.CharField(max_length=15)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['run', 'h3_id']
+        indexes = [
+            models.Index(fields=['processed_at', 'h3_id']),
+        ]
+
 class AlertItem(models.Model):
     source = models.ForeignKey(DataSource, on_delete=models.CASCADE)
     title = models.CharField(max_length=500)
@@ -44,12 +73,18 @@ class AlertItem(models.Model):
     severity = models.IntegerField(default=0) # 0-10 scale?
     geom = models.PointField()
     h3_id = models.CharField(max_length=15, db_index=True)
+    # Natural key within the source: the feed's own id/link, or a hash of
+    # title and publish time. Null for rows not ingested by a connector.
+    external_id = models.CharField(max_length=255, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         indexes = [
             models.Index(fields=['h3_id', 'published_at']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['source', 'external_id'], name='unique_alert_per_source'),
+        ]
 
 class IncidentNorm(models.Model):
     """Normalized incident from historical crime reports"""
@@ -2,7 +2,9 @@ import os
 import yaml
 from celery import shared_task
 from django.conf import settings
+from django.utils import timezone
 from .models import DataSource, IngestRun
+from .connectors.base import SourceUnchanged
 from .connectors.rss import RSSConnector
 
 import logging
@@ -17,6 +19,7 @@ def ingest_source(source_slug):
         return
 
     run = IngestRun.objects.create(source=source)
+    connector = None
 
     try:
         # Determine connector class
@@ -37,6 +40,11 @@ def ingest_source(source_slug):
              connector = RSSConnector(source)
              count = connector.run()
 
+        elif connector_type == 'socrata':
+            from .connectors.socrata import SocrataConnector
+            connector = SocrataConnector(source)
+            count = connector.run()
+
         elif connector_type == 'csv' or source.slug in ['nyc-nypd-ytd', 'nyc-street-light-conditions', 'nyc-subway-entrances', 'ny-state-index']:
             from .connectors.csv_connector import CSVConnector
             connector = CSVConnector(source)
@@ -48,6 +56,16 @@ def ingest_source(source_slug):
             logger.warning(f"No connector mapped for {source.slug} (type: {connector_type})")
             count = 0
 
+        # Flag touched cells so the next recompute only rescores those
+        if connector is not None and connector.dirty_cells:
+            run.record_dirty_cells(connector.dirty_cells)
+        invalidate_cached_responses(connector)
+
+        # Remember what was ingested so the next run can skip it if unchanged,
+        # or start from where it stopped
+        if connector is not None:
+            connector.save_source_state()
+
         # Update run status
         run.status = IngestRun.Status.SUCCESS
         run.items_processed = count
@@ -55,13 +73,32 @@ def ingest_source(source_slug):
         run.save()
         return f"Ingested {count} items for {source.slug}"
 
+    except SourceUnchanged as e:
+        run.status = IngestRun.Status.UNCHANGED
+        run.completed_at = timezone.now()
+        run.save()
+        logger.info(f"Skipped ingest: {e}")
+        return f"Unchanged: {source.slug}"
+
     except Exception as e:
+        # Rows written before the failure still need rescoring
+        if connector is not None and connector.dirty_cells:
+            run.record_dirty_cells(connector.dirty_cells)
+        invalidate_cached_responses(connector)
         run.status = IngestRun.Status.FAILED
         run.error_log = str(e)
         run.save()
         logger.exception(f"Ingest failed for {source_slug}")
         return f"Failed to ingest {source.slug}: {e}"
 
+def invalidate_cached_responses(connector):
+    """Drops cached context responses for cells whose incidents or alerts changed in this run."""
+    if connector is None:
+        return
+    from safety.services.response_cache import ResponseCache, ALERT_RING
+    ResponseCache.invalidate_cells(connector.dirty_cells)
+    ResponseCache.invalidate_cells(connector.alert_cells, ring=ALERT_RING)
+
 @shared_task
 def trigger_all_ingests():
     """
@@ -90,7 +127,8 @@ def trigger_all_ingests():
                  'name': entry['name'],
                  'type': entry['type'],
                  'url': entry['url'], # This ensures the URL is updated
-                 'connector': entry['connector'] # Also ensure connector is up to date
+                 'connector': entry['connector'], # Also ensure connector is up to date
+                 'watermark_field': entry.get('watermark_field', '')
              }
         )
         # Trigger task
@@ -1,3 +1,335 @@
-from django.test import TestCase
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
 
-# Create your tests here.
+import feedparser
+import h3
+import numpy as np
+import pandas as pd
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .connectors.base import content_key
+from .connectors.csv_connector import CSVConnector
+from .connectors.rss import RSSConnector
+from .connectors.socrata import SocrataConnector
+from .loader import ENV_FIELDS, INCIDENT_FIELDS, BulkLoader, point_ewkb
+from .models import AlertItem, DataSource, DirtyCell, EnvMetric, IncidentNorm, IngestRun
+from .tasks import ingest_source
+
+
+def rss_feed(*titles):
+    items = "".join(
+        f"<item><title>{title}</title><link>http://example.com/{i}</link>"
+        f"<guid>urn:test:{i}</guid><pubDate>Mon, 12 Oct 2026 10:00:00 GMT</pubDate></item>"
+        for i, title in enumerate(titles)
+    )
+    return f'<?xml version="1.0"?><rss version="2.0"><channel><title>Test</title>{items}</channel></rss>'.encode()
+
+
+class FeedServer:
+    """
+    Local HTTP stand-in for a feed. Sends an ETag when one is set and
+    answers a matching If-None-Match with 304, like a real server.
+    """
+
+    def __init__(self):
+        self.body = b""
+        self.etag = None
+        self.requests = []
+        self.paths = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server.requests.append(dict(self.headers))
+                server.paths.append(self.path)
+                if server.etag and self.headers.get("If-None-Match") == server.etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                if server.etag:
+                    self.send_header("ETag", server.etag)
+                self.send_header("Content-Length", str(len(server.body)))
+                self.end_headers()
+                self.wfile.write(server.body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/feed.xml"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class ConditionalFetchTests(TestCase):
+    def setUp(self):
+        self.server = FeedServer()
+        self.addCleanup(self.server.close)
+        self.server.body = rss_feed("Signal problems")
+        self.source = DataSource.objects.create(
+            name="Test feed", slug="test-feed", type=DataSource.SourceType.OFFICIAL_ALERTS,
+            connector="rss", url=self.server.url
+        )
+
+    def ingest(self):
+        ingest_source(self.source.slug)
+        self.source.refresh_from_db()
+        return IngestRun.objects.filter(source=self.source).latest("id")
+
+    def test_not_modified_marks_run_unchanged(self):
+        self.server.etag = '"v1"'
+        self.assertEqual(self.ingest().status, IngestRun.Status.SUCCESS)
+        self.assertEqual(self.source.etag, '"v1"')
+
+        run = self.ingest()
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), '"v1"')
+        self.assertEqual(run.status, IngestRun.Status.UNCHANGED)
+        self.assertEqual(AlertItem.objects.filter(source=self.source).count(), 1)
+
+    def test_same_content_without_validators_is_skipped_by_hash(self):
+        self.assertEqual(self.ingest().status, IngestRun.Status.SUCCESS)
+        self.assertEqual((self.source.etag, self.source.last_modified), ("", ""))
+        self.assertEqual(len(self.source.content_sha256), 64)
+
+        run = self.ingest()
+        self.assertNotIn("If-None-Match", self.server.requests[-1])
+        self.assertNotIn("If-Modified-Since", self.server.requests[-1])
+        self.assertEqual(run.status, IngestRun.Status.UNCHANGED)
+
+    def test_changed_content_is_ingested(self):
+        self.ingest()
+        first_hash = self.source.content_sha256
+
+        self.server.body = rss_feed("Signal problems", "Station closed")
+        run = self.ingest()
+        self.assertEqual(run.status, IngestRun.Status.SUCCESS)
+        self.assertEqual(run.items_processed, 1)
+        self.assertNotEqual(self.source.content_sha256, first_hash)
+        self.assertEqual(AlertItem.objects.filter(source=self.source).count(), 2)
+
+    def test_failed_run_keeps_previous_validators(self):
+        self.server.etag = '"v1"'
+        self.ingest()
+        first_hash = self.source.content_sha256
+
+        self.server.etag = '"v2"'
+        self.server.body = rss_feed("Signal problems", "Station closed")
+        with mock.patch.object(RSSConnector, "parse", side_effect=ValueError("bad feed")):
+            self.assertEqual(self.ingest().status, IngestRun.Status.FAILED)
+        self.assertEqual((self.source.etag, self.source.content_sha256), ('"v1"', first_hash))
+
+        # So the next run fetches the new content again instead of skipping it
+        run = self.ingest()
+        self.assertEqual(self.server.requests[-1].get("If-None-Match"), '"v1"')
+        self.assertEqual(run.status, IngestRun.Status.SUCCESS)
+        self.assertEqual(self.source.etag, '"v2"')
+
+
+class SaveItemsTests(TestCase):
+    def setUp(self):
+        self.source = DataSource.objects.create(
+            name="Test feed", slug="test-feed", type=DataSource.SourceType.OFFICIAL_ALERTS, connector="rss"
+        )
+        self.connector = RSSConnector(self.source)
+        self.items = self.connector.parse(feedparser.parse(rss_feed("Signal problems", "Station closed")))
+
+    def test_rss_entries_are_keyed_by_guid(self):
+        self.assertEqual([item["external_id"] for item in self.items], ["urn:test:0", "urn:test:1"])
+
+    def test_stored_keys_are_skipped(self):
+        self.assertEqual(self.connector.save_items(self.items[:1]), 1)
+
+        # The stored entry, a repeat within the batch and an entry with no guid or link
+        untitled = {**self.items[1], "title": "Service change", "external_id": "", "url": ""}
+        self.assertEqual(self.connector.save_items([*self.items, self.items[1], untitled]), 2)
+        self.assertEqual(
+            sorted(AlertItem.objects.filter(source=self.source).values_list("external_id", flat=True)),
+            sorted(["urn:test:0", "urn:test:1", content_key(untitled)])
+        )
+
+    def test_alerts_backfilled_with_content_key_are_skipped(self):
+        item = dict(self.items[0])
+        item.pop("external_id")
+        AlertItem.objects.create(source=self.source, external_id=content_key(item), **item)
+
+        self.assertEqual(self.connector.save_items(self.items), 1)
+        self.assertFalse(AlertItem.objects.filter(source=self.source, external_id="urn:test:0").exists())
+
+
+class SocrataFetchTests(SimpleTestCase):
+    def setUp(self):
+        self.server = FeedServer()
+        self.addCleanup(self.server.close)
+        self.server.body = (
+            b":created_at,created_date,latitude,longitude\n"
+            b"2026-10-02T08:00:00.000Z,2026-09-30T21:00:00.000,40.75,-73.99\n"
+            b"2026-10-03T08:00:00.000Z,2026-10-03T07:00:00.000,40.76,-73.98\n"
+        )
+        self.source = DataSource(
+            id=3, name="Street lights", slug="nyc-street-light-conditions", type="environment",
+            connector="socrata", url=self.server.url,
+            watermark_field=":created_at", watermark="2026-10-01T00:00:00.000Z"
+        )
+
+    def test_fetch_pages_rows_added_after_the_watermark(self):
+        connector = SocrataConnector(self.source)
+        pages = list(connector.fetch())
+
+        query = {k: v[0] for k, v in parse_qs(urlsplit(self.server.paths[0]).query).items()}
+        self.assertEqual(query["$select"], ":created_at, *")
+        self.assertEqual(query["$where"], ":created_at > '2026-10-01T00:00:00.000Z'")
+        self.assertEqual(query["$order"], ":created_at, :id")
+        self.assertEqual(query["$offset"], "0")
+
+        # A short page is the last one
+        self.assertEqual(len(self.server.paths), 1)
+        self.assertEqual(len(pages), 1)
+        self.assertEqual(list(pages[0]["Created Date"]), ["2026-09-30T21:00:00.000", "2026-10-03T07:00:00.000"])
+        self.assertEqual(connector.watermark, "2026-10-03T08:00:00.000Z")
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SocrataFirstRunTests(TestCase):
+    def setUp(self):
+        self.server = FeedServer()
+        self.addCleanup(self.server.close)
+        self.server.body = (
+            b":created_at,created_date,latitude,longitude\n"
+            b"2026-10-02T08:00:00.000Z,2026-09-30T21:00:00.000,40.75,-73.99\n"
+        )
+        self.source = DataSource.objects.create(
+            name="Street lights", slug="nyc-street-light-conditions", type=DataSource.SourceType.ENVIRONMENT,
+            connector="socrata", url=self.server.url, watermark_field=":created_at"
+        )
+        # Loaded by the CSV export before the source became incremental
+        self.old_cell = h3.latlng_to_cell(40.70, -73.95, 9)
+        EnvMetric.objects.create(
+            source=self.source, metric="street_light_out", value=1, ts="2026-09-01T00:00:00Z", h3_id=self.old_cell
+        )
+        other = DataSource.objects.create(
+            name="Subway", slug="nyc-subway-entrances", type=DataSource.SourceType.ENVIRONMENT, connector="csv"
+        )
+        EnvMetric.objects.create(
+            source=other, metric="subway_entrance", value=1, ts="2026-09-01T00:00:00Z", h3_id=self.old_cell
+        )
+
+        # COPY needs PostgreSQL; the rows the load would write are collected instead
+        self.loaded = []
+        load = mock.patch.object(BulkLoader, "load", autospec=True, side_effect=self.load)
+        load.start()
+        self.addCleanup(load.stop)
+
+    def load(self, loader, rows):
+        self.loaded.extend(rows)
+        return {"rows": len(self.loaded)}
+
+    def ingest(self):
+        ingest_source(self.source.slug)
+        self.source.refresh_from_db()
+        return IngestRun.objects.filter(source=self.source).latest("id")
+
+    def test_first_run_replaces_rows_loaded_before(self):
+        run = self.ingest()
+
+        self.assertEqual(run.status, IngestRun.Status.SUCCESS)
+        self.assertNotIn("%24where", self.server.paths[0])
+        self.assertEqual(len(self.loaded), 1)
+        self.assertEqual(self.source.watermark, "2026-10-02T08:00:00.000Z")
+        # Only this source's old rows go, and their cells are rescored
+        self.assertEqual(list(EnvMetric.objects.values_list("source__slug", flat=True)), ["nyc-subway-entrances"])
+        self.assertEqual(
+            set(DirtyCell.objects.filter(run=run).values_list("h3_id", flat=True)),
+            {self.old_cell, h3.latlng_to_cell(40.75, -73.99, 9)}
+        )
+
+    def test_later_runs_keep_existing_rows(self):
+        self.source.watermark = "2026-10-01T00:00:00.000Z"
+        self.source.save()
+
+        self.assertEqual(self.ingest().status, IngestRun.Status.SUCCESS)
+        self.assertEqual(EnvMetric.objects.filter(source=self.source).count(), 1)
+
+    def test_failed_first_run_keeps_rows(self):
+        self.server.body = b"not,a,soda,page\n1,2,3,4\n"
+
+        self.assertEqual(self.ingest().status, IngestRun.Status.FAILED)
+        self.assertEqual(EnvMetric.objects.filter(source=self.source).count(), 1)
+        self.assertEqual(self.source.watermark, "")
+
+
+class CSVIncidentRowsTests(SimpleTestCase):
+    def test_drops_bad_rows_and_maps_categories(self):
+        source = DataSource(id=7, name="NYPD", slug="nyc-nypd-ytd", type="crime_history")
+        chunk = pd.DataFrame({
+            'Latitude':     [40.75,        np.nan,    0.0,       40.75,        40.75,     40.76,          "abc",     40.77],
+            'Longitude':    [-73.99,       -73.99,    0.0,       -73.99,       -73.99,    -73.98,         -73.99,    -73.97],
+            'OFNS_DESC':    ["ROBBERY",    "ROBBERY", "ROBBERY", "ROBBERY",    "PARKING", "PETIT LARCENY", "ROBBERY", " robbery "],
+            'CMPLNT_FR_DT': ["01/15/2026", "01/15/2026", "01/15/2026", "not a date", "01/15/2026", "02/01/2026", "01/15/2026", "03/02/2026"],
+            'CMPLNT_FR_TM': ["10:30:00",   "10:30:00", "10:30:00", "10:30:00",   "10:30:00", "23:05:00",     "10:30:00", "00:00:00"],
+        })
+        # Kept: 0, 5 and 7 (stripped, case-insensitive offense). Dropped: missing,
+        # out-of-box and non-numeric coordinates, a bad date, an unmapped offense
+        rows = CSVConnector(source).incident_rows(chunk)
+
+        self.assertEqual(rows, [
+            (7, 'robbery', 80, datetime(2026, 1, 15, 10, 30), h3.latlng_to_cell(40.75, -73.99, 9), point_ewkb(-73.99, 40.75)),
+            (7, 'theft_minor', 20, datetime(2026, 2, 1, 23, 5), h3.latlng_to_cell(40.76, -73.98, 9), point_ewkb(-73.98, 40.76)),
+            (7, 'robbery', 80, datetime(2026, 3, 2, 0, 0), h3.latlng_to_cell(40.77, -73.97, 9), point_ewkb(-73.97, 40.77)),
+        ])
+
+    def test_missing_columns_yield_no_rows(self):
+        source = DataSource(id=7, name="NYPD", slug="nyc-nypd-ytd", type="crime_history")
+        chunk = pd.DataFrame({'Latitude': [40.75], 'Longitude': [-73.99]})
+        self.assertEqual(CSVConnector(source).incident_rows(chunk), [])
+
+
+class BulkLoaderTests(SimpleTestCase):
+    def test_statements_merge_staging_and_stamp_auto_now_fields(self):
+        create, copy, insert, drop = BulkLoader(IncidentNorm, INCIDENT_FIELDS).statements()
+        columns = '"source_id", "category", "severity", "occurred_at", "h3_id", "geom"'
+
+        self.assertEqual(create, (
+            'CREATE TEMPORARY TABLE "ingest_incidentnorm_staging" ON COMMIT DROP AS '
+            f'SELECT {columns} FROM "ingest_incidentnorm" WITH NO DATA'
+        ))
+        self.assertEqual(copy, f'COPY "ingest_incidentnorm_staging" ({columns}) FROM STDIN')
+        self.assertEqual(insert, (
+            f'INSERT INTO "ingest_incidentnorm" ({columns}, "created_at") '
+            f'SELECT {columns}, now() FROM "ingest_incidentnorm_staging"'
+        ))
+        self.assertEqual(drop, 'DROP TABLE "ingest_incidentnorm_staging"')
+
+    def test_conflict_fields_skip_existing_rows(self):
+        insert = BulkLoader(EnvMetric, ENV_FIELDS, conflict_fields=('source', 'h3_id', 'ts')).statements()[2]
+        self.assertTrue(insert.startswith(
+            'INSERT INTO "ingest_envmetric" ("source_id", "metric", "value", "ts", "h3_id", "geom", "created_at") '
+            'SELECT "source_id", "metric", "value", "ts", "h3_id", "geom", now() FROM "ingest_envmetric_staging"'
+        ))
+        self.assertTrue(insert.endswith(' ON CONFLICT ("source_id", "h3_id", "ts") DO NOTHING'))
+
+    def test_load_copies_every_row(self):
+        loader = BulkLoader(IncidentNorm, INCIDENT_FIELDS)
+        cursor = mock.MagicMock(rowcount=2)
+        copy = cursor.cursor.copy.return_value.__enter__.return_value
+        rows = [(1, 'robbery', 80, datetime(2026, 1, 1), '892a100d2c3ffff', point_ewkb(-73.99, 40.75))] * 2
+        create, copy_sql, insert, drop = loader.statements()
+
+        with mock.patch('ingest.loader.transaction.atomic'), \
+             mock.patch('ingest.loader.connection') as patched:
+            patched.ops = connection.ops
+            patched.cursor.return_value.__enter__.return_value = cursor
+            stats = loader.load(iter(rows))
+
+        self.assertEqual([c.args[0] for c in cursor.execute.call_args_list], [create, insert, drop])
+        cursor.cursor.copy.assert_called_once_with(copy_sql)
+        self.assertEqual(copy.write_row.call_args_list, [mock.call(row) for row in rows])
+        self.assertEqual((stats['rows'], stats['inserted']), (2, 2))
@@ -1,41 +1,156 @@
+from django.conf import settings
 from django.utils import timezone
-from django.db.models import Sum, Count, Avg
-from ingest.models import IncidentNorm
+from django.db.models import Max
+from ingest.models import DirtyCell, IncidentNorm
 from safety.models import RiskScore
+from safety.services.scoring import BatchScoringService
+from safety.services.score_writer import RiskScoreWriter
+from safety.services.pyramid import NATIVE_RESOLUTIONS, ScorePyramidBuilder
+from safety.services.response_cache import ResponseCache, RouteCache
+import h3
+import zlib
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Ring of neighbours whose score depends on a cell's data.
+# ScoringService only reads rows from the cell itself, so no spatial smoothing yet.
+SMOOTHING_RING = 0
+
+# Cells per h3_id__in query when rescoring a subset
+SCORING_BATCH_SIZE = 5000
+
 def calculate_risk_scores():
     """
     Aggregates IncidentNorm data by H3 cell and updates RiskScore.
-    This is a simplistic MVP implementation.
+    Scores are computed for all active cells at once by BatchScoringService.
+    Scored cells that no longer have incidents lose their RiskScore.
     """
     logger.info("Starting risk score calculation")
 
-    # 1. Identify active H3 cells (those with incidents)
+    # 1. Score active H3 cells (those with incidents)
     # Ideally we process all cells in a region, but for MVP we follow the data.
-    active_cells = IncidentNorm.objects.values_list('h3_id', flat=True).distinct()
+    results = BatchScoringService().score_cells()
 
-    count = 0
-    for h3_id in active_cells:
-        # Use Scoring Service
-        from safety.services.scoring import ScoringService
-        service = ScoringService()
-        result = service.calculate_score(h3_id)
-
-        # Update or Create RiskScore
-        RiskScore.objects.update_or_create(
-            h3_id=h3_id,
-            defaults={
-                'score': result['score'],
-                'confidence': result['confidence'],
-                'reasons_json': result['reasons'],
-                'updated_at': timezone.now()
-            }
-        )
-        count += 1
-        count += 1
+    # 2. Persist
+    count = save_risk_scores(results)
+    prune_risk_scores({r['h3_id'] for r in results})
+
+    # 3. Roll up for zoomed-out views
+    build_score_pyramid()
 
     logger.info(f"Updated risk scores for {count} cells")
     return count
+
+def calculate_dirty_risk_scores():
+    """
+    Rescores only the cells flagged by ingest runs since the last recompute.
+    Cells that no longer have incidents lose their RiskScore, matching a full pass.
+    """
+    pending = DirtyCell.objects.filter(processed_at__isnull=True)
+    # Snapshot the backlog so cells flagged while we run are kept for next time
+    last_id = pending.aggregate(last_id=Max('id'))['last_id']
+    if last_id is None:
+        logger.info("No dirty cells to rescore")
+        return 0
+
+    pending = pending.filter(id__lte=last_id)
+    cells = set(pending.values_list('h3_id', flat=True).distinct())
+    if SMOOTHING_RING > 0:
+        cells = {n for c in cells for n in h3.grid_disk(c, SMOOTHING_RING)}
+
+    logger.info(f"Rescoring {len(cells)} dirty cells")
+    count = rescore_cells(cells)
+    build_score_pyramid(cells)
+
+    pending.update(processed_at=timezone.now())
+
+    logger.info(f"Updated risk scores for {count} dirty cells")
+    return count
+
+def calculate_shard_risk_scores(shard, shard_count, on_progress=None):
+    """
+    Rescores the active cells that belong to one shard of a sharded pass.
+    on_progress(done, total) is called after every batch.
+    """
+    cells = [h3_id for h3_id in active_cells() if shard_for_cell(h3_id, shard_count) == shard]
+
+    logger.info(f"Shard {shard + 1}/{shard_count}: rescoring {len(cells)} cells")
+    return rescore_cells(cells, on_progress=on_progress)
+
+def active_cells():
+    """H3 cells with incidents: the cells a full pass scores."""
+    return IncidentNorm.objects.values_list('h3_id', flat=True).distinct()
+
+def prune_risk_scores(scored):
+    """
+    Deletes the native-resolution RiskScores of cells missing from a full
+    pass (their incidents were all removed) and drops their cached responses.
+    Returns the number of cells removed.
+    """
+    stored = RiskScore.objects.filter(resolution__in=NATIVE_RESOLUTIONS).values_list('h3_id', flat=True).distinct()
+    stale = sorted(set(stored) - set(scored))
+    for i in range(0, len(stale), SCORING_BATCH_SIZE):
+        batch = stale[i:i + SCORING_BATCH_SIZE]
+        RiskScore.objects.filter(h3_id__in=batch).delete()
+        ResponseCache.invalidate_cells(batch)
+
+    if stale:
+        RouteCache.bump_score_version()
+        logger.info(f"Removed risk scores for {len(stale)} cells without incidents")
+    return len(stale)
+
+def build_score_pyramid(cells=None):
+    """
+    Refreshes the roll-up levels above the given cells (all levels if None).
+    """
+    rows = ScorePyramidBuilder().build(cells)
+    logger.info(f"Rebuilt {rows} pyramid scores")
+    return rows
+
+def shard_for_cell(h3_id, shard_count):
+    """
+    Maps a cell to a shard through its coarse H3 parent, so neighbouring
+    cells are scored by the same worker.
+    """
+    parent = h3.cell_to_parent(h3_id, min(settings.RISK_SHARD_RESOLUTION, h3.get_resolution(h3_id)))
+    return zlib.crc32(parent.encode()) % shard_count
+
+def rescore_cells(cells, on_progress=None):
+    """
+    Scores the given cells in batches and persists the results.
+    Cells without incidents lose their RiskScore.
+    """
+    service = BatchScoringService()
+    cells = sorted(cells)
+    count = 0
+    for i in range(0, len(cells), SCORING_BATCH_SIZE):
+        batch = cells[i:i + SCORING_BATCH_SIZE]
+        results = service.score_cells(batch)
+        count += save_risk_scores(results)
+
+        # Cells whose incidents were all removed
+        scored = {r['h3_id'] for r in results}
+        stale = [c for c in batch if c not in scored]
+        if stale:
+            RiskScore.objects.filter(h3_id__in=stale).delete()
+            ResponseCache.invalidate_cells(stale)
+            RouteCache.bump_score_version()
+
+        if on_progress:
+            on_progress(i + len(batch), len(cells))
+
+    return count
+
+def save_risk_scores(results):
+    """
+    Writes scoring results (dicts from ScoringService) to RiskScore and
+    drops cached responses for those cells. Returns the number of cells written.
+    """
+    stats = RiskScoreWriter().write(results)
+    ResponseCache.invalidate_cells({r['h3_id'] for r in results})
+    logger.info(
+        f"RiskScore upsert: {stats['inserted']} inserted, "
+        f"{stats['updated']} updated, {stats['unchanged']} unchanged"
+    )
+    return len(results)
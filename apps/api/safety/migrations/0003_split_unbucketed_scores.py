@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:08
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """
+    Scores written before day/night scoring have an empty time_bucket.
+    Copy them into both buckets so lookups keep finding a score until the
+    next recompute replaces them.
+    """
+
+    dependencies = [
+        ('safety', '0002_scoringrun'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            sql=[
+                """
+                INSERT INTO safety_riskscore (h3_id, time_bucket, score, confidence, reasons_json, updated_at)
+                SELECT rs.h3_id, b.bucket, rs.score, rs.confidence, rs.reasons_json, rs.updated_at
+                FROM safety_riskscore rs
+                CROSS JOIN (VALUES ('day'), ('night')) AS b(bucket)
+                WHERE rs.time_bucket = ''
+                ON CONFLICT (h3_id, time_bucket) DO NOTHING
+                """,
+                "DELETE FROM safety_riskscore WHERE time_bucket = ''",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
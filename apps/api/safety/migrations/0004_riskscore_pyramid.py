@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:11
+
+from collections import defaultdict
+
+import h3
+from django.db import migrations, models
+
+
+def backfill_resolution(apps, schema_editor):
+    RiskScore = apps.get_model('safety', 'RiskScore')
+    by_resolution = defaultdict(list)
+    for h3_id in RiskScore.objects.values_list('h3_id', flat=True).distinct():
+        by_resolution[h3.get_resolution(h3_id)].append(h3_id)
+
+    for resolution, h3_ids in by_resolution.items():
+        for i in range(0, len(h3_ids), 5000):
+            RiskScore.objects.filter(h3_id__in=h3_ids[i:i + 5000]).update(resolution=resolution)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('safety', '0003_split_unbucketed_scores'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='riskscore',
+            name='incident_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='riskscore',
+            name='resolution',
+            field=models.PositiveSmallIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='riskscore',
+            index=models.Index(fields=['resolution', 'time_bucket'], name='safety_risk_resolut_507e3e_idx'),
+        ),
+        migrations.RunPython(backfill_resolution, migrations.RunPython.noop),
+    ]
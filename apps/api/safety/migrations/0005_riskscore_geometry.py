@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:12
+
+import django.contrib.gis.db.models.fields
+import h3
+from django.contrib.gis.geos import Polygon
+from django.db import migrations
+
+
+# Rows per bulk_update
+BATCH_SIZE = 1000
+
+
+def backfill_geometry(apps, schema_editor):
+    """Sets every row's hexagon boundary, one bulk UPDATE per batch of rows."""
+    RiskScore = apps.get_model('safety', 'RiskScore')
+    pending = RiskScore.objects.filter(geometry__isnull=True).only('id', 'h3_id').order_by('id')
+
+    batch = []
+    for score in pending.iterator(chunk_size=BATCH_SIZE):
+        ring = [(lng, lat) for lat, lng in h3.cell_to_boundary(score.h3_id)]
+        ring.append(ring[0])
+        score.geometry = Polygon(ring, srid=4326)
+        batch.append(score)
+        if len(batch) >= BATCH_SIZE:
+            RiskScore.objects.bulk_update(batch, ['geometry'])
+            batch = []
+    RiskScore.objects.bulk_update(batch, ['geometry'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('safety', '0004_riskscore_pyramid'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='riskscore',
+            name='geometry',
+            field=django.contrib.gis.db.models.fields.PolygonField(blank=True, null=True, srid=4326),
+        ),
+        migrations.RunPython(backfill_geometry, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,18 @@
-from django.db import models
+from django.contrib.gis.db import models
+
+# Incidents with occurred_at hour in [DAY_START_HOUR, NIGHT_START_HOUR) count as day
+DAY_START_HOUR = 6
+NIGHT_START_HOUR = 18
 
 class RiskScore(models.Model):
     class TimeBucket(models.TextChoices):
         DAY = "day", "Day"
         NIGHT = "night", "Night"
 
+        @classmethod
+        def for_hour(cls, hour):
+            return cls.DAY if DAY_START_HOUR <= hour < NIGHT_START_HOUR else cls.NIGHT
+
     class Confidence(models.TextChoices):
         LOW = "low", "Low"
         MEDIUM = "medium", "Medium"
@@ -12,13 +20,49 @@ class RiskScore(models.Model):
 
     h3_id = models.CharField(max_length=15, db_index=True)
     time_bucket = models.CharField(max_length=10, choices=TimeBucket.choices)
+    # H3 resolution of h3_id: 9/7 for scored cells, 3-6 for pyramid roll-ups
+    resolution = models.PositiveSmallIntegerField(null=True, blank=True)
     score = models.IntegerField() # 0-100
     confidence = models.CharField(max_length=10, choices=Confidence.choices)
     reasons_json = models.JSONField(default=list)
+    # Incidents behind the score; the weight used when rolling up the pyramid
+    incident_count = models.IntegerField(default=0)
+    # Cached hexagon boundary (GiST indexed) so maps can be served and bbox-filtered in PostGIS
+    geometry = models.PolygonField(null=True, blank=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         unique_together = ['h3_id', 'time_bucket']
         indexes = [
             models.Index(fields=['h3_id', 'time_bucket']),
+            models.Index(fields=['resolution', 'time_bucket']),
         ]
+
+class ScoringRun(models.Model):
+    """One pass of risk score recomputation"""
+    class Mode(models.TextChoices):
+        FULL = "full", "Full"
+        INCREMENTAL = "incremental", "Incremental"
+        SHARDED = "sharded", "Sharded"
+
+    class Status(models.TextChoices):
+        RUNNING = "running", "Running"
+        SUCCESS = "success", "Success"
+        FAILED = "failed", "Failed"
+
+    mode = models.CharField(max_length=20, choices=Mode.choices)
+    status = models.CharField(max_length=20, choices=Status.choices, default=Status.RUNNING)
+    shard_count = models.IntegerField(default=1)
+    cells_scored = models.IntegerField(default=0)
+    started_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    error_log = models.TextField(blank=True)
+
+    def __str__(self):
+        return f"{self.mode} - {self.started_at}"
+
+    @property
+    def duration_seconds(self):
+        if not self.completed_at:
+            return None
+        return (self.completed_at - self.started_at).total_seconds()
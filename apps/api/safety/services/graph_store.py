@@ -0,0 +1,384 @@
+from collections import OrderedDict
+from django.conf import settings
+from geo.utils import haversine_m
+from safety.services.compact_graph import BudgetExceeded, CompactGraph
+import h3
+import numpy as np
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Same exclusions as OSMnx's network_type='walk' filter
+EXCLUDED_HIGHWAYS = {
+    'abandoned', 'bus_guideway', 'construction', 'cycleway', 'motorway', 'motorway_link',
+    'no', 'planned', 'platform', 'proposed', 'raceway', 'razed'
+}
+
+TILE_ARRAYS = ('node_id', 'lat', 'lng', 'edge_u', 'edge_v', 'length', 'cell')
+
+# Resolution of the H3 cell stored per edge, matching street-level RiskScores
+EDGE_CELL_RESOLUTION = 9
+
+# Points snap to the nearest node within this many degrees (~200 m)
+SNAP_RADIUS = 0.002
+
+# Peak memory of a routing request per byte of graph tiles it loads: the
+# tiles, their stitched and cropped copies, the CompactGraph holding both
+# directions of every street, and its per-edge risk and weight arrays.
+# Measured at 6.2 on a 180k-edge grid.
+WORKING_SET_FACTOR = 6.5
+
+def is_walkable(tags):
+    """True if an OSM way with these tags belongs in the walking network."""
+    highway = tags.get('highway')
+    return (
+        bool(highway)
+        and highway not in EXCLUDED_HIGHWAYS
+        and tags.get('area') != 'yes'
+        and tags.get('access') != 'private'
+        and tags.get('foot') != 'no'
+        and tags.get('service') != 'private'
+    )
+
+def graph_path(metro):
+    return settings.ROUTING_GRAPH_DIR / f"{metro}.npz"
+
+def tiles_for_bbox(north, south, east, west, resolution):
+    """H3 cells at the tile resolution that overlap the bbox."""
+    poly = h3.LatLngPoly([(south, west), (south, east), (north, east), (north, west)])
+    return h3.polygon_to_cells_experimental(poly, resolution, contain='overlap')
+
+def stitch_tiles(tiles):
+    """
+    Merges tiles into one set of arrays: node_id, lat, lng, then undirected
+    edge_u / edge_v (indices into the nodes), length and cell. Tiles share
+    their border nodes, so nodes are merged by OSM id.
+    """
+    offsets = np.cumsum([0] + [len(t['node_id']) for t in tiles])
+    all_ids = np.concatenate([t['node_id'] for t in tiles])
+    node_id, first, remap = np.unique(all_ids, return_index=True, return_inverse=True)
+    return {
+        'node_id': node_id,
+        'lat': np.concatenate([t['lat'] for t in tiles])[first],
+        'lng': np.concatenate([t['lng'] for t in tiles])[first],
+        'edge_u': remap[np.concatenate([t['edge_u'] + off for t, off in zip(tiles, offsets)])],
+        'edge_v': remap[np.concatenate([t['edge_v'] + off for t, off in zip(tiles, offsets)])],
+        'length': np.concatenate([t['length'] for t in tiles]),
+        'cell': np.concatenate([t['cell'] for t in tiles]),
+    }
+
+class WalkGraphBuilder:
+    """
+    Builds a metro's walking graph offline from an OSM PBF extract.
+    Every walkable way inside the metro bbox becomes a chain of undirected
+    edges between consecutive OSM nodes, so route lines follow the street
+    geometry without storing per-edge shapes. Each edge also records the H3
+    cell of its midpoint, so routing can look up risk without touching H3.
+
+    The graph is cut into tiles by the H3 cell (ROUTING_TILE_RESOLUTION) of
+    each edge's first node. A tile holds its edges plus both of their end
+    nodes, so neighbouring tiles share the nodes on their border and can be
+    stitched back together by node id.
+    """
+
+    def build(self, metro):
+        """Builds ROUTING_GRAPH_DIR/<metro>.npz. Returns (node count, edge count)."""
+        import osmium
+
+        config = settings.ROUTING_METROS[metro]
+        min_lng, min_lat, max_lng, max_lat = config['bbox']
+
+        node_index = {}
+        node_ids, lats, lngs = [], [], []
+        edge_u, edge_v = [], []
+
+        def index_of(ref, location):
+            idx = node_index.get(ref)
+            if idx is None:
+                idx = node_index[ref] = len(node_ids)
+                node_ids.append(ref)
+                lats.append(location.lat)
+                lngs.append(location.lon)
+            return idx
+
+        class WalkwayHandler(osmium.SimpleHandler):
+            def way(self, way):
+                if not is_walkable(way.tags):
+                    return
+                prev = None
+                for node in way.nodes:
+                    location = node.location
+                    if not (location.valid()
+                            and min_lng <= location.lon <= max_lng
+                            and min_lat <= location.lat <= max_lat):
+                        prev = None
+                        continue
+                    idx = index_of(node.ref, location)
+                    if prev is not None and prev != idx:
+                        edge_u.append(prev)
+                        edge_v.append(idx)
+                    prev = idx
+
+        logger.info(f"Reading walkable ways for {metro} from {config['pbf']}")
+        WalkwayHandler().apply_file(str(config['pbf']), locations=True)
+
+        node_id = np.array(node_ids, dtype=np.int64)
+        lat = np.array(lats, dtype=np.float64)
+        lng = np.array(lngs, dtype=np.float64)
+
+        # One undirected edge per node pair
+        pairs = np.sort(np.column_stack([edge_u, edge_v]).astype(np.int32).reshape(-1, 2), axis=1)
+        pairs = np.unique(pairs, axis=0)
+        u, v = pairs[:, 0], pairs[:, 1]
+        length = haversine_m(lat[u], lng[u], lat[v], lng[v]).astype(np.float32)
+        mid_lat = (lat[u] + lat[v]) / 2
+        mid_lng = (lng[u] + lng[v]) / 2
+        cell = np.array([
+            h3.str_to_int(h3.latlng_to_cell(y, x, EDGE_CELL_RESOLUTION))
+            for y, x in zip(mid_lat.tolist(), mid_lng.tolist())
+        ], dtype=np.uint64)
+
+        resolution = settings.ROUTING_TILE_RESOLUTION
+        node_tile = np.array([h3.latlng_to_cell(y, x, resolution) for y, x in zip(lats, lngs)])
+        edge_tile = node_tile[u]
+
+        arrays = {}
+        order = np.argsort(edge_tile, kind='stable')
+        tiles, starts = np.unique(edge_tile[order], return_index=True)
+        for tile, edges in zip(tiles, np.split(order, starts[1:])):
+            nodes, local = np.unique(np.concatenate([u[edges], v[edges]]), return_inverse=True)
+            arrays.update({
+                f"{tile}:node_id": node_id[nodes],
+                f"{tile}:lat": lat[nodes],
+                f"{tile}:lng": lng[nodes],
+                f"{tile}:edge_u": local[:len(edges)].astype(np.int32),
+                f"{tile}:edge_v": local[len(edges):].astype(np.int32),
+                f"{tile}:length": length[edges],
+                f"{tile}:cell": cell[edges],
+            })
+
+        # Write aside and swap in, so workers never open a partial archive;
+        # they notice the new file by its mtime and size (see WalkGraphStore.archive)
+        path = graph_path(metro)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        partial = path.with_name(f".{path.name}")
+        np.savez(
+            partial,
+            tiles=tiles,
+            tile_resolution=np.array(resolution),
+            bbox=np.array(config['bbox'], dtype=np.float64),
+            **arrays
+        )
+        os.replace(partial, path)
+
+        logger.info(f"Wrote {path}: {len(node_ids)} nodes, {len(u)} edges in {len(tiles)} tiles")
+        return len(node_ids), len(u)
+
+class GraphTileCache:
+    """
+    Memory-bounded LRU of graph tiles, shared by all requests in a worker.
+    Sizes are the exact bytes of the tile arrays; least recently used tiles
+    are evicted once the total passes max_bytes.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.tiles = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, load):
+        """
+        Returns the tile for key, calling load() to read it on a miss.
+        Loads run under the lock: archive reads share one file handle.
+        """
+        with self.lock:
+            tile = self.tiles.get(key)
+            if tile is not None:
+                self.tiles.move_to_end(key)
+                self.hits += 1
+                return tile
+
+            self.misses += 1
+            tile = load()
+            self.tiles[key] = tile
+            self.bytes += sum(a.nbytes for a in tile.values())
+
+            # Always keep the tile just loaded, even if it alone exceeds the budget
+            while self.bytes > self.max_bytes and len(self.tiles) > 1:
+                _, evicted = self.tiles.popitem(last=False)
+                self.bytes -= sum(a.nbytes for a in evicted.values())
+                self.evictions += 1
+            return tile
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tiles": len(self.tiles),
+                "memory_bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions
+            }
+
+# Open graph archives of this process by metro, and its tile cache keyed by
+# (metro, archive stamp, tile) so tiles of a replaced archive are never served
+_archives = {}
+_archives_lock = threading.Lock()
+_tile_cache = GraphTileCache(settings.ROUTING_TILE_CACHE_MB * 1024 * 1024)
+
+class WalkGraphStore:
+    """
+    Serves walking graphs prebuilt by WalkGraphBuilder.
+    A request loads the tiles overlapping its bbox through the worker's
+    GraphTileCache, so nearby routes reuse tiles already in memory, and
+    stitches them into one CompactGraph cropped to the bbox.
+    """
+
+    def metro_for_bbox(self, north, south, east, west):
+        """
+        Slug of the configured metro containing the bbox center, or None.
+        Parts of the bbox outside the metro simply have no graph.
+        """
+        lat = (north + south) / 2
+        lng = (east + west) / 2
+        for metro, config in settings.ROUTING_METROS.items():
+            min_lng, min_lat, max_lng, max_lat = config['bbox']
+            if min_lng <= lng <= max_lng and min_lat <= lat <= max_lat:
+                return metro
+        return None
+
+    def archive(self, metro):
+        """
+        Lazily read archive of a metro's tiles, or None if it has not been
+        built. Reopened when the file is rebuilt, like load_hierarchy.
+        """
+        path = graph_path(metro)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            logger.warning(f"No walking graph for {metro} at {path}; run scripts/build_walk_graphs.py")
+            return None
+        stamp = (stat.st_mtime_ns, stat.st_size)
+
+        with _archives_lock:
+            archive = _archives.get(metro)
+            if archive is None or archive['stamp'] != stamp:
+                # Requests still holding the old archive keep reading its (replaced) file
+                file = np.load(path)
+                archive = _archives[metro] = {
+                    'stamp': stamp,
+                    'file': file,
+                    'tiles': set(file['tiles'].tolist()),
+                    'tile_resolution': int(file['tile_resolution'])
+                }
+            return archive
+
+    def tile_bytes(self, archive, tile):
+        """Size of a tile's arrays, read from the archive index without loading them."""
+        return sum(archive['file'].zip.getinfo(f"{tile}:{name}.npy").file_size for name in TILE_ARRAYS)
+
+    def load_tiles(self, metro, north, south, east, west, max_bytes=None):
+        """
+        Tile arrays overlapping the bbox, through the tile cache.
+        Raises BudgetExceeded before loading anything if routing over them
+        needs more than max_bytes (WORKING_SET_FACTOR times their size).
+        """
+        archive = self.archive(metro)
+        if archive is None:
+            return []
+
+        tiles = [
+            t for t in tiles_for_bbox(north, south, east, west, archive['tile_resolution'])
+            if t in archive['tiles']
+        ]
+        if max_bytes is not None:
+            tile_bytes = sum(self.tile_bytes(archive, t) for t in tiles)
+            needed = tile_bytes * WORKING_SET_FACTOR
+            if needed > max_bytes:
+                raise BudgetExceeded(
+                    f"Route needs about {needed / 2**20:.1f} MB for {tile_bytes / 2**20:.1f} MB of street graph, "
+                    f"over the {max_bytes / 2**20:g} MB limit"
+                )
+        return [
+            _tile_cache.get(
+                (metro, archive['stamp'], t),
+                lambda t=t: {name: archive['file'][f"{t}:{name}"] for name in TILE_ARRAYS}
+            )
+            for t in tiles
+        ]
+
+    def nearest_node_id(self, lat, lng, radius=SNAP_RADIUS):
+        """
+        OSM id of the walkable node closest to a point, from the (usually
+        cached) tiles around it alone, or None if none is within radius degrees.
+        """
+        metro = self.metro_for_bbox(lat, lat, lng, lng)
+        if metro is None:
+            return None
+        tiles = self.load_tiles(metro, lat + radius, lat - radius, lng + radius, lng - radius)
+        if not tiles:
+            return None
+
+        lats = np.concatenate([t['lat'] for t in tiles])
+        lngs = np.concatenate([t['lng'] for t in tiles])
+        near = np.flatnonzero((np.abs(lats - lat) <= radius) & (np.abs(lngs - lng) <= radius))
+        if len(near) == 0:
+            return None
+        nearest = near[np.argmin(haversine_m(lats[near], lngs[near], lat, lng))]
+        return int(np.concatenate([t['node_id'] for t in tiles])[nearest])
+
+    def graph_for_bbox(self, north, south, east, west, max_bytes=None):
+        """
+        CompactGraph (both directions per street) of the walkable network
+        inside the bbox, or None if no built metro covers it.
+        Raises BudgetExceeded if routing over it needs more than max_bytes (see load_tiles).
+        """
+        metro = self.metro_for_bbox(north, south, east, west)
+        if metro is None:
+            logger.warning(f"No routing metro covers bbox N={north}, S={south}, E={east}, W={west}")
+            return None
+
+        tiles = self.load_tiles(metro, north, south, east, west, max_bytes)
+        if not tiles:
+            return None
+        logger.debug(f"Stitching {len(tiles)} graph tiles; tile cache: {_tile_cache.stats()}")
+
+        graph = stitch_tiles(tiles)
+        lat, lng, u, v = graph['lat'], graph['lng'], graph['edge_u'], graph['edge_v']
+
+        # Crop to the bbox and renumber the remaining nodes
+        inside = (lat >= south) & (lat <= north) & (lng >= west) & (lng <= east)
+        keep = inside[u] & inside[v]
+        nodes = np.flatnonzero(inside)
+        index = np.full(len(lat), -1, dtype=np.int64)
+        index[nodes] = np.arange(len(nodes))
+
+        return CompactGraph.from_edges(
+            graph['node_id'][nodes], lat[nodes], lng[nodes],
+            index[u[keep]], index[v[keep]], graph['length'][keep], graph['cell'][keep]
+        )
+
+    def metro_graph(self, metro):
+        """
+        Stitched arrays of a whole metro (see stitch_tiles), read straight from
+        the archive so offline jobs do not flush the tile cache. None if not built.
+        """
+        archive = self.archive(metro)
+        if archive is None:
+            return None
+        return stitch_tiles([
+            {name: archive['file'][f"{t}:{name}"] for name in TILE_ARRAYS}
+            for t in sorted(archive['tiles'])
+        ])
+
+    @staticmethod
+    def cache_stats():
+        """Memory use, hits, misses and evictions of this worker's tile cache."""
+        return _tile_cache.stats()
@@ -0,0 +1,74 @@
+import mapbox_vector_tile
+from django.contrib.gis.db.models.functions import Transform
+from django.contrib.gis.geos import Polygon
+from geo.utils import tile_bounds, lnglat_to_mercator
+from safety.models import RiskScore
+from safety.services.pyramid import NATIVE_RESOLUTIONS
+
+# (min_zoom, resolutions) bands, first match wins. Scored cells are drawn
+# from z10; below that the pyramid level whose hexes cover a tile with
+# roughly a few hundred to 2k cells.
+ZOOM_LEVELS = (
+    (10, NATIVE_RESOLUTIONS),
+    (7, (6,)),
+    (6, (5,)),
+    (5, (4,)),
+    (0, (3,)),
+)
+
+TILE_EXTENT = 4096
+TILE_LAYER_NAME = "risk"
+
+class HeatmapTileService:
+    """
+    Renders RiskScore hexagons as Mapbox Vector Tiles.
+    Rows are selected with a GiST bbox lookup on the stored hexagon
+    geometry, so the work per tile is bounded by the viewport rather than
+    by nationwide coverage.
+    """
+
+    def resolutions_for_zoom(self, z):
+        for min_zoom, resolutions in ZOOM_LEVELS:
+            if z >= min_zoom:
+                return resolutions
+        return NATIVE_RESOLUTIONS
+
+    def render_tile(self, z, x, y, time_bucket=RiskScore.TimeBucket.DAY):
+        """
+        Returns the encoded tile as bytes, or None if no scored cells fall in it.
+        """
+        west, south, east, north = tile_bounds(z, x, y)
+        bbox = Polygon.from_bbox((west, south, east, north))
+        bbox.srid = 4326
+
+        scores = RiskScore.objects.filter(
+            time_bucket=time_bucket,
+            resolution__in=self.resolutions_for_zoom(z),
+            geometry__bboverlaps=bbox
+        ).annotate(mercator=Transform('geometry', 3857)) \
+         .values_list('h3_id', 'score', 'confidence', 'resolution', 'mercator')
+
+        features = []
+        for h3_id, score, confidence, resolution, mercator in scores:
+            features.append({
+                "geometry": mercator.wkt,
+                "properties": {
+                    "h3_id": h3_id,
+                    "score": score,
+                    "confidence": confidence,
+                    "resolution": resolution
+                }
+            })
+
+        if not features:
+            return None
+
+        min_x, min_y = lnglat_to_mercator(west, south)
+        max_x, max_y = lnglat_to_mercator(east, north)
+        return mapbox_vector_tile.encode(
+            [{"name": TILE_LAYER_NAME, "features": features}],
+            default_options={
+                "quantize_bounds": (min_x, min_y, max_x, max_y),
+                "extents": TILE_EXTENT
+            }
+        )
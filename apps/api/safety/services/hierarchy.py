@@ -0,0 +1,493 @@
+from django.conf import settings
+from geo.utils import haversine_m
+from safety.services.graph_store import WalkGraphStore
+from safety.services.response_cache import RouteCache
+import numpy as np
+import os
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Hierarchies and metrics loaded in this process
+_hierarchies = {}
+_metrics = {}
+_lock = threading.Lock()
+
+# Parts of the dissection this small are not split further
+DISSECTION_LEAF_SIZE = 8
+
+def dissection_order(lat, lng, u, v):
+    """
+    Elimination order by recursive coordinate bisection: split each part
+    at the median of its longer axis, take the nodes on the smaller side of
+    the cut edges as separator, order both halves first and the separator
+    last. Returns node indices, first eliminated first.
+    """
+    n = len(lat)
+    # Roughly equal-area axes
+    y = np.asarray(lat, dtype=np.float64)
+    x = np.asarray(lng, dtype=np.float64) * np.cos(np.radians(y.mean() if n else 0.0))
+
+    order = []
+    # Work items: (nodes, edge_u, edge_v) or a finished separator to emit
+    stack = [('part', np.arange(n), np.asarray(u), np.asarray(v))]
+    side = np.zeros(n, dtype=np.int8)
+    while stack:
+        item = stack.pop()
+        if item[0] == 'separator':
+            order.append(item[1])
+            continue
+
+        _, nodes, eu, ev = item
+        if len(nodes) <= DISSECTION_LEAF_SIZE or len(eu) == 0:
+            order.append(nodes)
+            continue
+
+        coord = x[nodes] if np.ptp(x[nodes]) >= np.ptp(y[nodes]) else y[nodes]
+        left = coord <= np.median(coord)
+        if left.all() or not left.any():
+            order.append(nodes)
+            continue
+
+        side[nodes] = np.where(left, 0, 1)
+        cut = side[eu] != side[ev]
+        cut_u, cut_v = eu[cut], ev[cut]
+        left_ends = np.unique(np.where(side[cut_u] == 0, cut_u, cut_v))
+        right_ends = np.unique(np.where(side[cut_u] == 0, cut_v, cut_u))
+        separator = left_ends if len(left_ends) <= len(right_ends) else right_ends
+        side[separator] = 2
+
+        halves = []
+        for part in (0, 1):
+            keep = (side[eu] == part) & (side[ev] == part)
+            halves.append(('part', nodes[side[nodes] == part], eu[keep], ev[keep]))
+
+        # Popped in reverse: left half, right half, then the separator
+        stack.append(('separator', separator))
+        stack.extend(reversed(halves))
+
+    return np.concatenate(order) if order else np.array([], dtype=np.int64)
+
+def hierarchy_path(metro):
+    return settings.ROUTING_GRAPH_DIR / f"{metro}.cch.npz"
+
+def metric_path(metro, time_bucket, alpha):
+    return settings.ROUTING_GRAPH_DIR / f"{metro}.{time_bucket}.a{alpha:g}.metric.npz"
+
+class HierarchyBuilder:
+    """
+    Metric-independent part of a customizable contraction hierarchy (CCH)
+    over a metro's walking graph. It only depends on the street network, so
+    it is built once next to the graph and reused for every safety weighting.
+
+    Nodes are ranked by geometric nested dissection and eliminated in that
+    order without witness searches: the remaining neighbours of each
+    eliminated node become a clique, and every resulting arc points from its
+    lower- to its higher-ranked end. Small separators keep those cliques,
+    and so the search spaces, small.
+    Each arc (a, b) keeps the lower triangles (x, a, b) that can shorten
+    it, grouped by level so customization can relax a level at a time.
+    """
+
+    def build(self, metro):
+        """Builds ROUTING_GRAPH_DIR/<metro>.cch.npz. Returns (node count, arc count, triangle count)."""
+        graph = WalkGraphStore().metro_graph(metro)
+        if graph is None:
+            raise ValueError(f"No walking graph built for {metro}")
+
+        n = len(graph['node_id'])
+        u, v = graph['edge_u'], graph['edge_v']
+
+        adj = [set() for _ in range(n)]
+        for a, b in zip(u.tolist(), v.tolist()):
+            adj[a].add(b)
+            adj[b].add(a)
+
+        # 1. Eliminate in nested dissection order; the remaining neighbours
+        # of each eliminated node become a clique
+        rank = np.zeros(n, dtype=np.int64)
+        upper = [None] * n
+        elimination = dissection_order(graph['lat'], graph['lng'], u, v)
+        rank[elimination] = np.arange(n)
+        for x in elimination.tolist():
+            neighbours = list(adj[x])
+            adj[x] = None
+            upper[x] = neighbours
+            for y in neighbours:
+                adj[y].discard(x)
+            for i, a in enumerate(neighbours):
+                for b in neighbours[i + 1:]:
+                    if b not in adj[a]:
+                        adj[a].add(b)
+                        adj[b].add(a)
+
+        # 2. Upward arcs as CSR by lower node, sorted by (lower, upper)
+        counts = np.array([len(up) for up in upper], dtype=np.int64)
+        arc_lower = np.repeat(np.arange(n, dtype=np.int64), counts)
+        arc_upper = np.array([y for up in upper for y in up], dtype=np.int64)
+        keys = arc_lower * n + arc_upper
+        order = np.argsort(keys)
+        arc_lower, arc_upper, keys = arc_lower[order], arc_upper[order], keys[order]
+        up_offsets = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(counts, out=up_offsets[1:])
+
+        # Elimination tree parent: lowest-ranked upper neighbour
+        parent = np.full(n, -1, dtype=np.int64)
+        level = np.zeros(n, dtype=np.int64)
+        for x in np.argsort(rank).tolist():
+            up = upper[x]
+            if up:
+                parent[x] = min(up, key=rank.__getitem__)
+                for y in up:
+                    if level[y] <= level[x]:
+                        level[y] = level[x] + 1
+
+        # 3. Lower triangles: eliminating x shortcuts every pair (a, b) of its upper neighbours
+        tri_target, tri_a, tri_b = [], [], []
+        for x, up in enumerate(upper):
+            if len(up) < 2:
+                continue
+            up = np.array(up, dtype=np.int64)
+            i, j = np.triu_indices(len(up), k=1)
+            a, b = up[i], up[j]
+            swap = rank[a] > rank[b]
+            a, b = np.where(swap, b, a), np.where(swap, a, b)
+            tri_target.append(np.searchsorted(keys, a * n + b))
+            tri_a.append(np.searchsorted(keys, x * n + a))
+            tri_b.append(np.searchsorted(keys, x * n + b))
+
+        if tri_target:
+            tri_target = np.concatenate(tri_target)
+            tri_a = np.concatenate(tri_a)
+            tri_b = np.concatenate(tri_b)
+        else:
+            tri_target = tri_a = tri_b = np.array([], dtype=np.int64)
+
+        # An arc only depends on arcs of lower-level nodes, so sort triangles by that level
+        tri_level = level[arc_lower[tri_target]]
+        order = np.argsort(tri_level, kind='stable')
+        tri_target, tri_a, tri_b = tri_target[order], tri_a[order], tri_b[order]
+        level_starts = np.searchsorted(tri_level[order], np.arange(int(tri_level.max(initial=0)) + 2))
+
+        # Original edges map onto the arc between their ends
+        lo = np.where(rank[u] < rank[v], u, v)
+        hi = np.where(rank[u] < rank[v], v, u)
+        edge_arc = np.searchsorted(keys, lo * n + hi)
+
+        # Written aside and swapped in, like the metrics; load_hierarchy reloads on the new mtime
+        path = hierarchy_path(metro)
+        partial = path.with_name(f".{path.name}")
+        np.savez(
+            partial,
+            node_id=graph['node_id'],
+            lat=graph['lat'],
+            lng=graph['lng'],
+            parent=parent,
+            up_offsets=up_offsets,
+            arc_lower=arc_lower.astype(np.int32),
+            arc_upper=arc_upper.astype(np.int32),
+            edge_arc=edge_arc,
+            edge_length=graph['length'],
+            edge_cell=graph['cell'],
+            tri_target=tri_target.astype(np.int32),
+            tri_a=tri_a.astype(np.int32),
+            tri_b=tri_b.astype(np.int32),
+            level_starts=level_starts
+        )
+        os.replace(partial, path)
+        _hierarchies.pop(metro, None)
+
+        logger.info(f"Wrote {path}: {n} nodes, {len(arc_lower)} arcs, {len(tri_target)} triangles")
+        return n, len(arc_lower), len(tri_target)
+
+def load_hierarchy(metro):
+    """Arrays of a metro's hierarchy, or None if it has not been built. Reloaded when rebuilt."""
+    path = hierarchy_path(metro)
+    try:
+        mtime = path.stat().st_mtime
+    except FileNotFoundError:
+        return None
+
+    with _lock:
+        cached = _hierarchies.get(metro)
+        if cached is None or cached[0] != mtime:
+            with np.load(path) as data:
+                cached = _hierarchies[metro] = (mtime, {key: data[key] for key in data.files})
+        return cached[1]
+
+class HierarchyCustomizer:
+    """
+    Applies a safety weighting to a built hierarchy. Shortcut weights are
+    recomputed bottom-up from the current edge risks in a few vectorized
+    passes, so a risk recompute only needs this step, not a new hierarchy.
+    Each arc also keeps the middle node of its best triangle (for unpacking)
+    and the physical length and length-weighted risk of the path it stands for.
+    Metrics are stamped with the route cache's score version they were
+    customized from; HierarchyRouter ignores them once scores change again.
+    """
+
+    def customize_all(self, score_run=None):
+        """
+        Re-customizes every built hierarchy for each time bucket and each
+        alpha in ROUTING_CH_ALPHAS from the current risk scores.
+        Returns the number of metrics written.
+        """
+        from safety.models import RiskScore
+        from safety.services.routing import RoutingService
+
+        # Read before the scores: a write landing mid-customization moves the
+        # version on, so these metrics are never used with the newer scores
+        score_version = RouteCache.score_version()
+        count = 0
+        for metro in settings.ROUTING_METROS:
+            cch = load_hierarchy(metro)
+            if cch is None:
+                continue
+            for time_bucket in RiskScore.TimeBucket.values:
+                edge_risk = RoutingService().edge_risk(cch['edge_cell'], time_bucket)
+                for alpha in settings.ROUTING_CH_ALPHAS:
+                    self.customize(metro, time_bucket, alpha, edge_risk, score_run=score_run, score_version=score_version)
+                    count += 1
+        return count
+
+    def customize(self, metro, time_bucket, alpha, edge_risk, score_run=None, score_version=0):
+        """
+        Writes the metric for (metro, time_bucket, alpha). edge_risk aligns with
+        the hierarchy's edges, in RoutingService.edge_risk units (0 safe to 100),
+        read from the scores at score_version (RouteCache.score_version).
+        """
+        cch = load_hierarchy(metro)
+        arc_count = len(cch['arc_lower'])
+        edge_length = cch['edge_length'].astype(np.float64)
+        edge_risk = np.asarray(edge_risk, dtype=np.float64)
+        edge_weight = edge_length * (1 + (edge_risk / 100.0) * alpha)
+
+        weight = np.full(arc_count, np.inf)
+        length = np.full(arc_count, np.inf)
+        risk = np.zeros(arc_count)
+        # Parallel edges share an arc: assign heaviest first so the lightest wins
+        order = np.argsort(-edge_weight, kind='stable')
+        arcs = cch['edge_arc'][order]
+        weight[arcs] = edge_weight[order]
+        length[arcs] = edge_length[order]
+        risk[arcs] = (edge_risk * edge_length)[order]
+        direct = weight.copy()
+
+        via = np.full(arc_count, -1, dtype=np.int32)
+        tri_target, tri_a, tri_b = cch['tri_target'], cch['tri_a'], cch['tri_b']
+        starts = cch['level_starts']
+        for start, end in zip(starts[:-1], starts[1:]):
+            if start == end:
+                continue
+            target, a, b = tri_target[start:end], tri_a[start:end], tri_b[start:end]
+            candidate = weight[a] + weight[b]
+            np.minimum.at(weight, target, candidate)
+
+            won = (candidate == weight[target]) & (candidate < direct[target])
+            won_targets, first = np.unique(target[won], return_index=True)
+            a, b = a[won][first], b[won][first]
+            via[won_targets] = cch['arc_lower'][a]
+            length[won_targets] = length[a] + length[b]
+            risk[won_targets] = risk[a] + risk[b]
+
+        # Write aside and swap in, so API workers never read a partial file
+        path = metric_path(metro, time_bucket, alpha)
+        partial = path.with_name(f".{path.name}")
+        np.savez(
+            partial,
+            weight=weight,
+            length=length.astype(np.float32),
+            risk=risk.astype(np.float32),
+            via=via,
+            score_run=np.array(score_run if score_run is not None else -1),
+            score_version=np.array(score_version, dtype=np.int64)
+        )
+        os.replace(partial, path)
+        logger.info(f"Customized {metro} hierarchy for {time_bucket}, alpha={alpha:g} (score run {score_run})")
+        return path
+
+class HierarchyRouter:
+    """
+    Answers route queries on a customized hierarchy: an upward search from
+    each end along its elimination-tree ancestors, then the cheapest meeting
+    node. Shortcuts on the result are unpacked back into street nodes.
+    Metrics are reloaded when a new customization lands on disk, and only
+    used while their score version is current: between a score write and
+    the end of the re-customization it triggers, routes fall back to A*.
+    """
+
+    def __init__(self, metro):
+        self.metro = metro
+        self.cch = load_hierarchy(metro)
+
+    @property
+    def available(self):
+        return self.cch is not None
+
+    def metric(self, time_bucket, alpha):
+        """Arrays of the metric for (time_bucket, alpha), or None if missing or customized from older scores."""
+        path = metric_path(self.metro, time_bucket, alpha)
+        try:
+            mtime = path.stat().st_mtime
+        except FileNotFoundError:
+            return None
+
+        key = (self.metro, time_bucket, alpha)
+        with _lock:
+            cached = _metrics.get(key)
+            if cached is None or cached[0] != mtime:
+                with np.load(path) as data:
+                    cached = _metrics[key] = (mtime, {name: data[name] for name in data.files})
+
+        metric = cached[1]
+        # Metrics from before score versions were stamped count as stale
+        if 'score_version' not in metric or int(metric['score_version']) != RouteCache.score_version():
+            logger.debug(f"Skipping stale {self.metro} metric for {time_bucket}, alpha={alpha:g}")
+            return None
+        return metric
+
+    def nearest_node(self, lat, lng, radius=0.01):
+        """Closest node within radius degrees of the point, or None."""
+        lats, lngs = self.cch['lat'], self.cch['lng']
+        near = np.flatnonzero((np.abs(lats - lat) < radius) & (np.abs(lngs - lng) < radius))
+        if len(near) == 0:
+            return None
+        return int(near[np.argmin(haversine_m(lats[near], lngs[near], lat, lng))])
+
+    def route(self, source, target, time_bucket, alpha):
+        """
+        Route between two node indices as (node indices, distance in meters,
+        length-weighted risk sum), or None if no metric or no path.
+        """
+        metric = self.metric(time_bucket, alpha)
+        if metric is None:
+            return None
+
+        forward = self._upward(source, metric['weight'])
+        backward = self._upward(target, metric['weight'])
+        meeting = self._meet(forward, backward)
+        if meeting is None:
+            return None
+
+        up_arcs = self._arc_chain(meeting, source, forward)[::-1]
+        down_arcs = self._arc_chain(meeting, target, backward)
+
+        nodes = [source]
+        for arc in up_arcs:
+            nodes.extend(self._unpack(arc, metric['via'], reverse=False)[1:])
+        for arc in down_arcs:
+            nodes.extend(self._unpack(arc, metric['via'], reverse=True)[1:])
+
+        arcs = np.array(up_arcs + down_arcs, dtype=np.int64)
+        distance = float(metric['length'][arcs].astype(np.float64).sum())
+        risk = float(metric['risk'][arcs].astype(np.float64).sum())
+        return np.array(nodes), distance, risk
+
+    def table(self, sources, targets, time_bucket, alpha):
+        """
+        Costs, distances in meters and length-weighted risk sums between node
+        indices paired up in sources and targets, as arrays aligned with them
+        (inf where there is no path), or None if no metric. Each node's upward search runs once,
+        however many pairs it is in, and no path is unpacked.
+        """
+        metric = self.metric(time_bucket, alpha)
+        if metric is None:
+            return None
+
+        searches = {}
+        def search(node):
+            if node not in searches:
+                searches[node] = self._upward(node, metric['weight'])
+            return searches[node]
+
+        cost = np.full(len(sources), np.inf)
+        length = np.full(len(sources), np.inf)
+        risk = np.full(len(sources), np.inf)
+        for i, (source, target) in enumerate(zip(sources, targets)):
+            forward, backward = search(source), search(target)
+            meeting = self._meet(forward, backward)
+            if meeting is None:
+                continue
+            arcs = self._arc_chain(meeting, source, forward) + self._arc_chain(meeting, target, backward)
+            cost[i] = metric['weight'][arcs].astype(np.float64).sum()
+            length[i] = metric['length'][arcs].astype(np.float64).sum()
+            risk[i] = metric['risk'][arcs].astype(np.float64).sum()
+        return cost, length, risk
+
+    def _meet(self, forward, backward):
+        """Cheapest node reached by both upward searches, or None if they never meet."""
+        # Both searches end in the shared ancestors of their start nodes
+        _, fi, bi = np.intersect1d(forward[0], backward[0], return_indices=True)
+        if len(fi) == 0:
+            return None
+        total = forward[1][fi] + backward[1][bi]
+        best = int(np.argmin(total))
+        if total[best] == np.inf:
+            return None
+        return int(forward[0][fi[best]])
+
+    def _upward(self, start, weight):
+        """
+        Upward search from start. Its search space is exactly its ancestors in
+        the elimination tree, visited in rank order, so each is final when
+        reached. Returns (ancestors, distances, arc reaching each or -1).
+        """
+        offsets, arc_upper, parent = self.cch['up_offsets'], self.cch['arc_upper'], self.cch['parent']
+        chain = [start]
+        while parent[chain[-1]] != -1:
+            chain.append(int(parent[chain[-1]]))
+        ancestors = np.array(chain, dtype=np.int64)
+        sorter = np.argsort(ancestors)
+
+        dist = np.full(len(chain), np.inf)
+        dist[0] = 0.0
+        via_arc = np.full(len(chain), -1, dtype=np.int64)
+        for i, node in enumerate(chain):
+            first, last = offsets[node], offsets[node + 1]
+            if dist[i] == np.inf or first == last:
+                continue
+            heads = sorter[np.searchsorted(ancestors, arc_upper[first:last], sorter=sorter)]
+            cost = dist[i] + weight[first:last]
+            better = cost < dist[heads]
+            dist[heads[better]] = cost[better]
+            via_arc[heads[better]] = np.arange(first, last)[better]
+        return ancestors, dist, via_arc
+
+    def _arc_chain(self, node, start, search):
+        """Arcs from node back down to start along an upward search tree."""
+        ancestors, _, via_arc = search
+        position = {n: i for i, n in enumerate(ancestors.tolist())}
+        arcs = []
+        while node != start:
+            arc = int(via_arc[position[node]])
+            arcs.append(arc)
+            node = int(self.cch['arc_lower'][arc])
+        return arcs
+
+    def _arc_id(self, lower, upper):
+        offsets = self.cch['up_offsets']
+        first, last = offsets[lower], offsets[lower + 1]
+        return int(first + np.searchsorted(self.cch['arc_upper'][first:last], upper))
+
+    def _unpack(self, arc, via, reverse):
+        """Street nodes along an arc, from its lower end (or upper end if reverse)."""
+        lower_of, upper_of = self.cch['arc_lower'], self.cch['arc_upper']
+        nodes = [int(upper_of[arc] if reverse else lower_of[arc])]
+        stack = [(arc, reverse)]
+        while stack:
+            arc, reverse = stack.pop()
+            middle = int(via[arc])
+            lower, upper = int(lower_of[arc]), int(upper_of[arc])
+            if middle < 0:
+                nodes.append(lower if reverse else upper)
+                continue
+            # lower -> upper is lower -> middle (arc middle-lower, reversed) then middle -> upper
+            to_lower, to_upper = self._arc_id(middle, lower), self._arc_id(middle, upper)
+            if reverse:
+                stack.append((to_lower, False))
+                stack.append((to_upper, True))
+            else:
+                stack.append((to_upper, False))
+                stack.append((to_lower, True))
+        return nodes
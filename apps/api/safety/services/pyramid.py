@@ -0,0 +1,117 @@
+import h3
+import numpy as np
+import pandas as pd
+from safety.models import RiskScore
+from safety.services.scoring import ScoringService
+from safety.services.response_cache import RouteCache
+from safety.services.score_writer import RiskScoreWriter
+
+# Resolutions cells are scored at directly: 9 for NYC incidents, 7 for state baselines
+NATIVE_RESOLUTIONS = (7, 9)
+
+# Roll-up levels, finest first. Each level is built from the one before it.
+PYRAMID_RESOLUTIONS = (6, 5, 4, 3)
+
+# Cells per h3_id__in query
+QUERY_BATCH_SIZE = 5000
+
+class ScorePyramidBuilder:
+    """
+    Rolls scored cells up the H3 hierarchy so zoomed-out maps can draw a
+    few hundred coarse hexes instead of every scored cell.
+    A parent's score is the incident-weighted mean of its children (plain
+    mean if none of them have incidents). Its incident_count is the summed
+    weight, and confidence follows that count like it does for a single cell.
+    """
+
+    def build(self, cells=None):
+        """
+        Rebuilds every pyramid level, or only the ancestors of the given
+        scored cells. Returns the number of pyramid rows written.
+        """
+        total = 0
+        child_resolutions = NATIVE_RESOLUTIONS
+        changed = None if cells is None else set(cells)
+
+        for level in PYRAMID_RESOLUTIONS:
+            parents = None
+            if changed is not None:
+                parents = {h3.cell_to_parent(c, level) for c in changed}
+
+            rows = self._child_rows(child_resolutions, level, parents)
+            results = self._roll_up(rows, level)
+            RiskScoreWriter().write(results)
+            self._delete_empty_parents(level, parents, {r['h3_id'] for r in results})
+
+            total += len(results)
+            child_resolutions = (level,)
+            changed = parents
+
+        return total
+
+    def _child_rows(self, child_resolutions, level, parents=None):
+        """(h3_id, time_bucket, score, incident_count) of the cells under parents (all if None)."""
+        children = RiskScore.objects.filter(resolution__in=child_resolutions)
+        fields = ('h3_id', 'time_bucket', 'score', 'incident_count')
+        if parents is None:
+            return list(children.values_list(*fields))
+
+        candidates = [
+            child
+            for parent in parents
+            for res in child_resolutions
+            for child in h3.cell_to_children(parent, res)
+        ]
+        rows = []
+        for i in range(0, len(candidates), QUERY_BATCH_SIZE):
+            batch = candidates[i:i + QUERY_BATCH_SIZE]
+            rows.extend(children.filter(h3_id__in=batch).values_list(*fields))
+        return rows
+
+    def _roll_up(self, rows, level):
+        if not rows:
+            return []
+
+        frame = pd.DataFrame.from_records(rows, columns=['h3_id', 'time_bucket', 'score', 'incident_count'])
+        frame['parent'] = [h3.cell_to_parent(c, level) for c in frame['h3_id']]
+        frame['weighted'] = frame['score'] * frame['incident_count']
+
+        grouped = frame.groupby(['parent', 'time_bucket']).agg(
+            weighted=('weighted', 'sum'),
+            weight=('incident_count', 'sum'),
+            mean_score=('score', 'mean')
+        )
+        weight = grouped['weight'].to_numpy()
+        score = np.where(
+            weight > 0,
+            grouped['weighted'].to_numpy() / np.maximum(weight, 1),
+            grouped['mean_score'].to_numpy()
+        )
+        score = np.rint(score).astype(np.int64)
+
+        results = []
+        for i, (parent, time_bucket) in enumerate(grouped.index):
+            incident_count = int(weight[i])
+            results.append({
+                'h3_id': parent,
+                'time_bucket': time_bucket,
+                'score': int(score[i]),
+                'confidence': ScoringService.confidence_for_count(incident_count),
+                'reasons': [{
+                    "factor": "aggregate",
+                    "impact": "neutral",
+                    "score_impact": 0,
+                    "detail": f"Regional Aggregate: Weighted by {incident_count} reported incidents across this area."
+                }],
+                'incident_count': incident_count
+            })
+        return results
+
+    def _delete_empty_parents(self, level, parents, built):
+        existing = RiskScore.objects.filter(resolution=level)
+        if parents is not None:
+            existing = existing.filter(h3_id__in=parents)
+        empty = set(existing.values_list('h3_id', flat=True)) - built
+        if empty:
+            RiskScore.objects.filter(resolution=level, h3_id__in=empty).delete()
+            RouteCache.bump_score_version()
@@ -0,0 +1,137 @@
+from django.conf import settings
+from django.core.cache import cache
+import h3
+import hashlib
+import json
+import time
+
+# Cached responses are versioned per cell at this resolution. The context
+# endpoints read a res 9 cell and fall back to its res 7 parent, so bumping
+# the res 7 version covers both.
+VERSION_RESOLUTION = 7
+
+# ContextAlertsView reads alerts this many res 9 rings around the point
+ALERT_RING = 5
+
+KEY_PREFIX = "resp"
+
+# Stamp of the last RiskScore change, shared by every route key
+SCORE_VERSION_KEY = f"{KEY_PREFIX}:score_version"
+
+class ResponseCache:
+    """
+    Caches API responses keyed by (endpoint, h3_id, resolution, params) in
+    the default (Redis) cache, with a TTL per endpoint from RESPONSE_CACHE_TTLS.
+
+    Every key embeds the current version of the cell's res 7 parent, so
+    invalidate_cells() drops all responses under a cell with one write per
+    parent instead of a key scan. Hit and miss counts are kept in Redis so
+    they add up across API workers.
+    """
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.timeout = settings.RESPONSE_CACHE_TTLS[endpoint]
+
+    def key(self, h3_id, resolution, params=None):
+        """Builds the cache key for a lookup. Read it before computing the response."""
+        parent = _version_cell(h3_id)
+        version = cache.get(_version_key(parent), 0) if parent else 0
+        digest = hashlib.sha1(json.dumps(params or {}, sort_keys=True).encode()).hexdigest()[:16]
+        return f"{KEY_PREFIX}:{self.endpoint}:{resolution}:{h3_id}:{version}:{digest}"
+
+    def get(self, key):
+        """Returns the cached response data, or None on a miss."""
+        data = cache.get(key)
+        self._count("hits" if data is not None else "misses")
+        return data
+
+    def set(self, key, data):
+        cache.set(key, data, timeout=self.timeout)
+
+    def _count(self, outcome):
+        counter = _stats_key(self.endpoint, outcome)
+        if not cache.add(counter, 1, timeout=None):
+            cache.incr(counter)
+
+    @staticmethod
+    def invalidate_cells(cells, ring=0):
+        """
+        Drops cached responses for the given cells, and for every cell within
+        `ring` of them when a response reads a neighbourhood (e.g. alerts).
+        Returns the number of versions bumped.
+        """
+        parents = set()
+        for cell in cells:
+            area = h3.grid_disk(cell, ring) if ring else (cell,)
+            parents.update(p for p in map(_version_cell, area) if p)
+
+        if parents:
+            version = time.time_ns()
+            cache.set_many({_version_key(p): version for p in parents}, timeout=None)
+        return len(parents)
+
+    @staticmethod
+    def stats():
+        """Hit and miss counts per endpoint since the counters were created."""
+        endpoints = list(settings.RESPONSE_CACHE_TTLS)
+        counts = cache.get_many([_stats_key(e, o) for e in endpoints for o in ("hits", "misses")])
+
+        stats = {}
+        for endpoint in endpoints:
+            hits = counts.get(_stats_key(endpoint, "hits"), 0)
+            misses = counts.get(_stats_key(endpoint, "misses"), 0)
+            total = hits + misses
+            stats[endpoint] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / total, 3) if total else None
+            }
+        return stats
+
+class RouteCache(ResponseCache):
+    """
+    Caches route responses keyed by the OSM nodes both ends snap to, the
+    time bucket, the routing options and the score version. Any change to
+    RiskScore bumps the version (see bump_score_version), so every route
+    cached before it is simply never read again and expires with its TTL.
+    """
+
+    def __init__(self):
+        super().__init__("routes")
+
+    def route_key(self, origin, destination, time_bucket, score_version, params=None):
+        """Builds the cache key for a route between two snapped node ids (see score_version)."""
+        digest = hashlib.sha1(json.dumps(params or {}, sort_keys=True).encode()).hexdigest()[:16]
+        return (
+            f"{KEY_PREFIX}:{self.endpoint}:{origin}:{destination}:{time_bucket}:"
+            f"{score_version}:{digest}"
+        )
+
+    @staticmethod
+    def score_version():
+        """Stamp of the last RiskScore change, or 0 if none was recorded."""
+        return cache.get(SCORE_VERSION_KEY, 0)
+
+    @staticmethod
+    def bump_score_version():
+        """
+        Records a RiskScore change. Called by RiskScoreWriter and wherever
+        scores are deleted, whether or not a ScoringRun is open.
+        """
+        version = time.time_ns()
+        cache.set(SCORE_VERSION_KEY, version, timeout=None)
+        return version
+
+def _version_cell(h3_id):
+    """Res 7 ancestor of a cell, or None for coarser (pyramid) cells no endpoint caches."""
+    resolution = h3.get_resolution(h3_id)
+    if resolution < VERSION_RESOLUTION:
+        return None
+    return h3.cell_to_parent(h3_id, VERSION_RESOLUTION)
+
+def _version_key(parent):
+    return f"{KEY_PREFIX}:v:{parent}"
+
+def _stats_key(endpoint, outcome):
+    return f"{KEY_PREFIX}:stats:{endpoint}:{outcome}"
@@ -1,49 +1,185 @@
-import networkx as nx
-import osmnx as ox
 import h3
+import numpy as np
 from safety.models import RiskScore
+from safety.services.compact_graph import BudgetExceeded, check_deadline
+from safety.services.graph_store import WalkGraphStore
+from safety.services.hierarchy import HierarchyRouter
 from django.conf import settings
+import time
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Routing works in risk, 0 (safe) to 100, which is 100 minus the RiskScore
+# safety score. Streets with no score at either resolution have no recorded
+# incidents (a fresh cell scores 100, risk 0); they get a little risk so a
+# scored, clean street still wins a tie.
+MAX_SCORE = 100
+DEFAULT_RISK = 10
 
-# Configure OSMnx globally
-# Fix for "This area is ... times your configured Overpass max query area size"
-ox.settings.use_cache = True
-ox.settings.log_console = False
-ox.settings.max_query_area_size = 2500000000 # 2500 sq km
+# Cells per h3_id__in query
+RISK_QUERY_BATCH_SIZE = 5000
+
+# Risk penalty: weight = length * (1 + risk / 100 * alpha)
+DEFAULT_ALPHA = 5.0
+
+# Weightings tried for alternative routes, from shortest (0) to safest
+ALTERNATIVE_ALPHAS = (0.0, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+# Largest weighting a request may ask for
+MAX_ALPHA = 20.0
+
+# Routes spanning more than this (degrees, ~5.5 km) use long-distance mode
+SHORT_ROUTE_SPAN = 0.05
+
+# Share of the route span added around it, so detours fit in the graph
+LONG_ROUTE_PADDING = 0.1
 
 class RoutingService:
     def __init__(self):
-        pass
+        self.graphs = WalkGraphStore()
+
+    def edge_risk(self, edge_cell, time_bucket):
+        """
+        Risk (100 - safety score) per edge from the edges' H3 cells (e.g.
+        CompactGraph.edge_cell), as a float32 array aligned with them. Street cells (res 9) without a score fall back to their
+        res 7 baseline, like the snapshot endpoint, then to DEFAULT_RISK.
+        """
+        cells, edge_cell_index = np.unique(edge_cell, return_inverse=True)
+        h3_ids = [h3.int_to_str(c) for c in cells.tolist()]
+        parents = [h3.cell_to_parent(c, 7) for c in h3_ids]
+
+        wanted = sorted(set(h3_ids) | set(parents))
+        scores = {}
+        for i in range(0, len(wanted), RISK_QUERY_BATCH_SIZE):
+            scores.update(
+                RiskScore.objects.filter(h3_id__in=wanted[i:i + RISK_QUERY_BATCH_SIZE], time_bucket=time_bucket)
+                                 .values_list('h3_id', 'score')
+            )
+
+        # Safety scores are 100 for safe, so invert them at the join
+        risks = {h3_id: MAX_SCORE - score for h3_id, score in scores.items()}
+        cell_risk = np.array(
+            [risks.get(c, risks.get(p, DEFAULT_RISK)) for c, p in zip(h3_ids, parents)],
+            dtype=np.float32
+        )
+        return cell_risk[edge_cell_index]
 
     def get_graph_for_area(self, north, south, east, west):
-        """Fetch walking graph for the bounding box."""
+        """Walking graph for the bounding box, from the prebuilt metro graphs on disk."""
         # Add buffer to ensure we cover edge cases
-        return ox.graph_from_bbox(
-            bbox=(north + 0.01, south - 0.01, east + 0.01, west - 0.01),
-            network_type='walk',
-            simplify=True
+        return self.graphs.graph_for_bbox(
+            north + 0.01, south - 0.01, east + 0.01, west - 0.01,
+            max_bytes=settings.ROUTING_MAX_GRAPH_MB * 1024 * 1024
         )
 
-    def calculate_safer_route(self, start_lat, start_lng, end_lat, end_lng):
+    def snap_endpoints(self, start_lat, start_lng, end_lat, end_lng):
+        """
+        OSM ids of the nodes a route between the points starts and ends at,
+        found without loading a routing graph (e.g. for cache keys), or None
+        if either point has no street nearby.
+        """
+        origin = self.graphs.nearest_node_id(start_lat, start_lng)
+        destination = self.graphs.nearest_node_id(end_lat, end_lng)
+        if origin is None or destination is None:
+            return None
+        return origin, destination
+
+    def calculate_safer_route(self, start_lat, start_lng, end_lat, end_lng,
+                              time_bucket=RiskScore.TimeBucket.DAY, alpha=DEFAULT_ALPHA):
         """
         Calculates a route that balances distance and safety.
-        Returns GeoJSON feature.
+        Risk comes from the RiskScore rows of the given time bucket.
+        Returns GeoJSON feature, or None if no route is found.
+        Raises BudgetExceeded if the route is too long for the graph memory
+        or time one request may use (ROUTING_MAX_* / ROUTING_TIME_BUDGET_S).
+        The memory limit covers the request's whole graph working set, and
+        the deadline is checked between loading, scoring and every search.
         """
+        return self.safer_routes(start_lat, start_lng, end_lat, end_lng, time_bucket, [alpha])[0]
+
+    def route_alternatives(self, start_lat, start_lng, end_lat, end_lng,
+                           time_bucket=RiskScore.TimeBucket.DAY, alpha=DEFAULT_ALPHA, k=3):
+        """
+        Up to k routes along the distance / risk trade-off: the route for alpha
+        first, then others from ALTERNATIVE_ALPHAS from shortest to safest,
+        dropping duplicates and any route that another is both shorter and
+        safer than. Each alpha is a separate search (see safer_routes), so
+        this costs about one search per alpha. Each feature has
+        distance_meters and avg_risk as usual, plus its alpha.
+        Raises BudgetExceeded like calculate_safer_route.
+        """
+        alphas = [alpha] + [a for a in ALTERNATIVE_ALPHAS if a != alpha]
+        features = [
+            f for f in self.safer_routes(start_lat, start_lng, end_lat, end_lng, time_bucket, alphas)
+            if f is not None
+        ]
+
+        if not features:
+            return []
+
+        routes = []
+        seen = set()
+        for feature in features:
+            geometry = tuple(map(tuple, feature["geometry"]["coordinates"]))
+            if geometry not in seen:
+                seen.add(geometry)
+                routes.append(feature)
+
+        def stats(feature):
+            return feature["properties"]["distance_meters"], feature["properties"]["avg_risk"]
+
+        def dominated(route):
+            return any(stats(o) != stats(route) and all(a <= b for a, b in zip(stats(o), stats(route))) for o in routes)
+
+        # The route for the requested weighting is optimal for it, so on the
+        # front by construction; stats are rounded, so it is never filtered.
+        chosen = min(routes, key=lambda r: abs(r["properties"]["alpha"] - alpha))
+        others = sorted((r for r in routes if r is not chosen and not dominated(r)), key=stats)
+        if len(others) > k - 1:
+            # Spread the rest evenly from shortest to safest
+            picks = np.linspace(0, len(others) - 1, k - 1).round().astype(int) if k > 1 else []
+            others = [others[i] for i in picks]
+        return [chosen] + others
+
+    def safer_routes(self, start_lat, start_lng, end_lat, end_lng, time_bucket, alphas):
+        """
+        Route features for each risk weighting in alphas (None where no route).
+        They share the graph, risk lookup and snapped end nodes, but each
+        alpha runs its own independent search; no search state is reused.
+        Raises BudgetExceeded like calculate_safer_route.
+        """
+        deadline = time.monotonic() + settings.ROUTING_TIME_BUDGET_S
+        features = [None] * len(alphas)
         try:
             # 0. Safety Guardrail: Distance
             # Simple Euclidean approx for MVP check (or use Haversine if stricty needed)
-            # 1 deg lat ~ 111km. 0.05 deg ~ 5.5km
+            # 1 deg lat ~ 111km. 0.05 deg ~ 5.5km, 0.5 deg ~ 55km
             print(f"DEBUG: Routing Request: {start_lat},{start_lng} -> {end_lat},{end_lng}", flush=True)
-            if abs(start_lat - end_lat) > 0.05 or abs(start_lng - end_lng) > 0.05:
-                print(f"DEBUG: Route too long: {start_lat},{start_lng} -> {end_lat},{end_lng}", flush=True)
-                return None
+            span = max(abs(start_lat - end_lat), abs(start_lng - end_lng))
+            if span > settings.ROUTING_MAX_SPAN_DEG:
+                raise BudgetExceeded(
+                    f"Route spans {span:.2f} degrees, over the {settings.ROUTING_MAX_SPAN_DEG:g} degree limit"
+                )
+
+            # High penalty for risk.
+            # With alpha 5: if risk is 100 (safety score 0), weight becomes length * 6.
+            # If risk is 0 (safety score 100), weight is length * 1.
+
+            # Metro-wide contraction hierarchy, when one is customized for this weighting
+            for i, alpha in enumerate(alphas):
+                features[i] = self.route_with_hierarchy(start_lat, start_lng, end_lat, end_lng, time_bucket, alpha)
+            pending = [i for i, feature in enumerate(features) if feature is None]
+            if not pending:
+                return self.tag_alphas(features, alphas)
 
             # 1. Fetch Graph
             # Determine bbox with padding
             pad = 0.002 # ~200m padding
+            if span > SHORT_ROUTE_SPAN:
+                # Long-distance mode: stitch every tile along the way, with
+                # room for detours, within the request's memory and time budget
+                pad = max(pad, span * LONG_ROUTE_PADDING)
             north = max(start_lat, end_lat) + pad
             south = min(start_lat, end_lat) - pad
             east = max(start_lng, end_lng) + pad
@@ -51,135 +187,218 @@ class RoutingService:
 
             print(f"DEBUG: Calculated BBox: N={north}, S={south}, E={east}, W={west}", flush=True)
 
-            # Sanity Check BBox size
-            if (north - south) > 0.05 or (east - west) > 0.05:
-                print(f"DEBUG: BBox too large ({north-south}, {east-west}). Aborting.", flush=True)
-                return None
-
-            print(f"DEBUG: OSMnx Max Query Area: {ox.settings.max_query_area_size}", flush=True)
-
-            # Fetch graph (this can be slow, ideally we cache this or use a local PBF in prod)
-            # For this MVP, we fetch live from Overpass with caching enabled
+            # Load graph (prebuilt from a local PBF, no network access)
             G = self.get_graph_for_area(north, south, east, west)
-            if not G:
-                return None
+            if G is None or G.node_count == 0:
+                return self.tag_alphas(features, alphas)
+            check_deadline(deadline)
+            logger.debug(f"Routing over {G.node_count} nodes ({G.nbytes // 2**20} MB)")
 
             # 2. Find nearest nodes
-            orig_node = ox.distance.nearest_nodes(G, start_lng, start_lat)
-            dest_node = ox.distance.nearest_nodes(G, end_lng, end_lat)
+            orig_node = G.nearest_node(start_lat, start_lng)
+            dest_node = G.nearest_node(end_lat, end_lng)
 
             # 3. Annotate Edges with Safety Weights
             # weight = length * (1 + risk_factor)
-            # risk_factor = score / 100 (normalized) * alpha (tuning param)
-            alpha = 5.0 # High penalty for risk.
-            # If score is 100 (high risk), weight becomes length * 6.
-            # If score is 0 (safe), weight is length * 1.
-
-            # Batch fetch H3 scores? Or fetch all for bbox?
-            # Fetching all scores in the bbox is efficient.
-            # Get H3 cells for the bbox bounds?
-            # Actually, let's just create a set of H3 tokens for every edge midpoint.
-
-            # Optimization: Pre-fetch all RiskScores in the BBox if feasible.
-            # For now, let's just iterate edges. It might be slow but it's MVP.
-
-            # Better: Get all RiskScore objects for resolution 9 in the bbox area?
-            # H3 doesn't support bbox query natively easily without polyfill.
-            # Let's simple check midpoint of edge.
-
-            # Cache of H3 scores
-            h3_score_cache = {}
-
-            for u, v, k, data in G.edges(keys=True, data=True):
-                # Calculate edge midpoint
-                # If geometry exists, use it. Else average u, v.
-                if 'geometry' in data:
-                    # Shapely geom
-                    # Centroid is easy
-                    midpoint = data['geometry'].centroid
-                    lat, lng = midpoint.y, midpoint.x
-                else:
-                    node_u = G.nodes[u]
-                    node_v = G.nodes[v]
-                    lat = (node_u['y'] + node_v['y']) / 2
-                    lng = (node_u['x'] + node_v['x']) / 2
-
-                # Get H3 index (v4 API)
-                try:
-                    h3_index = h3.latlng_to_cell(lat, lng, 9)
-                except AttributeError:
-                     # Fallback for older h3-py versions
-                    h3_index = h3.geo_to_h3(lat, lng, 9) # Use res 9 for street level granularity
-
-                # Lookup Score
-                if h3_index not in h3_score_cache:
-                    # Inefficient N+1 query. FIXME: Bulk load later.
-                    try:
-                        rs = RiskScore.objects.filter(h3_index=h3_index).first()
-                        score = rs.score if rs else 10 # Default to low risk if unknown
-                    except Exception:
-                        score = 10
-                    h3_score_cache[h3_index] = score
-
-                risk_score = h3_score_cache[h3_index]
-
-                # Calculate Cost
-                length = data.get('length', 10) # meters
+            # risk_factor = risk / 100 (normalized) * alpha (tuning param)
 
+            # Every edge carries the H3 cell (res 9) of its midpoint from the
+            # graph build; all of their scores come from one bulk query.
+            edge_risk = self.edge_risk(G.edge_cell, time_bucket)
+            check_deadline(deadline)
+
+            for i in pending:
                 # Cost Function
                 # safety_cost = length * (1 + (risk/100 * alpha))
                 # If risk=0, cost=length.
-                # If risk=100, cost=length * (1 + 5) = 6 * length
-                risk_multiplier = 1 + (risk_score / 100.0) * alpha
-                data['safety_weight'] = length * risk_multiplier
-                data['risk_score'] = risk_score # for debug
-
-            # 4. Run A* Shortest Path
-            route = nx.shortest_path(G, orig_node, dest_node, weight='safety_weight')
-
-            # 5. Extract Geometry
-            # route_nodes is list of node IDs
-            route_coords = []
-            for node_id in route:
-                node = G.nodes[node_id]
-                route_coords.append([node['x'], node['y']]) # GeoJSON is [lng, lat]
-
-            # 6. Calculate Stats
-            total_dist = sum(nx.utils.pairwise(route)) # wait, need lengths
-            # calculate total physical length
-            real_length = 0
-            total_risk_accum = 0
-            for u, v in zip(route[:-1], route[1:]):
-                # get edge data
-                # MultiDiGraph, so there might be multiple edges. Get the one with min safety_weight
-                edge_data = G.get_edge_data(u, v)
-                # edge_data is a dict of key->data. Find the one with min safety_weight
-                best_key = min(edge_data, key=lambda k: edge_data[k]['safety_weight'])
-                data = edge_data[best_key]
-                real_length += data.get('length', 0)
-                total_risk_accum += data.get('risk_score', 0) * data.get('length', 0)
-
-            avg_risk = total_risk_accum / real_length if real_length > 0 else 0
-
-            return {
-                "type": "Feature",
-                "geometry": {
-                    "type": "LineString",
-                    "coordinates": route_coords
-                },
-                "properties": {
-                    "distance_meters": round(real_length),
-                    "avg_risk": round(avg_risk),
-                    "safety_level": "High" if avg_risk < 30 else ("Medium" if avg_risk < 60 else "Low"),
-                    "explanation": [
-                        f"Route avoids high-risk zones (avg risk {round(avg_risk)}/100).",
-                        f"Distance: {round(real_length)} meters."
-                    ]
-                }
-            }
+                # If risk=100, cost=length * (1 + alpha)
+                safety_weight = G.lengths * (1 + (edge_risk / 100.0) * alphas[i])
+
+                # 4. Run A* Shortest Path (bidirectional, straight-line heuristic)
+                path = G.bidirectional_shortest_path(orig_node, dest_node, safety_weight, deadline)
+                if path is None:
+                    continue
+                route, route_edges = path
+
+                # 5. Extract Geometry
+                # GeoJSON is [lng, lat]
+                route_coords = np.column_stack([G.lng[route], G.lat[route]]).tolist()
+
+                # 6. Calculate Stats
+                # calculate total physical length
+                lengths = G.lengths[route_edges].astype(np.float64)
+                real_length = float(lengths.sum())
+                total_risk_accum = float((edge_risk[route_edges] * lengths).sum())
 
+                features[i] = self.route_feature(route_coords, real_length, total_risk_accum)
+
+            return self.tag_alphas(features, alphas)
+
+        except BudgetExceeded:
+            raise
         except Exception as e:
             logger.error(f"Routing failed: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            return [None] * len(alphas)
+
+    def tag_alphas(self, features, alphas):
+        """Records the risk weighting of each route in its properties."""
+        for feature, alpha in zip(features, alphas):
+            if feature is not None:
+                feature["properties"]["alpha"] = alpha
+        return features
+
+    def route_matrix(self, origins, destinations, pairs, time_bucket=RiskScore.TimeBucket.DAY, alpha=DEFAULT_ALPHA):
+        """
+        Distance, safety-weighted cost and average risk for each (origin index,
+        destination index) in pairs, between [lat, lng] points. All pairs share
+        one graph and one risk lookup, and each origin runs one search to all
+        of its destinations (or one upward search on a hierarchy).
+        Returns lists aligned with pairs, None where there is no route.
+        Raises BudgetExceeded like calculate_safer_route.
+        """
+        deadline = time.monotonic() + settings.ROUTING_TIME_BUDGET_S
+
+        points = np.array(list(origins) + list(destinations), dtype=np.float64).reshape(-1, 2)
+        span = float(np.ptp(points, axis=0).max())
+        if span > settings.ROUTING_MAX_SPAN_DEG:
+            raise BudgetExceeded(
+                f"Points span {span:.2f} degrees, over the {settings.ROUTING_MAX_SPAN_DEG:g} degree limit"
+            )
+
+        found = self.matrix_with_hierarchy(origins, destinations, pairs, time_bucket, alpha)
+        if found is None:
+            found = self.matrix_with_graph(origins, destinations, pairs, time_bucket, alpha, span, deadline)
+        if found is None:
+            return None
+
+        cost, length, risk = found
+        reachable = np.isfinite(cost)
+        walked = reachable & (length > 0)
+        avg_risk = np.zeros(len(cost))
+        avg_risk[walked] = risk[walked] / length[walked]
+
+        return {
+            "distance_meters": [round(d) if ok else None for d, ok in zip(length.tolist(), reachable)],
+            "cost": [round(c, 1) if ok else None for c, ok in zip(cost.tolist(), reachable)],
+            "avg_risk": [round(r) if ok else None for r, ok in zip(avg_risk.tolist(), reachable)]
+        }
+
+    def matrix_with_hierarchy(self, origins, destinations, pairs, time_bucket, alpha):
+        """(cost, meters, risk sum) per pair from the metro's hierarchy, or None to fall back to A*."""
+        if alpha not in settings.ROUTING_CH_ALPHAS:
+            return None
+
+        lats = [p[0] for p in list(origins) + list(destinations)]
+        lngs = [p[1] for p in list(origins) + list(destinations)]
+        metro = self.graphs.metro_for_bbox(max(lats), min(lats), max(lngs), min(lngs))
+        if metro is None:
             return None
+
+        router = HierarchyRouter(metro)
+        if not router.available:
+            return None
+
+        origin_nodes = [router.nearest_node(lat, lng) for lat, lng in origins]
+        dest_nodes = [router.nearest_node(lat, lng) for lat, lng in destinations]
+        snapped = [i for i, (o, d) in enumerate(pairs) if origin_nodes[o] is not None and dest_nodes[d] is not None]
+
+        found = router.table(
+            [origin_nodes[pairs[i][0]] for i in snapped],
+            [dest_nodes[pairs[i][1]] for i in snapped],
+            time_bucket, alpha
+        )
+        if found is None:
+            return None
+
+        cost = np.full(len(pairs), np.inf)
+        length = np.full(len(pairs), np.inf)
+        risk = np.full(len(pairs), np.inf)
+        cost[snapped], length[snapped], risk[snapped] = found
+        return cost, length, risk
+
+    def matrix_with_graph(self, origins, destinations, pairs, time_bucket, alpha, span, deadline):
+        """(cost, meters, risk sum) per pair from one-to-many searches on the stitched tiles, or None."""
+        lats = [p[0] for p in list(origins) + list(destinations)]
+        lngs = [p[1] for p in list(origins) + list(destinations)]
+        pad = max(0.002, span * LONG_ROUTE_PADDING)
+        G = self.get_graph_for_area(max(lats) + pad, min(lats) - pad, max(lngs) + pad, min(lngs) - pad)
+        if G is None or G.node_count == 0:
+            return None
+        check_deadline(deadline)
+
+        edge_risk = self.edge_risk(G.edge_cell, time_bucket)
+        check_deadline(deadline)
+        safety_weight = G.lengths * (1 + (edge_risk / 100.0) * alpha)
+        risk_length = G.lengths * edge_risk
+
+        origin_nodes = [G.nearest_node(lat, lng) for lat, lng in origins]
+        dest_nodes = [G.nearest_node(lat, lng) for lat, lng in destinations]
+
+        cost = np.full(len(pairs), np.inf)
+        length = np.full(len(pairs), np.inf)
+        risk = np.full(len(pairs), np.inf)
+        by_origin = {}
+        for i, (o, d) in enumerate(pairs):
+            by_origin.setdefault(o, []).append(i)
+        for o, indices in by_origin.items():
+            targets = [dest_nodes[pairs[i][1]] for i in indices]
+            cost[indices], length[indices], risk[indices] = G.one_to_many(
+                origin_nodes[o], targets, safety_weight, risk_length, deadline
+            )
+        return cost, length, risk
+
+    def route_with_hierarchy(self, start_lat, start_lng, end_lat, end_lng, time_bucket, alpha):
+        """
+        Routes on the metro's contraction hierarchy if one is built and
+        customized for this time bucket and alpha (see ROUTING_CH_ALPHAS)
+        from the current scores. Returns the route feature, or None to fall back to A*.
+        """
+        if alpha not in settings.ROUTING_CH_ALPHAS:
+            return None
+
+        metro = self.graphs.metro_for_bbox(
+            max(start_lat, end_lat), min(start_lat, end_lat),
+            max(start_lng, end_lng), min(start_lng, end_lng)
+        )
+        if metro is None:
+            return None
+
+        router = HierarchyRouter(metro)
+        if not router.available:
+            return None
+
+        source = router.nearest_node(start_lat, start_lng)
+        target = router.nearest_node(end_lat, end_lng)
+        if source is None or target is None:
+            return None
+
+        found = router.route(source, target, time_bucket, alpha)
+        if found is None:
+            return None
+
+        nodes, real_length, total_risk_accum = found
+        route_coords = np.column_stack([router.cch['lng'][nodes], router.cch['lat'][nodes]]).tolist()
+        return self.route_feature(route_coords, real_length, total_risk_accum)
+
+    def route_feature(self, route_coords, real_length, total_risk_accum):
+        """GeoJSON feature for a route from its [lng, lat] coordinates and totals."""
+        avg_risk = total_risk_accum / real_length if real_length > 0 else 0
+
+        return {
+            "type": "Feature",
+            "geometry": {
+                "type": "LineString",
+                "coordinates": route_coords
+            },
+            "properties": {
+                "distance_meters": round(real_length),
+                "avg_risk": round(avg_risk),
+                "safety_level": "High" if avg_risk < 30 else ("Medium" if avg_risk < 60 else "Low"),
+                "explanation": [
+                    f"Route avoids high-risk zones (avg risk {round(avg_risk)}/100).",
+                    f"Distance: {round(real_length)} meters."
+                ]
+            }
+        }
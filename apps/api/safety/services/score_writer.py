@@ -0,0 +1,84 @@
+from django.db import transaction
+from safety.models import RiskScore
+from safety.services.response_cache import RouteCache
+from geo.utils import h3_to_polygon
+import h3
+
+class RiskScoreWriter:
+    """
+    Bulk upserts scoring results into RiskScore.
+    All batches are swapped in inside one transaction with
+    INSERT .. ON CONFLICT (h3_id, time_bucket), so a cell never loses its
+    score mid-write. Rows whose score, confidence and reasons are unchanged
+    are not written at all. New rows get their hexagon geometry; a cell's
+    boundary never changes, so updates leave it alone. Once rows change,
+    the route cache's score version is bumped.
+    """
+
+    UPDATE_FIELDS = ['resolution', 'score', 'confidence', 'reasons_json', 'incident_count', 'updated_at']
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+
+    def write(self, results):
+        """
+        Upserts a list of result dicts (h3_id, time_bucket, score, confidence,
+        reasons, incident_count). Returns counts of inserted, updated and
+        unchanged rows.
+        """
+        stats = {'inserted': 0, 'updated': 0, 'unchanged': 0}
+
+        with transaction.atomic():
+            for i in range(0, len(results), self.batch_size):
+                self._write_batch(results[i:i + self.batch_size], stats)
+
+        if stats['inserted'] or stats['updated']:
+            # After the outermost commit, so no route is cached against the old rows under the new version
+            transaction.on_commit(RouteCache.bump_score_version)
+        return stats
+
+    def _write_batch(self, batch, stats):
+        existing = {
+            (rs.h3_id, rs.time_bucket): rs
+            for rs in RiskScore.objects.filter(h3_id__in={r['h3_id'] for r in batch})
+                                       .only('h3_id', 'time_bucket', 'resolution', 'score', 'confidence',
+                                             'reasons_json', 'incident_count')
+        }
+
+        to_write = []
+        for result in batch:
+            time_bucket = result['time_bucket']
+            current = existing.get((result['h3_id'], time_bucket))
+
+            if current and self._is_unchanged(current, result):
+                stats['unchanged'] += 1
+                continue
+
+            stats['updated' if current else 'inserted'] += 1
+            to_write.append(RiskScore(
+                h3_id=result['h3_id'],
+                time_bucket=time_bucket,
+                resolution=h3.get_resolution(result['h3_id']),
+                score=result['score'],
+                confidence=result['confidence'],
+                reasons_json=result['reasons'],
+                incident_count=result['incident_count'],
+                geometry=None if current else h3_to_polygon(result['h3_id'])
+            ))
+
+        if to_write:
+            RiskScore.objects.bulk_create(
+                to_write,
+                update_conflicts=True,
+                unique_fields=['h3_id', 'time_bucket'],
+                update_fields=self.UPDATE_FIELDS
+            )
+
+    @staticmethod
+    def _is_unchanged(current, result):
+        return (
+            current.score == result['score']
+            and current.confidence == result['confidence']
+            and current.reasons_json == result['reasons']
+            and current.incident_count == result['incident_count']
+        )
@@ -1,6 +1,20 @@
 from django.utils import timezone
-from django.db.models import Count, Avg
+from django.db.models import Count, Avg, Case, When, Value, CharField
+from django.db.models.functions import ExtractHour
 from ingest.models import IncidentNorm, EnvMetric
+from safety.models import RiskScore, DAY_START_HOUR, NIGHT_START_HOUR
+import numpy as np
+import pandas as pd
+
+def with_time_bucket(incidents):
+    """Annotates an IncidentNorm queryset with the day/night bucket of occurred_at."""
+    return incidents.annotate(hour=ExtractHour('occurred_at')).annotate(
+        time_bucket=Case(
+            When(hour__gte=DAY_START_HOUR, hour__lt=NIGHT_START_HOUR, then=Value(RiskScore.TimeBucket.DAY)),
+            default=Value(RiskScore.TimeBucket.NIGHT),
+            output_field=CharField()
+        )
+    )
 
 class ScoringService:
     """
@@ -8,13 +22,14 @@ class ScoringService:
     Fuses Crime History, Environmental Factors, and Alerts.
     """
 
-    def calculate_score(self, h3_id):
+    def calculate_score(self, h3_id, time_bucket=None):
         """
         Computes the overall Safety Score (0-100) for a given H3 cell.
+        time_bucket ('day'/'night') limits crime history to incidents from those hours.
         Returns dict with score, confidence, and reasons.
         """
         # 1. Crime Baseline
-        crime_score, crime_reasons = self._compute_crime_score(h3_id)
+        crime_score, crime_reasons = self._compute_crime_score(h3_id, time_bucket)
 
         # 2. Environmental Modifiers
         env_adjustment, env_reasons = self._compute_env_impact(h3_id)
@@ -28,7 +43,8 @@ class ScoringService:
         raw_score = crime_score + env_adjustment
 
         # 5. Confidence
-        confidence = self._compute_confidence(h3_id)
+        inc_count = self._incidents(h3_id, time_bucket).count()
+        confidence = self.confidence_for_count(inc_count)
 
         # 6. Score Clamping (Step 1)
         # If confidence is NOT high, score cannot be below 25.
@@ -40,21 +56,30 @@ class ScoringService:
         final_score = max(min_score_allowed, min(100, raw_score))
 
         return {
+            'h3_id': h3_id,
+            'time_bucket': time_bucket,
             'score': int(final_score),
             'confidence': confidence,
-            'reasons': crime_reasons + env_reasons
+            'reasons': crime_reasons + env_reasons,
+            'incident_count': inc_count
         }
 
-    def _compute_crime_score(self, h3_id):
+    def _incidents(self, h3_id, time_bucket=None):
+        incidents = IncidentNorm.objects.filter(h3_id=h3_id)
+        if time_bucket:
+            incidents = with_time_bucket(incidents).filter(time_bucket=time_bucket)
+        return incidents
+
+    def _compute_crime_score(self, h3_id, time_bucket=None):
         """
         Calculates score based on historical incidents.
         Start at 100 (Safe). Deduct based on count and severity.
         """
-        incidents = IncidentNorm.objects.filter(h3_id=h3_id)
+        incidents = self._incidents(h3_id, time_bucket)
         count = incidents.count()
 
         if count == 0:
-            return 100, [{"factor": "crime_history", "impact": "positive", "score_impact": 0, "detail": "No recent incidents reported"}]
+            return 100, self._crime_reasons(count, 100, 0)
 
         avg_severity = incidents.aggregate(Avg('severity'))['severity__avg'] or 0
 
@@ -66,12 +91,16 @@ class ScoringService:
 
         base_score = 100 - risk_val
 
-        # Determine dominant crime for explanation
-        # Step 3: Neutral Language
-        top_cat = incidents.values('category').annotate(c=Count('category')).order_by('-c').first()
-        topic = top_cat['category'] if top_cat else "incidents"
+        return base_score, self._crime_reasons(count, base_score, risk_val)
 
-        # Clean up topic string to be more neutral if needed, but primary categorization is handled below.
+    @staticmethod
+    def _crime_reasons(count, base_score, risk_val):
+        """
+        Builds the crime_history explanation for a cell.
+        Step 3: Neutral Language.
+        """
+        if count == 0:
+            return [{"factor": "crime_history", "impact": "positive", "score_impact": 0, "detail": "No recent incidents reported"}]
 
         reasons = []
         if base_score < 60:
@@ -96,20 +125,29 @@ class ScoringService:
                 "detail": "Historical Incident Context: Low density of reported incidents."
             })
 
-        return base_score, reasons
+        return reasons
 
     def _compute_env_impact(self, h3_id):
         """
         Calculates modifiers from environmental data.
         Returns: adjustment_value (float), list of reasons
         """
+        metrics = EnvMetric.objects.filter(h3_id=h3_id)
+
+        outages = metrics.filter(metric='street_light_outage').count()
+        subways = metrics.filter(metric='subway_entrance').count()
+
+        return self._env_impact(outages, subways)
+
+    @staticmethod
+    def _env_impact(outages, subways):
+        """
+        Turns environmental metric counts into a score adjustment and reasons.
+        """
         adjustment = 0.0
         reasons = []
 
-        metrics = EnvMetric.objects.filter(h3_id=h3_id)
-
         # Street Lights (Negative)
-        outages = metrics.filter(metric='street_light_outage').count()
         if outages > 0:
             # -5 points per outage, cap at -30
             pen = min(outages * 5, 30)
@@ -122,7 +160,6 @@ class ScoringService:
             })
 
         # Subway Entrances (Positive)
-        subways = metrics.filter(metric='subway_entrance').count()
         if subways > 0:
             # +5 points per entrance, cap at +20
             bonus = min(subways * 5, 20)
@@ -136,19 +173,110 @@ class ScoringService:
 
         return adjustment, reasons
 
-    def _compute_confidence(self, h3_id):
+    @staticmethod
+    def confidence_for_count(inc_count):
         """
         Estimates confidence based on data volume/recency.
         """
         # For V1, simple heuristic on incident count.
         # If we have 0 incidents, confidence is low unless we know we have good coverage.
         # Assuming YTD data covers NYC well.
-
-        inc_count = IncidentNorm.objects.filter(h3_id=h3_id).count()
-
         if inc_count > 50:
             return "high"
         elif inc_count > 5:
             return "medium"
         else:
             return "low"
+
+
+class BatchScoringService(ScoringService):
+    """
+    Whole-table variant of ScoringService.
+    Pulls grouped aggregates for many cells in a fixed number of queries
+    and applies the V1 heuristics column-wise with NumPy. Results are
+    identical to calling calculate_score(h3_id, time_bucket) per cell.
+    """
+
+    def score_cells(self, h3_ids=None):
+        """
+        Scores every cell that has incidents, or only the given cells, for
+        both the day and night buckets in one pass.
+        Returns a list of dicts with h3_id, time_bucket, score, confidence,
+        reasons and incident_count.
+        """
+        frame = self._load_aggregates(h3_ids)
+        if frame.empty:
+            return []
+
+        count = frame['incident_count'].to_numpy(dtype=np.int64)
+        avg_severity = frame['avg_severity'].to_numpy(dtype=np.float64)
+        outages = frame['street_light_outage'].to_numpy(dtype=np.int64)
+        subways = frame['subway_entrance'].to_numpy(dtype=np.int64)
+
+        # 1. Crime Baseline (same heuristic as _compute_crime_score)
+        risk_val = (count * 2.0) + (avg_severity * 0.5)
+        base_score = np.where(count > 0, 100 - risk_val, 100.0)
+
+        # 2. Environmental Modifiers (same caps as _env_impact)
+        adjustment = 0.0 - np.minimum(outages * 5, 30) + np.minimum(subways * 5, 20)
+
+        # 4. Fusion + 5. Confidence + 6. Clamping
+        raw_score = base_score + adjustment
+        confidence = np.select([count > 50, count > 5], ["high", "medium"], default="low")
+        min_score_allowed = np.where(confidence == "high", 0, 25)
+        final_score = np.maximum(min_score_allowed, np.minimum(100, raw_score)).astype(np.int64)
+
+        results = []
+        for i, (h3_id, time_bucket) in enumerate(frame.index):
+            reasons = self._crime_reasons(int(count[i]), float(base_score[i]), float(risk_val[i]))
+            reasons += self._env_impact(int(outages[i]), int(subways[i]))[1]
+            results.append({
+                'h3_id': h3_id,
+                'time_bucket': time_bucket,
+                'score': int(final_score[i]),
+                'confidence': str(confidence[i]),
+                'reasons': reasons,
+                'incident_count': int(count[i])
+            })
+
+        return results
+
+    def _load_aggregates(self, h3_ids=None):
+        """
+        Returns a DataFrame indexed by (h3_id, time_bucket) with incident_count,
+        avg_severity and per-metric environmental counts, using one GROUP BY
+        per table. Every active cell gets a row for both buckets.
+        """
+        incidents = IncidentNorm.objects.all()
+        metrics = EnvMetric.objects.filter(metric__in=['street_light_outage', 'subway_entrance'])
+        if h3_ids is not None:
+            h3_ids = list(h3_ids)
+            incidents = incidents.filter(h3_id__in=h3_ids)
+            metrics = metrics.filter(h3_id__in=h3_ids)
+
+        incident_rows = with_time_bucket(incidents).values('h3_id', 'time_bucket') \
+            .annotate(incident_count=Count('id'), avg_severity=Avg('severity')) \
+            .order_by()
+        frame = pd.DataFrame.from_records(
+            list(incident_rows),
+            columns=['h3_id', 'time_bucket', 'incident_count', 'avg_severity']
+        ).set_index(['h3_id', 'time_bucket'])
+
+        # Like calculate_risk_scores, only cells with incidents are scored,
+        # but a cell with only night incidents still gets a day score.
+        cells = frame.index.get_level_values('h3_id').unique()
+        frame = frame.reindex(pd.MultiIndex.from_product(
+            [cells, RiskScore.TimeBucket.values],
+            names=['h3_id', 'time_bucket']
+        ))
+
+        metric_rows = metrics.values('h3_id', 'metric').annotate(c=Count('id')).order_by()
+        env = pd.DataFrame.from_records(list(metric_rows), columns=['h3_id', 'metric', 'c'])
+        env = env.pivot_table(index='h3_id', columns='metric', values='c', aggfunc='sum')
+
+        frame = frame.join(env, how='left')
+        for metric in ('street_light_outage', 'subway_entrance'):
+            if metric not in frame.columns:
+                frame[metric] = 0
+        frame['avg_severity'] = frame['avg_severity'].fillna(0).astype(float)
+        return frame.fillna(0).sort_index()
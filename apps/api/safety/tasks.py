@@ -1,19 +1,126 @@
-from celery import shared_task
-from .calculators import calculate_risk_scores
+from celery import shared_task, chord
+from django.conf import settings
+from django.utils import timezone
+from .calculators import (
+    calculate_risk_scores,
+    calculate_dirty_risk_scores,
+    calculate_shard_risk_scores,
+    active_cells,
+    build_score_pyramid,
+    prune_risk_scores,
+)
+from .models import ScoringRun
+from .services.response_cache import RouteCache
 import logging
 
 logger = logging.getLogger(__name__)
 
 @shared_task
-def recompute_risk_scores_task():
+def recompute_risk_scores_task(full=False, sharded=False, shards=None):
     """
-    Periodic task to refresh all risk scores.
+    Periodic task to refresh risk scores.
+    By default only cells flagged dirty by ingest runs are rescored;
+    pass full=True to rescore every active cell, or sharded=True to fan a
+    full rescore out across workers (shards defaults to RISK_RECOMPUTE_SHARDS).
     """
-    logger.info("Starting scheduled risk score recomputation")
+    if sharded:
+        return start_sharded_recompute(shards or settings.RISK_RECOMPUTE_SHARDS)
+
+    mode = ScoringRun.Mode.FULL if full else ScoringRun.Mode.INCREMENTAL
+    run = ScoringRun.objects.create(mode=mode)
+    score_version = RouteCache.score_version()
+    logger.info(f"Starting scheduled risk score recomputation ({mode})")
     try:
-        count = calculate_risk_scores()
-        logger.info(f"Successfully recomputed scores for {count} cells")
-        return f"Recomputed {count} cells"
+        if full:
+            count = calculate_risk_scores()
+        else:
+            count = calculate_dirty_risk_scores()
+
+        run.status = ScoringRun.Status.SUCCESS
+        run.cells_scored = count
+        run.completed_at = timezone.now()
+        run.save()
+        logger.info(f"Successfully recomputed scores for {count} cells in {run.duration_seconds:.1f}s")
+        # Any write or delete bumps the version; until customized, routing skips the hierarchy
+        if RouteCache.score_version() != score_version:
+            customize_route_hierarchies_task.delay(run.id)
+        return f"Recomputed {count} cells ({mode})"
     except Exception as e:
+        run.status = ScoringRun.Status.FAILED
+        run.error_log = str(e)
+        run.completed_at = timezone.now()
+        run.save()
         logger.exception("Failed to recompute risk scores")
         raise e
+
+def start_sharded_recompute(shard_count):
+    """
+    Dispatches one score_risk_shard_task per shard as a chord whose callback
+    closes the ScoringRun. Returns the ScoringRun id.
+    """
+    run = ScoringRun.objects.create(mode=ScoringRun.Mode.SHARDED, shard_count=shard_count)
+    logger.info(f"Dispatching sharded risk score recomputation: run {run.id}, {shard_count} shards")
+
+    header = [score_risk_shard_task.s(run.id, shard, shard_count) for shard in range(shard_count)]
+    callback = finish_scoring_run_task.s(run.id).on_error(fail_scoring_run_task.si(run.id))
+    chord(header)(callback)
+    return run.id
+
+@shared_task(bind=True)
+def score_risk_shard_task(self, run_id, shard, shard_count):
+    """
+    Rescores one shard of a sharded run.
+    Progress is published as a PROGRESS state with done/total cell counts.
+    """
+    def report(done, total):
+        self.update_state(state='PROGRESS', meta={
+            'run_id': run_id,
+            'shard': shard,
+            'done': done,
+            'total': total,
+        })
+        logger.info(f"Scoring run {run_id} shard {shard + 1}/{shard_count}: {done}/{total} cells")
+
+    return calculate_shard_risk_scores(shard, shard_count, on_progress=report)
+
+@shared_task
+def finish_scoring_run_task(shard_counts, run_id):
+    """
+    Chord callback: drops cells left without incidents (shards only rescore
+    active cells), rolls up the pyramid, then records totals and timing for
+    a sharded run.
+    """
+    prune_risk_scores(active_cells())
+    build_score_pyramid()
+
+    run = ScoringRun.objects.get(id=run_id)
+    run.status = ScoringRun.Status.SUCCESS
+    run.cells_scored = sum(shard_counts)
+    run.completed_at = timezone.now()
+    run.save()
+    logger.info(f"Scoring run {run_id} finished: {run.cells_scored} cells in {run.duration_seconds:.1f}s")
+    customize_route_hierarchies_task.delay(run_id)
+    return f"Recomputed {run.cells_scored} cells ({run.shard_count} shards)"
+
+@shared_task
+def fail_scoring_run_task(run_id):
+    """Chord error callback: marks a sharded run as failed."""
+    ScoringRun.objects.filter(id=run_id).update(
+        status=ScoringRun.Status.FAILED,
+        completed_at=timezone.now(),
+        error_log="One or more shards failed"
+    )
+    logger.error(f"Scoring run {run_id} failed")
+
+@shared_task
+def customize_route_hierarchies_task(run_id=None):
+    """
+    Re-applies current risk scores to the routing contraction hierarchies
+    after a scoring run. Only the metric is recomputed; the hierarchy itself
+    depends on the street network alone. HierarchyRouter skips the metrics
+    from the moment scores change until this finishes, and routes use A*.
+    """
+    from .services.hierarchy import HierarchyCustomizer
+    count = HierarchyCustomizer().customize_all(score_run=run_id)
+    logger.info(f"Customized {count} routing hierarchy metrics (score run {run_id})")
+    return count
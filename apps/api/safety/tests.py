@@ -1,3 +1,808 @@
-from django.test import TestCase
+import socket
+import tempfile
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import h3
+import mapbox_vector_tile
+import networkx as nx
+import numpy as np
+from django.contrib.gis.geos import Point
+from django.core.cache import cache
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from geo.utils import h3_to_polygon, haversine_m, tile_bounds
+from ingest.models import DataSource, DirtyCell, EnvMetric, IncidentNorm, IngestRun
+from safety.calculators import (
+    active_cells,
+    calculate_dirty_risk_scores,
+    calculate_risk_scores,
+    calculate_shard_risk_scores,
+    rescore_cells,
+)
+from safety.models import RiskScore, ScoringRun
+from safety.tasks import finish_scoring_run_task
+from safety.services.compact_graph import BudgetExceeded, CompactGraph
+from safety.services.graph_store import WORKING_SET_FACTOR, WalkGraphBuilder, WalkGraphStore
+from safety.services.heatmap import TILE_EXTENT, TILE_LAYER_NAME, ZOOM_LEVELS
+from safety.services.hierarchy import HierarchyBuilder, HierarchyCustomizer, HierarchyRouter
+from safety.services.response_cache import RouteCache
+from safety.services.routing import DEFAULT_RISK, RoutingService
+from safety.services.score_writer import RiskScoreWriter
+from safety.services.scoring import BatchScoringService, ScoringService
+
+# 5 x 5 street grid, 0.002 degrees apart from (40.750, -73.990), with the
+# middle column a footway, plus a motorway and a private service road
+WALK_GRID_PBF = Path(__file__).resolve().parent / "fixtures" / "walk_grid.osm.pbf"
+WALK_GRID_BBOX = (-73.995, 40.745, -73.977, 40.763)
+
+
+def diamond_graph():
+    """
+    Two ways from node 0 (south) to node 3 (north): straight up through
+    node 1 (~1.1 km), or a dog-leg east through node 2 (~2 km).
+    """
+    node_id = np.array([10, 11, 12, 13], dtype=np.int64)
+    lat = np.array([40.750, 40.755, 40.755, 40.760])
+    lng = np.array([-73.990, -73.990, -73.980, -73.990])
+    u = np.array([0, 1, 0, 2])
+    v = np.array([1, 3, 2, 3])
+    length = haversine_m(lat[u], lng[u], lat[v], lng[v])
+    cell = np.array([
+        h3.str_to_int(h3.latlng_to_cell((lat[a] + lat[b]) / 2, (lng[a] + lng[b]) / 2, 9))
+        for a, b in zip(u, v)
+    ], dtype=np.uint64)
+    return CompactGraph.from_edges(node_id, lat, lng, u, v, length, cell)
+
+
+def three_way_graph():
+    """
+    Three ways from node 0 (south) to node 4 (north), through nodes 1, 2 and
+    3 ever further east: ~1.1 km, ~1.7 km and ~3.5 km. Returns the CompactGraph
+    and the risk of each way (90, 30 and 0); edge_cell carries the way's index.
+    """
+    node_id = np.arange(5)
+    lat = np.array([40.750, 40.755, 40.755, 40.755, 40.760])
+    lng = np.array([-73.990, -73.990, -73.982, -73.970, -73.990])
+    u = np.array([0, 1, 0, 2, 0, 3])
+    v = np.array([1, 4, 2, 4, 3, 4])
+    length = haversine_m(lat[u], lng[u], lat[v], lng[v])
+    graph = CompactGraph.from_edges(node_id, lat, lng, u, v, length, np.array([0, 0, 1, 1, 2, 2]))
+    return graph, np.array([90.0, 30.0, 0.0], dtype=np.float32)
+
+
+def random_graph(seed, n=80, extra_edges=80):
+    """
+    Random connected street graph in a ~2 km box, plus one isolated node
+    (the last), with a risk (0-100) per street. Returns the CompactGraph,
+    the per-edge risk aligned with it, and the same graph in NetworkX.
+    Streets are longer than the straight line between their ends, like real ones.
+    """
+    rng = np.random.default_rng(seed)
+    lat = 40.75 + rng.uniform(0, 0.02, n + 1)
+    lng = -73.99 + rng.uniform(0, 0.02, n + 1)
+    # A random spanning tree keeps the first n nodes connected
+    pairs = {(int(rng.integers(i)), i) for i in range(1, n)}
+    while len(pairs) < n - 1 + extra_edges:
+        a, b = sorted(rng.choice(n, 2, replace=False).tolist())
+        pairs.add((a, b))
+    u, v = np.array(sorted(pairs)).T
+    length = haversine_m(lat[u], lng[u], lat[v], lng[v]) * rng.uniform(1.0, 1.5, len(u))
+    street_risk = rng.uniform(0, 100, len(u))
+
+    # edge_cell carries the street index, so directed edges can find their street
+    graph = CompactGraph.from_edges(np.arange(n + 1), lat, lng, u, v, length, np.arange(len(u)))
+    risk = street_risk[graph.edge_cell.astype(np.int64)]
+
+    G = nx.Graph()
+    G.add_nodes_from((i, {'lat': float(lat[i]), 'lng': float(lng[i])}) for i in range(n + 1))
+    for street, (a, b) in enumerate(zip(u.tolist(), v.tolist())):
+        G.add_edge(a, b, length=float(np.float32(length[street])), risk=float(street_risk[street]))
+    return graph, risk, G
+
+
+def metro_graph(G):
+    """
+    Arrays of a NetworkX graph from random_graph in the layout of
+    WalkGraphStore.metro_graph, with cell as the street index, and the risk per street.
+    """
+    streets = sorted(G.edges(data=True))
+    nodes = sorted(G.nodes(data=True))
+    graph = {
+        'node_id': np.arange(len(nodes), dtype=np.int64),
+        'lat': np.array([data['lat'] for _, data in nodes]),
+        'lng': np.array([data['lng'] for _, data in nodes]),
+        'edge_u': np.array([a for a, _, _ in streets], dtype=np.int64),
+        'edge_v': np.array([b for _, b, _ in streets], dtype=np.int64),
+        'length': np.array([data['length'] for _, _, data in streets], dtype=np.float32),
+        'cell': np.arange(len(streets), dtype=np.uint64),
+    }
+    return graph, np.array([data['risk'] for _, _, data in streets])
+
+
+def nx_weight(alpha):
+    """NetworkX weight function matching length * (1 + risk / 100 * alpha)."""
+    return lambda a, b, data: data['length'] * (1 + data['risk'] / 100.0 * alpha)
+
+
+class EdgeRiskTests(TestCase):
+    def setUp(self):
+        self.lat, self.lng = 40.750, -73.990
+        self.cell = h3.latlng_to_cell(self.lat, self.lng, 9)
+        self.parent = h3.cell_to_parent(self.cell, 7)
+
+    def edge_risk(self):
+        return RoutingService().edge_risk(np.array([h3.str_to_int(self.cell)], dtype=np.uint64), RiskScore.TimeBucket.DAY)
+
+    def test_safety_score_becomes_risk(self):
+        RiskScore.objects.create(h3_id=self.cell, time_bucket=RiskScore.TimeBucket.DAY, score=100, confidence="low")
+        self.assertEqual(self.edge_risk().tolist(), [0.0])
+
+        RiskScore.objects.filter(h3_id=self.cell).update(score=20)
+        self.assertEqual(self.edge_risk().tolist(), [80.0])
+
+    def test_falls_back_to_parent_then_default(self):
+        self.assertEqual(self.edge_risk().tolist(), [DEFAULT_RISK])
+
+        RiskScore.objects.create(h3_id=self.parent, time_bucket=RiskScore.TimeBucket.DAY, score=70, confidence="low")
+        self.assertEqual(self.edge_risk().tolist(), [30.0])
+
+
+@override_settings(ROUTING_CH_ALPHAS=())
+class SaferRouteTests(TestCase):
+    def setUp(self):
+        self.graph = diamond_graph()
+        patcher = mock.patch.object(RoutingService, 'get_graph_for_area', return_value=self.graph)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def route(self, alpha):
+        return RoutingService().calculate_safer_route(40.750, -73.990, 40.760, -73.990, alpha=alpha)
+
+    def test_avoids_low_score_cells(self):
+        # The short way is dangerous (safety score 5), the long way is unscored
+        straight = {h3.int_to_str(int(c)) for c in self.graph.edge_cell[self.graph.targets == 1]}
+        for cell in straight:
+            RiskScore.objects.create(h3_id=cell, time_bucket=RiskScore.TimeBucket.DAY, score=5, confidence="high")
+
+        shortest = self.route(alpha=0.0)
+        safest = self.route(alpha=5.0)
+
+        self.assertNotIn([-73.980, 40.755], shortest["geometry"]["coordinates"])
+        self.assertIn([-73.980, 40.755], safest["geometry"]["coordinates"])
+        self.assertGreater(shortest["properties"]["avg_risk"], 90)
+        self.assertEqual(safest["properties"]["avg_risk"], DEFAULT_RISK)
+        self.assertEqual(safest["properties"]["safety_level"], "High")
+
+
+@override_settings(ROUTING_CH_ALPHAS=())
+class RouteAlternativesTests(SimpleTestCase):
+    def setUp(self):
+        self.graph, way_risk = three_way_graph()
+        patchers = [
+            mock.patch.object(RoutingService, 'get_graph_for_area', return_value=self.graph),
+            mock.patch.object(
+                RoutingService, 'edge_risk',
+                side_effect=lambda edge_cell, time_bucket: way_risk[edge_cell.astype(np.int64)]
+            ),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def alternatives(self, alpha, k=3):
+        return RoutingService().route_alternatives(40.750, -73.990, 40.760, -73.990, alpha=alpha, k=k)
+
+    def stats(self, route):
+        return route["properties"]["distance_meters"], route["properties"]["avg_risk"]
+
+    def assert_pareto(self, routes):
+        for route in routes:
+            for other in routes:
+                if other is not route:
+                    self.assertFalse(
+                        all(a <= b for a, b in zip(self.stats(other), self.stats(route))),
+                        f"{self.stats(route)} is dominated by {self.stats(other)}"
+                    )
+
+    def test_routes_run_from_shortest_to_safest(self):
+        routes = self.alternatives(alpha=0.0)
+
+        # Alpha 0 takes the straight way, 2.5 the middle one, 5 and up the far one
+        self.assertEqual([r["properties"]["alpha"] for r in routes], [0.0, 2.5, 5.0])
+        self.assertEqual([r["properties"]["avg_risk"] for r in routes], [90, 30, 0])
+        distances = [r["properties"]["distance_meters"] for r in routes]
+        self.assertEqual(distances, sorted(distances))
+        self.assertEqual(distances[0], round(2 * haversine_m(40.750, -73.990, 40.755, -73.990)))
+        self.assertIn([-73.970, 40.755], routes[-1]["geometry"]["coordinates"])
+        self.assert_pareto(routes)
+
+    def test_requested_route_comes_first(self):
+        routes = self.alternatives(alpha=5.0)
+
+        self.assertEqual([r["properties"]["alpha"] for r in routes], [5.0, 0.0, 2.5])
+        self.assertEqual([r["properties"]["avg_risk"] for r in routes], [0, 90, 30])
+        self.assert_pareto(routes)
+
+        self.assertEqual(len(self.alternatives(alpha=5.0, k=2)), 2)
+
+    def test_drops_duplicate_and_dominated_routes(self):
+        service = RoutingService()
+
+        def feature(coords, length, risk):
+            return service.route_feature(coords, length, risk * length)
+
+        safe_way = [[-73.990, 40.750], [-73.980, 40.755], [-73.990, 40.760]]
+        found = service.tag_alphas([
+            feature([[-73.990, 40.750], [-73.990, 40.760]], 1000, 80),
+            feature([[-73.990, 40.750], [-73.985, 40.755], [-73.990, 40.760]], 1500, 85),
+            feature(safe_way, 2000, 10),
+            feature(safe_way, 2000, 10),
+        ], [0.0, 1.0, 2.5, 5.0])
+        with mock.patch.object(RoutingService, 'safer_routes', return_value=found):
+            routes = service.route_alternatives(40.750, -73.990, 40.760, -73.990, alpha=0.0, k=4)
+
+        # The detour is longer and riskier than the short way; the safe way is found twice
+        self.assertEqual([self.stats(r) for r in routes], [(1000, 80), (2000, 10)])
+
+
+class WalkGraphBuildTests(SimpleTestCase):
+    def setUp(self):
+        graph_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(graph_dir.cleanup)
+        self.graph_dir = Path(graph_dir.name)
+        settings = override_settings(
+            ROUTING_GRAPH_DIR=self.graph_dir,
+            ROUTING_METROS={"walk_grid": {"pbf": str(WALK_GRID_PBF), "bbox": WALK_GRID_BBOX}}
+        )
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        # Building and routing must work offline
+        no_network = mock.patch.object(socket.socket, "connect", side_effect=OSError("network access in test"))
+        no_network.start()
+        self.addCleanup(no_network.stop)
+
+    def test_builds_walkable_grid_and_routes_over_it(self):
+        nodes, edges = WalkGraphBuilder().build("walk_grid")
+        # 25 grid nodes and 40 blocks; the motorway and private road are left out
+        self.assertEqual((nodes, edges), (25, 40))
+
+        graph = WalkGraphStore().graph_for_bbox(40.762, 40.748, -73.980, -73.992)
+        self.assertEqual(graph.node_count, 25)
+        self.assertEqual(graph.edge_count, 80)
+
+        source = graph.nearest_node(40.750, -73.990)
+        target = graph.nearest_node(40.758, -73.982)
+        nodes, edges = graph.shortest_path(source, target, graph.lengths)
+        self.assertEqual(len(edges), 8)
+
+        blocks = 4 * haversine_m(40.750, -73.990, 40.752, -73.990) + 4 * haversine_m(40.750, -73.990, 40.750, -73.988)
+        self.assertAlmostEqual(float(graph.lengths[edges].sum()), blocks, delta=1.0)
+
+    def test_memory_budget_covers_the_working_set(self):
+        WalkGraphBuilder().build("walk_grid")
+        store = WalkGraphStore()
+        bbox = (40.762, 40.748, -73.980, -73.992)
+        archive = store.archive("walk_grid")
+        tile_bytes = sum(store.tile_bytes(archive, t) for t in archive['tiles'])
+
+        # Room for the tiles alone is not enough to route over them
+        with self.assertRaises(BudgetExceeded):
+            store.graph_for_bbox(*bbox, max_bytes=2 * tile_bytes)
+        graph = store.graph_for_bbox(*bbox, max_bytes=WORKING_SET_FACTOR * tile_bytes)
+        self.assertEqual(graph.node_count, 25)
+
+    def test_rebuilt_archive_replaces_cached_tiles(self):
+        south_half = (-73.995, 40.745, -73.977, 40.7545)
+        with override_settings(ROUTING_METROS={"walk_grid": {"pbf": str(WALK_GRID_PBF), "bbox": south_half}}):
+            WalkGraphBuilder().build("walk_grid")
+        store = WalkGraphStore()
+        # Opens the archive and caches its tiles in this process
+        self.assertEqual(store.graph_for_bbox(40.762, 40.748, -73.980, -73.992).node_count, 15)
+
+        WalkGraphBuilder().build("walk_grid")
+        self.assertEqual(store.graph_for_bbox(40.762, 40.748, -73.980, -73.992).node_count, 25)
+        # Written aside and swapped in
+        self.assertEqual(sorted(p.name for p in self.graph_dir.iterdir()), ["walk_grid.npz"])
+
+
+class BatchScoringTests(TestCase):
+    def setUp(self):
+        self.source = DataSource.objects.create(name="Test", slug="test", type=DataSource.SourceType.CRIME_REPORTS)
+        rng = np.random.default_rng(7)
+        start = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+        self.cells = []
+
+        # (incidents, street light outages, subway entrances, hours incidents happen at)
+        layouts = [
+            (150, 0, 0, range(24)),     # high confidence in both buckets, no 25 floor
+            (8, 3, 1, range(24)),       # medium confidence, both env factors
+            (2, 10, 0, (22, 23, 2)),    # night only, outage penalty capped
+            (1, 0, 5, (12,)),           # one severe incident, subway bonus capped
+        ]
+        incidents, metrics = [], []
+        for i, (count, outages, subways, hours) in enumerate(layouts):
+            lat, lng = 40.70 + 0.01 * i, -73.95
+            h3_id = h3.latlng_to_cell(lat, lng, 9)
+            self.cells.append(h3_id)
+            hours = list(hours)
+            for _ in range(count):
+                incidents.append(IncidentNorm(
+                    source=self.source, category="test", severity=int(rng.choice([20, 40, 80, 100])),
+                    occurred_at=start + timedelta(days=int(rng.integers(0, 300)), hours=hours[int(rng.integers(len(hours)))]),
+                    geom=Point(lng, lat), h3_id=h3_id
+                ))
+            for metric, n in (("street_light_outage", outages), ("subway_entrance", subways)):
+                metrics += [
+                    EnvMetric(source=self.source, metric=metric, value=1.0, ts=start, geom=Point(lng, lat), h3_id=h3_id)
+                    for _ in range(n)
+                ]
+        IncidentNorm.objects.bulk_create(incidents)
+        EnvMetric.objects.bulk_create(metrics)
+
+    def test_matches_per_cell_scorer(self):
+        results = BatchScoringService().score_cells()
+        self.assertEqual(
+            sorted((r['h3_id'], r['time_bucket']) for r in results),
+            sorted((c, b) for c in self.cells for b in RiskScore.TimeBucket.values)
+        )
+
+        # The layouts reach every confidence level
+        self.assertEqual({r['confidence'] for r in results}, {"high", "medium", "low"})
+
+        per_cell = ScoringService()
+        for result in results:
+            with self.subTest(h3_id=result['h3_id'], time_bucket=result['time_bucket']):
+                self.assertEqual(result, per_cell.calculate_score(result['h3_id'], result['time_bucket']))
+
+    def test_scores_only_the_given_cells(self):
+        results = BatchScoringService().score_cells(self.cells[1:2] + ["89283082803ffff"])
+        self.assertEqual({r['h3_id'] for r in results}, {self.cells[1]})
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class RecalculationTests(TestCase):
+    def setUp(self):
+        self.source = DataSource.objects.create(name="Test", slug="test", type=DataSource.SourceType.CRIME_REPORTS)
+        occurred_at = datetime(2026, 1, 1, 12, tzinfo=dt_timezone.utc)
+        # Far enough apart to have different resolution 3 parents
+        self.kept, self.cleared = (h3.latlng_to_cell(lat, -73.99, 9) for lat in (40.75, 45.75))
+        IncidentNorm.objects.bulk_create([
+            IncidentNorm(source=self.source, category="test", severity=80, occurred_at=occurred_at,
+                         geom=Point(-73.99, lat), h3_id=h3_id)
+            for lat, h3_id in ((40.75, self.kept), (45.75, self.cleared))
+        ])
+        calculate_risk_scores()
+        IncidentNorm.objects.filter(h3_id=self.cleared).delete()
+
+    def scored_cells(self):
+        return set(RiskScore.objects.values_list('h3_id', flat=True))
+
+    def test_full_pass_removes_cells_without_incidents(self):
+        calculate_risk_scores()
+        self.assertEqual(
+            self.scored_cells(),
+            {self.kept, *(h3.cell_to_parent(self.kept, level) for level in (6, 5, 4, 3))}
+        )
+
+    def test_sharded_pass_matches_full_pass(self):
+        # More active cells, spread over several shard parents
+        IncidentNorm.objects.bulk_create([
+            IncidentNorm(source=self.source, category="test", severity=40,
+                         occurred_at=datetime(2026, 1, 1, 12, tzinfo=dt_timezone.utc),
+                         geom=Point(lng, lat), h3_id=h3.latlng_to_cell(lat, lng, 9))
+            for lat in (40.6, 40.9, 41.5, 42.5) for lng in (-74.2, -73.8, -73.0)
+        ])
+        active = set(active_cells())
+        shard_count = 4
+
+        run = ScoringRun.objects.create(mode=ScoringRun.Mode.SHARDED, shard_count=shard_count)
+        shards, counts = [], []
+        with mock.patch("safety.calculators.rescore_cells", wraps=rescore_cells) as rescore:
+            for shard in range(shard_count):
+                counts.append(calculate_shard_risk_scores(shard, shard_count))
+                shards.append(set(rescore.call_args.args[0]))
+
+        # Every active cell is in exactly one shard
+        self.assertEqual(sum(len(cells) for cells in shards), len(active))
+        self.assertEqual(set().union(*shards), active)
+        self.assertGreater(sum(1 for cells in shards if cells), 1)
+
+        with mock.patch("safety.tasks.customize_route_hierarchies_task.delay") as customize:
+            finish_scoring_run_task(counts, run.id)
+        customize.assert_called_once_with(run.id)
+
+        sharded = self.scored_cells()
+        self.assertNotIn(self.cleared, sharded)
+        full_count = calculate_risk_scores()
+        self.assertEqual(sharded, self.scored_cells())
+
+        # The chord's shard totals add up to what a full pass scores
+        run.refresh_from_db()
+        self.assertEqual((run.status, run.cells_scored), (ScoringRun.Status.SUCCESS, full_count))
+        self.assertIsNotNone(run.completed_at)
+
+    def test_dirty_pass_matches_full_pass(self):
+        DirtyCell.objects.create(run=IngestRun.objects.create(source=self.source), h3_id=self.cleared)
+        calculate_dirty_risk_scores()
+        dirty = self.scored_cells()
+
+        calculate_risk_scores()
+        self.assertEqual(dirty, self.scored_cells())
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class SnapshotViewTests(TestCase):
+    def test_cached_snapshot_is_stamped_per_response(self):
+        cache.clear()
+        h3_id = h3.latlng_to_cell(40.75, -73.99, 9)
+        RiskScoreWriter().write([{
+            'h3_id': h3_id, 'time_bucket': RiskScore.TimeBucket.DAY, 'score': 70, 'confidence': 'medium',
+            'reasons': [{'factor': 'crime_history', 'impact': 'negative', 'detail': 'Some incidents'}], 'incident_count': 5
+        }])
+        scored_at = RiskScore.objects.get(h3_id=h3_id).updated_at
+        params = {"lat": 40.75, "lng": -73.99, "time": "day"}
+
+        responses = []
+        for hour in (10, 11):
+            with mock.patch("django.utils.timezone.now", return_value=datetime(2026, 10, 17, hour, tzinfo=dt_timezone.utc)):
+                responses.append(self.client.get("/api/safety/snapshot/", params))
+
+        miss, hit = responses
+        self.assertEqual((miss["X-Cache"], hit["X-Cache"]), ("MISS", "HIT"))
+        for response in responses:
+            crime = datetime.fromisoformat(response.json()["evidence"]["crime"]["last_updated"].replace("Z", "+00:00"))
+            self.assertEqual(crime, scored_at)
+        # No alerts or environment data in the cell: stamped when served, not when cached
+        self.assertEqual(miss.json()["evidence"]["environment"]["last_updated"], "2026-10-17T10:00:00Z")
+        self.assertEqual(hit.json()["evidence"]["environment"]["last_updated"], "2026-10-17T11:00:00Z")
+        self.assertEqual(hit.json()["evidence"]["alerts"]["last_updated"], "2026-10-17T11:00:00Z")
+
+
+def tile_for(lat, lng, z):
+    """(x, y) of the XYZ tile containing a point."""
+    n = 2 ** z
+    x = int((lng + 180.0) / 360.0 * n)
+    y = int((1 - np.arcsinh(np.tan(np.radians(lat))) / np.pi) / 2 * n)
+    return x, y
+
+
+def score_cell(h3_id, score=50):
+    """A day RiskScore for a cell, with its hexagon, as the score writer stores it."""
+    return RiskScore.objects.create(
+        h3_id=h3_id, time_bucket=RiskScore.TimeBucket.DAY, resolution=h3.get_resolution(h3_id),
+        score=score, confidence="medium", geometry=h3_to_polygon(h3_id)
+    )
+
+
+class HeatmapTileTests(TestCase):
+    def tile(self, z, x, y):
+        response = self.client.get(f"/api/safety/heatmap/tiles/{z}/{x}/{y}.mvt")
+        if response.status_code == 204:
+            return []
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "application/vnd.mapbox-vector-tile")
+        return mapbox_vector_tile.decode(response.content)[TILE_LAYER_NAME]["features"]
+
+    def test_only_cells_overlapping_the_tile_are_drawn(self):
+        z = 14
+        x, y = tile_for(40.75, -73.99, z)
+        west, south, east, north = tile_bounds(z, x, y)
+        middle_lat, middle_lng = (south + north) / 2, (west + east) / 2
+
+        inside = h3.latlng_to_cell(middle_lat, middle_lng, 9)
+        # Centred on the west edge, so partly in this tile and partly in the next
+        edge = h3.latlng_to_cell(middle_lat, west, 9)
+        beyond = h3.latlng_to_cell(middle_lat, middle_lng + 2 * (east - west), 9)
+        for h3_id in (inside, edge, beyond):
+            score_cell(h3_id)
+
+        features = {f["properties"]["h3_id"]: f for f in self.tile(z, x, y)}
+
+        self.assertEqual(set(features), {inside, edge})
+        self.assertEqual(features[inside]["properties"]["resolution"], 9)
+        self.assertEqual(features[inside]["properties"]["score"], 50)
+        ring = features[inside]["geometry"]["coordinates"][0]
+        self.assertTrue(all(0 <= px <= TILE_EXTENT and 0 <= py <= TILE_EXTENT for px, py in ring))
+        self.assertLess(min(px for px, _ in features[edge]["geometry"]["coordinates"][0]), 0)
+
+        # The far cell is two tiles east, and the edge cell's other half is in the tile west
+        self.assertEqual([f["properties"]["h3_id"] for f in self.tile(z, x + 2, y)], [beyond])
+        self.assertEqual([f["properties"]["h3_id"] for f in self.tile(z, x - 1, y)], [edge])
+
+    def test_zoom_picks_the_pyramid_resolution(self):
+        cell = h3.latlng_to_cell(40.75, -73.99, 9)
+        for resolution in range(3, 10):
+            score_cell(h3.cell_to_parent(cell, resolution))
+
+        # Each band from its lowest zoom, and scored cells all the way in
+        for z, resolutions in [*((min_zoom, resolutions) for min_zoom, resolutions in ZOOM_LEVELS), (16, (7, 9))]:
+            with self.subTest(z=z):
+                features = self.tile(z, *tile_for(40.75, -73.99, z))
+                self.assertEqual(sorted(f["properties"]["resolution"] for f in features), sorted(resolutions))
+
+    def test_empty_and_invalid_tiles(self):
+        self.assertEqual(self.client.get("/api/safety/heatmap/tiles/14/4823/6160.mvt").status_code, 204)
+        self.assertEqual(self.client.get("/api/safety/heatmap/tiles/2/4/0.mvt").status_code, 400)
+
+
+class HeatmapViewTests(TestCase):
+    def setUp(self):
+        # Five cells 0.01 degrees apart going east; lower scores are riskier
+        self.cells = [h3.latlng_to_cell(40.75, -73.99 + 0.01 * i, 9) for i in range(5)]
+        for h3_id, score in zip(self.cells, (40, 10, 30, 10, 20)):
+            score_cell(h3_id, score)
+
+    def heatmap(self, **params):
+        response = self.client.get("/api/safety/heatmap/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def ids(self, body):
+        return [f["properties"]["h3_id"] for f in body["features"]]
+
+    def test_bbox_leaves_out_cells_outside_it(self):
+        body = self.heatmap(bbox="-73.995,40.745,-73.965,40.755")
+
+        self.assertEqual(set(self.ids(body)), set(self.cells[:3]))
+        self.assertEqual(body["features"][0]["geometry"]["type"], "Polygon")
+        self.assertEqual(self.client.get("/api/safety/heatmap/", {"bbox": "1,2,3"}).status_code, 400)
+
+    @override_settings(HEATMAP_MAX_FEATURES=2)
+    def test_capped_at_max_features_riskiest_first(self):
+        body = self.heatmap()
+
+        # The two cells scored 10, tied and in the order they were stored
+        self.assertEqual(self.ids(body), [self.cells[1], self.cells[3]])
+        self.assertEqual(body["meta"], {"count": 2, "max_features": 2, "truncated": True, "next_offset": 2})
+
+    @override_settings(HEATMAP_MAX_FEATURES=2)
+    def test_offset_pages_follow_on_without_overlap(self):
+        pages = [self.heatmap()]
+        while pages[-1]["meta"]["truncated"]:
+            pages.append(self.heatmap(offset=pages[-1]["meta"]["next_offset"]))
+
+        self.assertEqual([self.ids(page) for page in pages], [
+            [self.cells[1], self.cells[3]],
+            [self.cells[4], self.cells[2]],
+            [self.cells[0]],
+        ])
+        self.assertEqual(pages[-1]["meta"]["next_offset"], None)
+        scores = [f["properties"]["score"] for page in pages for f in page["features"]]
+        self.assertEqual(scores, sorted(scores))
+
+        # Paging works within a bbox too
+        east = "-73.975,40.745,-73.945,40.755"
+        first = self.heatmap(bbox=east)
+        self.assertEqual(self.ids(first), [self.cells[3], self.cells[4]])
+        self.assertEqual(self.ids(self.heatmap(bbox=east, offset=first["meta"]["next_offset"])), [self.cells[2]])
+
+
+class RiskScoreWriterTests(TestCase):
+    def result(self, h3_id, score, time_bucket=RiskScore.TimeBucket.DAY):
+        return {
+            'h3_id': h3_id, 'time_bucket': time_bucket, 'score': score,
+            'confidence': 'low', 'reasons': [{'factor': 'crime_history'}], 'incident_count': 3
+        }
+
+    def test_counts_inserted_updated_and_unchanged_rows(self):
+        a = h3.latlng_to_cell(40.75, -73.99, 9)
+        b = h3.latlng_to_cell(40.76, -73.99, 9)
+        # A batch size of 1 makes every result its own batch
+        writer = RiskScoreWriter(batch_size=1)
+
+        first = [self.result(a, 80), self.result(b, 60), self.result(b, 50, RiskScore.TimeBucket.NIGHT)]
+        self.assertEqual(writer.write(first), {'inserted': 3, 'updated': 0, 'unchanged': 0})
+        self.assertEqual(writer.write(first), {'inserted': 0, 'updated': 0, 'unchanged': 3})
+
+        second = [self.result(a, 80), self.result(b, 40), self.result(a, 70, RiskScore.TimeBucket.NIGHT)]
+        self.assertEqual(writer.write(second), {'inserted': 1, 'updated': 1, 'unchanged': 1})
+
+        self.assertEqual(RiskScore.objects.count(), 4)
+        updated = RiskScore.objects.get(h3_id=b, time_bucket=RiskScore.TimeBucket.DAY)
+        self.assertEqual((updated.score, updated.resolution), (40, 9))
+        # Set on insert and kept by the update
+        self.assertIsNotNone(updated.geometry)
+
+    @override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_changed_rows_bump_the_route_score_version(self):
+        h3_id = h3.latlng_to_cell(40.75, -73.99, 9)
+        writer = RiskScoreWriter()
+        cache.clear()
+        self.assertEqual(RouteCache.score_version(), 0)
+
+        # Without a ScoringRun, as bootstrap_states.py writes
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.write([self.result(h3_id, 80)])
+        first = RouteCache.score_version()
+        self.assertNotEqual(first, 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.write([self.result(h3_id, 80)])
+        self.assertEqual(RouteCache.score_version(), first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.write([self.result(h3_id, 60)])
+        self.assertGreater(RouteCache.score_version(), first)
+
+
+@override_settings(CACHES={"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class HierarchyTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        graph_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(graph_dir.cleanup)
+        settings = override_settings(ROUTING_GRAPH_DIR=Path(graph_dir.name))
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+    def build(self, G, metro="random"):
+        """Builds a hierarchy over G. Returns the risk per street, aligned with the hierarchy's edges."""
+        graph, street_risk = metro_graph(G)
+        with mock.patch.object(WalkGraphStore, "metro_graph", return_value=graph):
+            HierarchyBuilder().build(metro)
+        return street_risk
+
+    def customize(self, street_risk, alpha, metro="random"):
+        HierarchyCustomizer().customize(
+            metro, RiskScore.TimeBucket.DAY, alpha, street_risk, score_version=RouteCache.score_version()
+        )
+
+    def assert_route(self, G, found, source, target, alpha):
+        """A route from HierarchyRouter.route walks real streets and matches Dijkstra on G."""
+        nodes, distance, risk = found
+        nodes = nodes.tolist()
+        self.assertEqual((nodes[0], nodes[-1]), (source, target))
+        # Unpacked shortcuts give back streets of G, whose lengths add up to the distance
+        streets = list(zip(nodes, nodes[1:]))
+        self.assertTrue(all(G.has_edge(a, b) for a, b in streets))
+        self.assertAlmostEqual(distance, sum(G.edges[e]['length'] for e in streets), delta=0.05)
+        self.assertAlmostEqual(risk, sum(G.edges[e]['length'] * G.edges[e]['risk'] for e in streets), delta=5.0)
+        self.assertAlmostEqual(
+            sum(nx_weight(alpha)(a, b, G.edges[a, b]) for a, b in streets),
+            nx.shortest_path_length(G, source, target, weight=nx_weight(alpha)),
+            delta=0.01
+        )
+
+    def test_route_and_table_match_dijkstra(self):
+        for seed in range(5):
+            _, _, G = random_graph(seed)
+            street_risk = self.build(G)
+            router = HierarchyRouter("random")
+            isolated = G.number_of_nodes() - 1
+            rng = np.random.default_rng(400 + seed)
+            for alpha in GraphSearchTests.ALPHAS:
+                self.customize(street_risk, alpha)
+                pairs = rng.integers(0, isolated, (10, 2)).tolist()
+                for source, target in pairs:
+                    with self.subTest(seed=seed, alpha=alpha, source=source, target=target):
+                        found = router.route(source, target, RiskScore.TimeBucket.DAY, alpha)
+                        self.assert_route(G, found, source, target, alpha)
+
+                sources = [a for a, _ in pairs] + [0]
+                targets = [b for _, b in pairs] + [isolated]
+                cost, length, risk = router.table(sources, targets, RiskScore.TimeBucket.DAY, alpha)
+                for i, (source, target) in enumerate(pairs):
+                    with self.subTest(seed=seed, alpha=alpha, source=source, target=target, table=True):
+                        self.assertAlmostEqual(
+                            cost[i], nx.shortest_path_length(G, source, target, weight=nx_weight(alpha)), delta=0.01
+                        )
+                        self.assertAlmostEqual(length[i], router.route(source, target, RiskScore.TimeBucket.DAY, alpha)[1], delta=0.05)
+                self.assertEqual((cost[-1], length[-1], risk[-1]), (np.inf, np.inf, np.inf))
+                self.assertIsNone(router.route(0, isolated, RiskScore.TimeBucket.DAY, alpha))
+
+    def test_recustomized_metric_changes_the_route(self):
+        _, _, G = random_graph(1)
+        street_risk = self.build(G)
+        router = HierarchyRouter("random")
+        source, target = 3, 60
+
+        self.customize(np.zeros(len(street_risk)), 5.0)
+        shortest = router.route(source, target, RiskScore.TimeBucket.DAY, 5.0)[0].tolist()
+        self.assertEqual(shortest, nx.shortest_path(G, source, target, weight='length'))
+
+        # Make the streets of that route dangerous and re-customize the same hierarchy
+        on_route = {frozenset(e) for e in zip(shortest, shortest[1:])}
+        risky = np.array([100.0 if frozenset((a, b)) in on_route else 0.0 for a, b in sorted(G.edges())])
+        for a, b in G.edges():
+            G.edges[a, b]['risk'] = 100.0 if frozenset((a, b)) in on_route else 0.0
+        self.customize(risky, 5.0)
+
+        found = router.route(source, target, RiskScore.TimeBucket.DAY, 5.0)
+        self.assertNotEqual(found[0].tolist(), shortest)
+        self.assert_route(G, found, source, target, 5.0)
+
+    def test_metric_from_older_scores_is_skipped(self):
+        _, _, G = random_graph(0)
+        street_risk = self.build(G)
+        self.customize(street_risk, 5.0)
+        router = HierarchyRouter("random")
+        self.assertIsNotNone(router.route(0, 1, RiskScore.TimeBucket.DAY, 5.0))
+
+        # Scores changed and the metric has not been re-customized yet
+        RouteCache.bump_score_version()
+        self.assertIsNone(router.metric(RiskScore.TimeBucket.DAY, 5.0))
+        self.assertIsNone(router.route(0, 1, RiskScore.TimeBucket.DAY, 5.0))
+        self.assertIsNone(router.table([0], [1], RiskScore.TimeBucket.DAY, 5.0))
+
+        self.customize(street_risk, 5.0)
+        self.assertIsNotNone(router.route(0, 1, RiskScore.TimeBucket.DAY, 5.0))
+
+
+class GraphSearchTests(SimpleTestCase):
+    ALPHAS = (0.0, 5.0)
+
+    def assert_path(self, graph, found, source, target):
+        nodes, edges = found
+        self.assertEqual((nodes[0], nodes[-1]), (source, target))
+        # Every edge leads from one path node to the next
+        self.assertEqual(graph.targets[edges].tolist(), nodes[1:].tolist())
+        for node, edge in zip(nodes[:-1].tolist(), edges.tolist()):
+            self.assertTrue(graph.offsets[node] <= edge < graph.offsets[node + 1])
+
+    def test_a_star_matches_dijkstra(self):
+        for seed in range(5):
+            graph, risk, G = random_graph(seed)
+            rng = np.random.default_rng(100 + seed)
+            for alpha in self.ALPHAS:
+                weights = graph.lengths * (1 + risk / 100.0 * alpha)
+                for source, target in rng.integers(0, graph.node_count - 1, (10, 2)).tolist():
+                    with self.subTest(seed=seed, alpha=alpha, source=source, target=target):
+                        found = graph.shortest_path(source, target, weights)
+                        self.assert_path(graph, found, source, target)
+                        self.assertAlmostEqual(
+                            float(weights[found[1]].astype(np.float64).sum()),
+                            nx.dijkstra_path_length(G, source, target, weight=nx_weight(alpha)),
+                            delta=0.01
+                        )
+
+    def test_bidirectional_a_star_matches_dijkstra(self):
+        for seed in range(5):
+            graph, risk, G = random_graph(seed)
+            rng = np.random.default_rng(200 + seed)
+            for alpha in self.ALPHAS:
+                weights = graph.lengths * (1 + risk / 100.0 * alpha)
+                for source, target in rng.integers(0, graph.node_count - 1, (10, 2)).tolist():
+                    with self.subTest(seed=seed, alpha=alpha, source=source, target=target):
+                        found = graph.bidirectional_shortest_path(source, target, weights)
+                        nodes, edges = found
+                        self.assertEqual((nodes[0], nodes[-1]), (source, target))
+                        # Edges found by the reverse search point back along the path,
+                        # so check that each one joins its two path nodes either way
+                        for a, b, edge in zip(nodes[:-1].tolist(), nodes[1:].tolist(), edges.tolist()):
+                            ends = {int(graph.targets[edge]), int(np.searchsorted(graph.offsets, edge, side='right') - 1)}
+                            self.assertEqual(ends, {a, b})
+                        self.assertAlmostEqual(
+                            float(weights[edges].astype(np.float64).sum()),
+                            nx.dijkstra_path_length(G, source, target, weight=nx_weight(alpha)),
+                            delta=0.01
+                        )
+
+    def test_one_to_many_matches_dijkstra(self):
+        for seed in range(5):
+            graph, risk, G = random_graph(seed)
+            isolated = graph.node_count - 1
+            rng = np.random.default_rng(300 + seed)
+            for alpha in self.ALPHAS:
+                weights = graph.lengths * (1 + risk / 100.0 * alpha)
+                source = int(rng.integers(isolated))
+                targets = rng.integers(0, isolated, 12).tolist() + [isolated]
+                with self.subTest(seed=seed, alpha=alpha, source=source):
+                    cost, meters, risk_sum = graph.one_to_many(source, targets, weights, graph.lengths * risk)
+                    costs, paths = nx.single_source_dijkstra(G, source, weight=nx_weight(alpha))
+                    for i, target in enumerate(targets[:-1]):
+                        path = list(zip(paths[target], paths[target][1:]))
+                        self.assertAlmostEqual(cost[i], costs[target], delta=0.01)
+                        self.assertAlmostEqual(meters[i], sum(G.edges[e]['length'] for e in path), delta=0.01)
+                        self.assertAlmostEqual(
+                            risk_sum[i], sum(G.edges[e]['length'] * G.edges[e]['risk'] for e in path), delta=1.0
+                        )
+                    self.assertEqual((cost[-1], meters[-1], risk_sum[-1]), (np.inf, np.inf, np.inf))
+
+    def test_unreachable_target(self):
+        graph, risk, G = random_graph(0)
+        isolated = graph.node_count - 1
+        self.assertIsNone(graph.shortest_path(0, isolated, graph.lengths))
+        self.assertIsNone(graph.bidirectional_shortest_path(0, isolated, graph.lengths))
@@ -3,18 +3,24 @@ from .views import (
     SafetySnapshotView,
     AlertsGeoJSONView,
     CrimeHeatmapView,
+    CrimeHeatmapTileView,
     ContextIncidentsView,
     ContextEnvironmentView,
     ContextAlertsView,
-    SafetyRouteView
+    SafetyRouteView,
+    SafetyRouteMatrixView,
+    CacheStatsView
 )
 
 urlpatterns = [
     path('snapshot/', SafetySnapshotView.as_view(), name='snapshot'),
     path('alerts/', AlertsGeoJSONView.as_view(), name='alerts'),
     path('heatmap/', CrimeHeatmapView.as_view(), name='heatmap'),
+    path('heatmap/tiles/<int:z>/<int:x>/<int:y>.mvt', CrimeHeatmapTileView.as_view(), name='heatmap_tiles'),
     path('context/incidents/', ContextIncidentsView.as_view(), name='context_incidents'),
     path('context/environment/', ContextEnvironmentView.as_view(), name='context_environment'),
     path('context/alerts/', ContextAlertsView.as_view(), name='context_alerts'),
     path('routes/', SafetyRouteView.as_view(), name='routes'),
+    path('routes/matrix/', SafetyRouteMatrixView.as_view(), name='routes_matrix'),
+    path('cache/stats/', CacheStatsView.as_view(), name='cache_stats'),
 ]
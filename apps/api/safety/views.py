@@ -1,16 +1,60 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.fields import DateTimeField
+from django.conf import settings
+from django.http import HttpResponse
 from django.utils import timezone
 from django.contrib.gis.geos import Polygon
 from drf_spectacular.utils import extend_schema
 from .serializers import SafetySnapshotSerializer
 from geo.utils import point_to_h3
-from django.db.models import Count
-from ingest.models import AlertItem, IncidentNorm
+from django.db.models import Count, Max
+from ingest.models import AlertItem, EnvMetric, IncidentNorm
 from safety.models import RiskScore
+from safety.services.response_cache import ResponseCache, RouteCache, ALERT_RING
 import json
 
+def parse_time_bucket(value):
+    """Maps the ?time= parameter to a RiskScore bucket (default day); None if invalid."""
+    if not value:
+        return RiskScore.TimeBucket.DAY
+    if value not in RiskScore.TimeBucket.values:
+        return None
+    return value
+
+def parse_alpha(value):
+    """Risk weighting from a request body (default DEFAULT_ALPHA); None if invalid."""
+    from .services.routing import DEFAULT_ALPHA, MAX_ALPHA
+    if value is None or value == "":
+        return DEFAULT_ALPHA
+    try:
+        alpha = float(value)
+    except (TypeError, ValueError):
+        return None
+    return alpha if 0 <= alpha <= MAX_ALPHA else None
+
+def parse_points(value):
+    """[[lat, lng], ...] from a request body, or None if malformed."""
+    if not isinstance(value, list) or not value:
+        return None
+    try:
+        points = [(float(lat), float(lng)) for lat, lng in value]
+    except (TypeError, ValueError):
+        return None
+    if not all(-90 <= lat <= 90 and -180 <= lng <= 180 for lat, lng in points):
+        return None
+    return points
+
+def stamp_missing_evidence(snapshot):
+    """Copy of a serialized snapshot with evidence that has no data timestamp stamped with the current time."""
+    now = DateTimeField().to_representation(timezone.now())
+    evidence = {
+        name: {**source, "last_updated": source["last_updated"] or now}
+        for name, source in snapshot["evidence"].items()
+    }
+    return {**snapshot, "evidence": evidence}
+
 class SafetySnapshotView(APIView):
     @extend_schema(
         responses=SafetySnapshotSerializer,
@@ -23,18 +67,28 @@ class SafetySnapshotView(APIView):
         except (TypeError, ValueError):
             return Response({"error": "Invalid lat/lng"}, status=status.HTTP_400_BAD_REQUEST)
 
+        time_bucket = parse_time_bucket(request.query_params.get("time"))
+        if time_bucket is None:
+            return Response({"error": "Invalid time (expected day or night)"}, status=status.HTTP_400_BAD_REQUEST)
+
         # 1. Convert to H3 (Try Res 9 first - High Precision NYC)
         h3_id = point_to_h3(lat, lng, resolution=9)
         risk_obj = None
 
-        # 2. Get Real Risk Score
+        cache = ResponseCache("snapshot")
+        cache_key = cache.key(h3_id, 9, {"time": time_bucket})
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return Response(stamp_missing_evidence(cached), headers={"X-Cache": "HIT"})
+
+        # 2. Get Real Risk Score (unique key lookup on h3_id + time_bucket)
         try:
-            risk_obj = RiskScore.objects.filter(h3_id=h3_id).latest('updated_at')
+            risk_obj = RiskScore.objects.get(h3_id=h3_id, time_bucket=time_bucket)
         except RiskScore.DoesNotExist:
             # Fallback: Try Res 7 (National Baseline)
             h3_id_r7 = point_to_h3(lat, lng, resolution=7)
             try:
-                risk_obj = RiskScore.objects.filter(h3_id=h3_id_r7).latest('updated_at')
+                risk_obj = RiskScore.objects.get(h3_id=h3_id_r7, time_bucket=time_bucket)
                 h3_id = h3_id_r7 # Update h3_id reference for alerts lookup below
             except RiskScore.DoesNotExist:
                 pass
@@ -49,9 +103,12 @@ class SafetySnapshotView(APIView):
             # Default reasons
             reasons = [{"factor": "data", "impact": "neutral", "detail": "Region outside of active coverage area"}]
 
-        # 3. Evidence Metadata
+        # 3. Evidence Metadata: when the data behind each part last changed.
+        # Left empty here when there is none, and stamped per response by
+        # stamp_missing_evidence so the cached payload never carries a fixed now()
         latest_alert = AlertItem.objects.filter(h3_id=h3_id).order_by('-published_at').first()
-        alert_ts = latest_alert.published_at if latest_alert else timezone.now()
+        alert_ts = latest_alert.published_at if latest_alert else None
+        env_ts = EnvMetric.objects.filter(h3_id=h3_id).aggregate(latest=Max('ts'))['latest']
 
         data = {
             "score": score,
@@ -63,18 +120,20 @@ class SafetySnapshotView(APIView):
                     "coverage": "live_official"
                 },
                 "crime": {
-                    "last_updated": timezone.now(), # Update this real later
+                    # The score is recomputed whenever the cell's incidents change
+                    "last_updated": risk_obj.updated_at if risk_obj else None,
                     "coverage": "historical_only"
                 },
                 "environment": {
-                    "last_updated": timezone.now(),
+                    "last_updated": env_ts,
                     "coverage": "high_res"
                 }
             }
         }
 
         serializer = SafetySnapshotSerializer(data)
-        return Response(serializer.data)
+        cache.set(cache_key, serializer.data)
+        return Response(stamp_missing_evidence(serializer.data), headers={"X-Cache": "MISS"})
 
 class AlertsGeoJSONView(APIView):
     def get(self, request):
@@ -117,45 +176,101 @@ class CrimeHeatmapView(APIView):
         """
         Returns GeoJSON of RiskScore objects (Hexagons).
         Client should render as fill-extrusion or fill layer.
-        Since we don't store the Polygon in RiskScore, we need to convert H3 to GeoJSON.
-        We'll use h3-py for that.
+        Hexagon boundaries are stored on RiskScore, so PostGIS serializes them.
+        Optional ?zoom= serves the pyramid level for that zoom instead of scored cells,
+        ?bbox=min_lon,min_lat,max_lon,max_lat limits it to the viewport.
+        At most HEATMAP_MAX_FEATURES hexes are returned (riskiest first);
+        meta.truncated / meta.next_offset page through the rest with ?offset=.
         """
-        import h3
+        from django.contrib.gis.db.models.functions import AsGeoJSON
+        from .services.heatmap import HeatmapTileService
+        from .services.pyramid import NATIVE_RESOLUTIONS
 
-        # Get all scores (or filter by bbox if we had it)
-        # For now, just return all.
-        scores = RiskScore.objects.all()
+        time_bucket = parse_time_bucket(request.query_params.get("time"))
+        if time_bucket is None:
+            return Response({"error": "Invalid time (expected day or night)"}, status=status.HTTP_400_BAD_REQUEST)
 
-        features = []
-        for rs in scores:
-             # h3_to_geo_boundary return tuple of (lat, lng)
-             # GeoJSON expects (lng, lat)
-             # h3-py v4 returns (lat, lng) tuples. GeoJSON needs (lng, lat).
-             boundary_lat_lng = h3.cell_to_boundary(rs.h3_id)
-             boundary_lng_lat = [(pt[1], pt[0]) for pt in boundary_lat_lng]
+        resolutions = NATIVE_RESOLUTIONS
+        if request.query_params.get("zoom"):
+            try:
+                resolutions = HeatmapTileService().resolutions_for_zoom(int(request.query_params["zoom"]))
+            except ValueError:
+                return Response({"error": "Invalid zoom"}, status=status.HTTP_400_BAD_REQUEST)
 
-             # Close the polygon ring if not closed
-             if boundary_lng_lat and boundary_lng_lat[0] != boundary_lng_lat[-1]:
-                 boundary_lng_lat.append(boundary_lng_lat[0])
+        try:
+            offset = max(0, int(request.query_params.get("offset", 0)))
+        except ValueError:
+            return Response({"error": "Invalid offset"}, status=status.HTTP_400_BAD_REQUEST)
+
+        scores = RiskScore.objects.filter(
+            time_bucket=time_bucket,
+            resolution__in=resolutions,
+            geometry__isnull=False
+        )
+
+        bbox_param = request.query_params.get('bbox')
+        if bbox_param:
+            try:
+                min_lon, min_lat, max_lon, max_lat = map(float, bbox_param.split(','))
+            except ValueError:
+                return Response({"error": "Invalid bbox"}, status=status.HTTP_400_BAD_REQUEST)
+            bbox = Polygon.from_bbox((min_lon, min_lat, max_lon, max_lat))
+            bbox.srid = 4326
+            # GiST index lookup on the stored hexagons
+            scores = scores.filter(geometry__bboverlaps=bbox)
+
+        # Fetch one past the budget to know whether there is more
+        budget = settings.HEATMAP_MAX_FEATURES
+        scores = scores.order_by('score', 'id') \
+                       .annotate(geojson=AsGeoJSON('geometry')) \
+                       .values_list('h3_id', 'score', 'confidence', 'geojson')[offset:offset + budget + 1]
+        scores = list(scores)
+        truncated = len(scores) > budget
 
+        features = []
+        for h3_id, score, confidence, geojson in scores[:budget]:
              features.append({
                  "type": "Feature",
-                 "geometry": {
-                     "type": "Polygon",
-                     "coordinates": [boundary_lng_lat]
-                 },
+                 "geometry": json.loads(geojson),
                  "properties": {
-                     "h3_id": rs.h3_id,
-                     "score": rs.score,
-                     "confidence": rs.confidence
+                     "h3_id": h3_id,
+                     "score": score,
+                     "confidence": confidence
                  }
              })
 
         return Response({
             "type": "FeatureCollection",
-            "features": features
+            "features": features,
+            "meta": {
+                "count": len(features),
+                "max_features": budget,
+                "truncated": truncated,
+                "next_offset": offset + budget if truncated else None
+            }
         })
 
+class CrimeHeatmapTileView(APIView):
+    """
+    Returns RiskScore hexagons for one XYZ tile as a Mapbox Vector Tile
+    (layer "risk"). The H3 resolution drawn depends on the zoom level.
+    """
+    def get(self, request, z, x, y):
+        if z > 22 or not (0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return Response({"error": "Invalid tile"}, status=status.HTTP_400_BAD_REQUEST)
+
+        time_bucket = parse_time_bucket(request.query_params.get("time"))
+        if time_bucket is None:
+            return Response({"error": "Invalid time (expected day or night)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        from .services.heatmap import HeatmapTileService
+        tile = HeatmapTileService().render_tile(z, x, y, time_bucket=time_bucket)
+
+        if tile is None:
+            return HttpResponse(status=status.HTTP_204_NO_CONTENT)
+
+        return HttpResponse(tile, content_type="application/vnd.mapbox-vector-tile")
+
 class ContextIncidentsView(APIView):
     """
     Returns aggregated incident data for the 'Incidents' dashboard tab.
@@ -174,6 +289,12 @@ class ContextIncidentsView(APIView):
         # Try High Res (9) first - e.g. for NYC
         h3_id = point_to_h3(lat, lng, resolution=9)
 
+        cache = ResponseCache("context_incidents")
+        cache_key = cache.key(h3_id, 9, {"days": days})
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return Response(cached, headers={"X-Cache": "HIT"})
+
         # Check if we have high-res data here
         # Optimization: Just check if ANY incidents exist for this hex
         if not IncidentNorm.objects.filter(h3_id=h3_id).exists():
@@ -250,11 +371,13 @@ class ContextIncidentsView(APIView):
             "coverage": coverage_label
         }
 
-        return Response({
+        data = {
             "mix": mix_data,
             "trend": trend_data,
             "meta": meta
-        })
+        }
+        cache.set(cache_key, data)
+        return Response(data, headers={"X-Cache": "MISS"})
 
 class ContextEnvironmentView(APIView):
     """
@@ -347,9 +470,15 @@ class ContextAlertsView(APIView):
 
         h3_id = point_to_h3(lat, lng)
 
+        cache = ResponseCache("context_alerts")
+        cache_key = cache.key(h3_id, 9)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return Response(cached, headers={"X-Cache": "HIT"})
+
         # Get alerts with spatial radius (k=5 ~ 2.5km radius at Res 9)
         import h3
-        neighbor_ids = h3.grid_disk(h3_id, 5)
+        neighbor_ids = h3.grid_disk(h3_id, ALERT_RING)
 
         alerts = AlertItem.objects.filter(h3_id__in=neighbor_ids).select_related('source').order_by('-published_at')
 
@@ -367,17 +496,38 @@ class ContextAlertsView(APIView):
                 "url": a.url
             })
 
-        return Response({
+        response = {
             "alerts": data,
             "meta": {
                 "count": len(data),
                 "disclaimer": "Alerts from verified municipal agencies."
             }
+        }
+        cache.set(cache_key, response)
+        return Response(response, headers={"X-Cache": "MISS"})
+
+class CacheStatsView(APIView):
+    """
+    Hit and miss counters of the snapshot, context and route response caches, plus
+    memory use and evictions of the routing tile cache in the worker that
+    serves the request.
+    """
+    def get(self, request):
+        from .services.graph_store import WalkGraphStore
+        return Response({
+            "endpoints": ResponseCache.stats(),
+            "graph_tiles": WalkGraphStore.cache_stats()
         })
+
 class SafetyRouteView(APIView):
     """
     Calculates a route prioritizing safety context.
-    POST body: { start_lat, start_lng, end_lat, end_lng }
+    POST body: { start_lat, start_lng, end_lat, end_lng, time?, alpha?, alternatives? }
+    alpha weighs risk against distance (0 = shortest). With alternatives > 1
+    the response is a FeatureCollection of up to that many routes along the
+    distance / risk trade-off, the one for alpha first.
+    Responses are cached per snapped end nodes and options until the next
+    scoring run; "cache" in the response says whether this one was.
     """
     def post(self, request):
         print(f"DEBUG: SafetyRouteView POST received. Data: {request.data}", flush=True)
@@ -389,11 +539,125 @@ class SafetyRouteView(APIView):
         except (TypeError, ValueError):
             return Response({"error": "Invalid coordinates"}, status=status.HTTP_400_BAD_REQUEST)
 
-        from .services.routing import RoutingService
+        time_bucket = parse_time_bucket(request.data.get("time"))
+        if time_bucket is None:
+            return Response({"error": "Invalid time (expected day or night)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        alpha = parse_alpha(request.data.get("alpha"))
+        if alpha is None:
+            return Response({"error": "Invalid alpha"}, status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            alternatives = int(request.data.get("alternatives") or 1)
+        except (TypeError, ValueError):
+            alternatives = 0
+        if not 1 <= alternatives <= settings.ROUTING_MAX_ALTERNATIVES:
+            return Response(
+                {"error": f"alternatives must be between 1 and {settings.ROUTING_MAX_ALTERNATIVES}"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        from .services.routing import BudgetExceeded, RoutingService
         service = RoutingService()
-        result = service.calculate_safer_route(start_lat, start_lng, end_lat, end_lng)
+
+        # Cache lookup by snapped nodes: a hit never loads a routing graph
+        cache = RouteCache()
+        score_version = RouteCache.score_version()
+        ends = service.snap_endpoints(start_lat, start_lng, end_lat, end_lng)
+        key = None
+        if ends:
+            key = cache.route_key(*ends, time_bucket, score_version, {"alpha": alpha, "alternatives": alternatives})
+            cached = cache.get(key)
+            if cached is not None:
+                meta = {"hit": True, "score_version": score_version, "computed_at": cached["computed_at"]}
+                return Response({**cached["route"], "cache": meta}, headers={"X-Cache": "HIT"})
+
+        try:
+            if alternatives > 1:
+                routes = service.route_alternatives(
+                    start_lat, start_lng, end_lat, end_lng,
+                    time_bucket=time_bucket, alpha=alpha, k=alternatives
+                )
+                result = {"type": "FeatureCollection", "features": routes} if routes else None
+            else:
+                result = service.calculate_safer_route(
+                    start_lat, start_lng, end_lat, end_lng, time_bucket=time_bucket, alpha=alpha
+                )
+        except BudgetExceeded as e:
+            return Response({"error": f"Route too long: {e}"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
 
         if not result:
             return Response({"error": "Could not find a route"}, status=status.HTTP_404_NOT_FOUND)
 
-        return Response(result)
+        computed_at = timezone.now().isoformat()
+        if key:
+            cache.set(key, {"route": result, "computed_at": computed_at})
+        meta = {"hit": False, "score_version": score_version, "computed_at": computed_at}
+        return Response({**result, "cache": meta}, headers={"X-Cache": "MISS"})
+
+class SafetyRouteMatrixView(APIView):
+    """
+    Safer-route distances for many origin/destination pairs in one request,
+    sharing the graph, risk lookup and searches between them.
+    POST body: { origins: [[lat, lng], ...], destinations: [[lat, lng], ...],
+                 pairs?: [[origin index, destination index], ...], time?, alpha? }
+    Without pairs every origin is routed to every destination and results
+    are origins x destinations matrices; with pairs they are lists aligned
+    with pairs. Unreachable entries are null.
+    """
+    def post(self, request):
+        origins = parse_points(request.data.get("origins"))
+        destinations = parse_points(request.data.get("destinations"))
+        if origins is None or destinations is None:
+            return Response(
+                {"error": "origins and destinations must be non-empty lists of [lat, lng]"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        pairs = request.data.get("pairs")
+        matrix = pairs is None
+        if matrix:
+            pairs = [(o, d) for o in range(len(origins)) for d in range(len(destinations))]
+        else:
+            try:
+                pairs = [(int(o), int(d)) for o, d in pairs]
+            except (TypeError, ValueError):
+                pairs = None
+            if not pairs or not all(0 <= o < len(origins) and 0 <= d < len(destinations) for o, d in pairs):
+                return Response(
+                    {"error": "pairs must be a non-empty list of [origin index, destination index]"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+        if len(pairs) > settings.ROUTING_MATRIX_MAX_PAIRS:
+            return Response(
+                {"error": f"At most {settings.ROUTING_MATRIX_MAX_PAIRS} origin/destination pairs per request"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        time_bucket = parse_time_bucket(request.data.get("time"))
+        if time_bucket is None:
+            return Response({"error": "Invalid time (expected day or night)"}, status=status.HTTP_400_BAD_REQUEST)
+
+        alpha = parse_alpha(request.data.get("alpha"))
+        if alpha is None:
+            return Response({"error": "Invalid alpha"}, status=status.HTTP_400_BAD_REQUEST)
+
+        from .services.routing import BudgetExceeded, RoutingService
+        try:
+            result = RoutingService().route_matrix(origins, destinations, pairs, time_bucket=time_bucket, alpha=alpha)
+        except BudgetExceeded as e:
+            return Response({"error": f"Routes too long: {e}"}, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+
+        if result is None:
+            return Response({"error": "No routing graph covers these points"}, status=status.HTTP_404_NOT_FOUND)
+
+        if matrix:
+            width = len(destinations)
+            result = {
+                name: [values[i:i + width] for i in range(0, len(values), width)]
+                for name, values in result.items()
+            }
+            return Response({"origins": len(origins), "destinations": width, **result})
+
+        return Response({"pairs": pairs, **result})
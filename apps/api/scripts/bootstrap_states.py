@@ -71,8 +71,9 @@ def bootstrap():
             print(f"  [X] Failed: {e}")
 
         # 1.5 Calculate Scores (CRITICAL for Heatmap Visibility)
-        from safety.models import RiskScore
-        from safety.services.scoring import ScoringService
+        from safety.services.scoring import BatchScoringService
+        from safety.services.score_writer import RiskScoreWriter
+        from safety.services.pyramid import ScorePyramidBuilder
         from ingest.models import IncidentNorm
 
         print(f"  [i] Computing Risk Scores for {slug}...")
@@ -80,25 +81,12 @@ def bootstrap():
         source_obj = DataSource.objects.get(slug=slug)
         h3_ids = IncidentNorm.objects.filter(source=source_obj).values_list('h3_id', flat=True).distinct()
 
-        scorer = ScoringService()
-        score_objs = []
-
-        # Batch create scores
-        for h3_id in h3_ids:
-            res = scorer.calculate_score(h3_id)
-            score_objs.append(RiskScore(
-                h3_id=h3_id,
-                score=res['score'],
-                confidence=res['confidence'],
-                reasons_json=res['reasons']
-            ))
-
-        # Bulk create/update? RiskScore doesn't have unique constraint on h3_id in model def shown?
-        # Actually standard Django model has id. We should probably delete old scores for these H3s first or update.
-        # For demo speed: Delete old scores for these hexes and re-insert.
-        RiskScore.objects.filter(h3_id__in=h3_ids).delete()
-        RiskScore.objects.bulk_create(score_objs, batch_size=1000)
-        print(f"  -> Generated {len(score_objs)} RiskScore tiles.")
+        # Upsert in place so existing tiles keep their score until replaced
+        results = BatchScoringService().score_cells(h3_ids)
+        stats = RiskScoreWriter().write(results)
+        print(f"  -> RiskScore tiles: {stats['inserted']} inserted, {stats['updated']} updated, {stats['unchanged']} unchanged.")
+        pyramid_rows = ScorePyramidBuilder().build(h3_ids)
+        print(f"  -> Rolled up {pyramid_rows} pyramid tiles.")
 
         # 2. Alerts (NWS)
         slug_alerts = f"us-{state.lower()}-alerts"
@@ -124,6 +112,11 @@ def bootstrap():
              # NWS might timeout or have no alerts, just log
              print(f"  [!] Alert Ingest Log: {e}")
 
+    # Routing hierarchies ignore metrics customized before these score writes
+    from safety.services.hierarchy import HierarchyCustomizer
+    metrics = HierarchyCustomizer().customize_all()
+    print(f"Customized {metrics} routing hierarchy metrics.")
+
     print("Bootstrap complete.")
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import os
+import sys
+import django
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    django.setup()
+
+from django.conf import settings
+from safety.services.graph_store import WalkGraphBuilder
+from safety.services.hierarchy import HierarchyBuilder, HierarchyCustomizer
+
+# Usage: python scripts/build_walk_graphs.py [--hierarchy] [metro ...]
+# Builds every metro in ROUTING_METROS when none are given.
+# --hierarchy also builds a contraction hierarchy for fast metro-wide routing
+# and customizes it with the current risk scores.
+# Download extracts first, e.g. https://download.geofabrik.de/north-america/us/new-york-latest.osm.pbf
+
+def build(metros, hierarchy=False):
+    builder = WalkGraphBuilder()
+    for metro in metros:
+        if metro not in settings.ROUTING_METROS:
+            print(f"  [X] Unknown metro {metro} (known: {', '.join(settings.ROUTING_METROS)})")
+            continue
+
+        pbf = settings.ROUTING_METROS[metro]['pbf']
+        if not os.path.exists(pbf):
+            print(f"  [X] {metro}: PBF extract not found at {pbf}")
+            continue
+
+        print(f"Building walking graph for {metro} from {pbf}...")
+        nodes, edges = builder.build(metro)
+        print(f"  -> {nodes} nodes, {edges} edges")
+
+        if hierarchy:
+            print(f"Building contraction hierarchy for {metro}...")
+            nodes, arcs, triangles = HierarchyBuilder().build(metro)
+            print(f"  -> {arcs} arcs, {triangles} triangles")
+
+    if hierarchy:
+        print("Customizing hierarchies with current risk scores...")
+        print(f"  -> {HierarchyCustomizer().customize_all()} metrics written")
+
+    print("Done.")
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    hierarchy = '--hierarchy' in args
+    metros = [a for a in args if a != '--hierarchy']
+    build(metros or list(settings.ROUTING_METROS), hierarchy=hierarchy)